@@ -0,0 +1,948 @@
+"""
+AI服务 - 调用外部大模型接口进行对话和房价趋势分析
+
+上游调用全部使用 httpx.AsyncClient 异步进行并保持长连接，避免每次请求重新进行TCP+TLS握手。
+流式调用向上游请求 stream 模式，逐段产出生成的文本，供接口以SSE转发给前端。
+趋势分析结果按 (提示词, 模型, 数据集版本) 缓存在SQLite中，数据更新前重复分析不再调用接口。
+同时进行的相同请求合并为一次上游调用，上游并发数由信号量限制，排队时间计入统计。
+接口地址、密钥和模型可通过环境变量配置；离线模式下连接本地模拟服务（backend/mock_llm_server.py）。
+上游连续失败或响应过慢时熔断器打开，期间不再等待上游，趋势分析改为基于统计数据的模板分析。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import pandas as pd
+
+from backend.database import db_pool
+
+# 离线模式：不访问外网，改用本地模拟大模型服务
+AI_OFFLINE = os.environ.get("HOUSING_AI_OFFLINE", "0") == "1"
+
+
+def _default_api_url() -> str:
+    if AI_OFFLINE:
+        from backend.mock_llm_server import MOCK_LLM_HOST, MOCK_LLM_PORT
+        return f"http://{MOCK_LLM_HOST}:{MOCK_LLM_PORT}/v1/chat/completions"
+    return "https://chat3.eqing.tech/v1/chat/completions"
+
+
+# 接口地址、密钥和模型
+AI_API_URL = os.environ.get("HOUSING_AI_API_URL") or _default_api_url()
+AI_API_KEY = os.environ.get("HOUSING_AI_API_KEY", "MDc3YWI0YjUtMDdlYi00Y2Y3LTgzMTAtZTA4OGQ5NTBkOGFh")
+AI_MODEL = os.environ.get("HOUSING_AI_MODEL", "gpt-3.5-turbo")
+
+# 连接池大小与超时（秒）
+AI_POOL_SIZE = int(os.environ.get("HOUSING_AI_POOL_SIZE", "20"))
+AI_CONNECT_TIMEOUT = float(os.environ.get("HOUSING_AI_CONNECT_TIMEOUT", "5"))
+AI_READ_TIMEOUT = float(os.environ.get("HOUSING_AI_READ_TIMEOUT", "30"))
+
+# 趋势分析缓存开关和最多保存的分析条数
+AI_CACHE_ENABLED = os.environ.get("HOUSING_AI_CACHE_ENABLED", "1") == "1"
+AI_CACHE_MAX_ENTRIES = int(os.environ.get("HOUSING_AI_CACHE_MAX_ENTRIES", "1000"))
+# 同时进行的上游请求数上限，以及排队等待的最长时间（秒）
+AI_MAX_CONCURRENCY = max(1, int(os.environ.get("HOUSING_AI_MAX_CONCURRENCY", "8")))
+AI_QUEUE_TIMEOUT = float(os.environ.get("HOUSING_AI_QUEUE_TIMEOUT", "30"))
+# 批量分析城市各区域时，单个批次同时进行的分析数
+AI_BATCH_CONCURRENCY = max(1, int(os.environ.get("HOUSING_AI_BATCH_CONCURRENCY", "4")))
+# 连接失败或上游返回 429/5xx 时的重试次数和首次退避时间（秒），之后每次翻倍并加随机抖动。
+# 读取超时不重试：已经等待了完整的超时时间，重试只会让调用方等得更久
+AI_MAX_RETRIES = max(0, int(os.environ.get("HOUSING_AI_MAX_RETRIES", "2")))
+AI_RETRY_BACKOFF = float(os.environ.get("HOUSING_AI_RETRY_BACKOFF", "0.5"))
+AI_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 熔断：连续失败次数阈值、视为失败的慢响应耗时（秒）和打开后的冷却时间（秒）
+AI_BREAKER_FAILURE_THRESHOLD = max(1, int(os.environ.get("HOUSING_AI_BREAKER_FAILURES", "5")))
+AI_BREAKER_SLOW_SECONDS = float(os.environ.get("HOUSING_AI_BREAKER_SLOW_SECONDS", "15"))
+AI_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("HOUSING_AI_BREAKER_COOLDOWN_SECONDS", "30"))
+
+ASSISTANT_SYSTEM_PROMPT = "你是专业的房地产智能助手，请用中文简明回答用户问题。"
+
+
+class AIAnalysisCache:
+    """
+    AI趋势分析的持久缓存。相同的提示词、模型和数据集版本得到的分析直接从SQLite返回，
+    超出条数上限时淘汰最久未命中的记录。数据库不可用时视为未命中，不影响分析本身。
+    """
+
+    def __init__(self, max_entries: int = AI_CACHE_MAX_ENTRIES, enabled: bool = AI_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(system_prompt: str, user_prompt: str, model: str, dataset_version: str) -> str:
+        material = json.dumps([model, dataset_version, system_prompt, user_prompt], ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        try:
+            with db_pool.transaction() as conn:
+                row = conn.execute(
+                    "SELECT response FROM ai_analysis_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE ai_analysis_cache SET hits = hits + 1, last_hit_at = ? WHERE cache_key = ?",
+                        (time.time(), key)
+                    )
+        except sqlite3.Error as e:
+            print(f"⚠️ 读取AI分析缓存失败: {e}")
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row["response"])
+
+    def put(self, key: str, location: str, dataset_version: str, result: Dict[str, Any]):
+        """保存一次成功的分析（只保存文本和模型信息，基础统计每次重新计算）"""
+        if not self.enabled:
+            return
+        response = {
+            "text": result["text"],
+            "model_used": result.get("model_used", AI_MODEL),
+            "tokens_used": result.get("tokens_used", 0),
+        }
+        now = time.time()
+        try:
+            with db_pool.transaction() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO ai_analysis_cache
+                        (cache_key, location, model, dataset_version, response, created_at, last_hit_at, hits)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                """, (key, location, response["model_used"], dataset_version,
+                      json.dumps(response, ensure_ascii=False), now, now))
+                evicted = conn.execute("""
+                    DELETE FROM ai_analysis_cache WHERE cache_key IN (
+                        SELECT cache_key FROM ai_analysis_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,)).rowcount
+        except sqlite3.Error as e:
+            print(f"⚠️ 写入AI分析缓存失败: {e}")
+            return
+
+        with self._lock:
+            self.stores += 1
+            self.evicted += evicted
+
+    def clear(self) -> int:
+        with db_pool.transaction() as conn:
+            return conn.execute("DELETE FROM ai_analysis_cache").rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "stores": self.stores,
+                "evicted": self.evicted,
+            }
+
+
+class AIServiceBusy(Exception):
+    """上游并发槽位排队超时"""
+
+
+class AICallLimiter:
+    """
+    上游AI请求的并发限制：所有上游调用（都在事件循环中异步进行）共用 max_concurrency 个槽位，
+    排队时间、在途请求数和峰值计入统计。
+    """
+
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY, queue_timeout: float = AI_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        # asyncio 信号量在首次使用时创建，绑定到运行中的事件循环
+        self._async_semaphore = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _begin_wait(self):
+        with self._lock:
+            self.waiting += 1
+
+    def _end_wait(self, waited: float, acquired: bool):
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.timeouts += 1
+                return
+            self.acquired += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot_async(self):
+        if self._async_semaphore is None:
+            self._async_semaphore = asyncio.Semaphore(self.max_concurrency)
+        started = time.perf_counter()
+        acquired = False
+        self._begin_wait()
+        try:
+            await asyncio.wait_for(self._async_semaphore.acquire(), self.queue_timeout)
+            acquired = True
+        except asyncio.TimeoutError:
+            raise AIServiceBusy("AI服务繁忙，请稍后重试")
+        finally:
+            self._end_wait(time.perf_counter() - started, acquired)
+        try:
+            yield
+        finally:
+            self._async_semaphore.release()
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "waiting": self.waiting,
+                "acquired": self.acquired,
+                "queue_timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 2) if self.acquired else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+            }
+
+
+class AICircuitBreaker:
+    """
+    上游AI接口的熔断器。
+    closed: 正常放行；连续 failure_threshold 次失败（错误或耗时超过 slow_seconds）后转为 open。
+    open: 直接拒绝，冷却 cooldown_seconds 后转为 half_open。
+    half_open: 只放行一个探测请求，成功则恢复 closed，失败则重新 open。
+    """
+
+    def __init__(self, failure_threshold: int = AI_BREAKER_FAILURE_THRESHOLD,
+                 slow_seconds: float = AI_BREAKER_SLOW_SECONDS,
+                 cooldown_seconds: float = AI_BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.slow_seconds = slow_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened_count = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.time() - self.opened_at >= self.cooldown_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success: bool, elapsed: float):
+        with self._lock:
+            self._probe_in_flight = False
+            if success and elapsed <= self.slow_seconds:
+                self.consecutive_failures = 0
+                if self.state != "closed":
+                    print(f"✅ AI服务已恢复，熔断器关闭")
+                self.state = "closed"
+                return
+
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened_count += 1
+                    print(f"⚠️ AI服务连续失败 {self.consecutive_failures} 次，熔断 {self.cooldown_seconds:.0f} 秒")
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def release(self):
+        """请求未真正发出（如本地排队超时），不计入成功或失败"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "slow_seconds": self.slow_seconds,
+                "cooldown_seconds": self.cooldown_seconds,
+                "opened_count": self.opened_count,
+                "rejected": self.rejected,
+                "retry_in_seconds": max(0.0, round(self.opened_at + self.cooldown_seconds - time.time(), 1))
+                if self.state == "open" else 0.0,
+            }
+
+
+def build_fallback_analysis(location: str, basic_stats: Dict[str, Any]) -> str:
+    """AI服务不可用时，根据基础统计生成模板化的趋势分析"""
+    current = basic_stats.get("current_price")
+    average = basic_stats.get("average_price")
+    change_pct = basic_stats.get("price_change_percentage") or 0.0
+    price_range = basic_stats.get("price_range") or {}
+    low, high = price_range.get("min"), price_range.get("max")
+
+    if change_pct > 3:
+        trend = "上涨"
+        advice = ["上涨阶段避免追高，优先考虑刚需和长期持有", "关注成交量能否持续放大", "控制贷款杠杆，预留还款缓冲"]
+    elif change_pct < -3:
+        trend = "下跌"
+        advice = ["下跌阶段不急于入市，等待价格企稳信号", "自住需求可关注议价空间较大的房源", "谨慎评估持有物业的处置时机"]
+    else:
+        trend = "平稳"
+        advice = ["价格平稳期适合按自身需求从容选择", "优先考虑配套成熟、流动性好的地段", "分批决策，避免一次性重仓"]
+
+    lines = [
+        f"**{location}房价趋势分析**（AI服务暂时不可用，以下为基于统计数据自动生成的分析）",
+        "",
+        f"1. 趋势判断：近{basic_stats.get('sample_count', 0)}个月价格变化 {change_pct:+.1f}%，整体呈**{trend}**态势。",
+    ]
+    if current and average:
+        diff_pct = (current - average) / average * 100
+        level = "高于" if diff_pct > 0 else "低于" if diff_pct < 0 else "持平于"
+        position = ""
+        if low is not None and high is not None and high > low:
+            position = f"，处于近期区间（{low:.0f}-{high:.0f}元/㎡）的 {(current - low) / (high - low) * 100:.0f}% 分位"
+        lines.append(f"2. 价格水平：当前 {current:.0f}元/㎡，{level}近期均价（{average:.0f}元/㎡）{abs(diff_pct):.1f}%{position}。")
+    lines.append("3. 投资建议：")
+    lines.extend(f"   - {item}" for item in advice)
+    lines.append("4. 风险提示：以上内容由统计规则生成，未结合政策、供需等因素，仅供参考。")
+    return "\n".join(lines)
+
+
+class _UpstreamTimer:
+    """
+    最近一次上游HTTP请求的耗时，供熔断器判断是否过慢。
+    只在拿到并发槽位后开始计时，并且每次重试重新计时，本地排队和重试退避的等待不算作上游慢。
+    """
+
+    def __init__(self):
+        self._started = None
+        self._stopped = None
+
+    @contextmanager
+    def attempt(self):
+        self._started, self._stopped = time.perf_counter(), None
+        try:
+            yield
+        finally:
+            self._stopped = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        """请求未发出时为0；请求仍在进行（如流式响应中）时为到目前为止的耗时"""
+        if self._started is None:
+            return 0.0
+        return (self._stopped or time.perf_counter()) - self._started
+
+
+class _StreamBroadcast:
+    """一次上游流式调用的事件广播：后加入的订阅者先回放已收到的事件，再等待新事件"""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.task = None  # 读取上游的任务，保持引用直到流结束
+        self._condition = asyncio.Condition()
+
+    async def publish(self, event: Optional[Dict[str, Any]] = None, finished: bool = False):
+        async with self._condition:
+            if event is not None:
+                self.events.append(event)
+            self.finished = self.finished or finished
+            self._condition.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        index = 0
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: index < len(self.events) or self.finished)
+                pending = self.events[index:]
+                finished = self.finished
+            index += len(pending)
+            for event in pending:
+                yield event
+            if finished and index >= len(self.events):
+                return
+
+
+class AIService:
+    def __init__(self, api_key: str = None, api_url: str = None):
+        self.api_key = api_key or AI_API_KEY
+        self.api_url = api_url or AI_API_URL
+
+        if not self.api_key:
+            raise ValueError("AI API密钥未设置")
+
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+        # 异步客户端在首次使用时创建（需要运行中的事件循环）
+        self._async_client = None
+
+        self.cache = AIAnalysisCache()
+
+        # 上游并发限制，以及正在进行的请求（相同请求合并为一次上游调用）
+        self.limiter = AICallLimiter()
+        self.breaker = AICircuitBreaker()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._inflight_streams: Dict[str, _StreamBroadcast] = {}
+        self.coalesced = 0
+        self.coalesced_streams = 0
+        self.retries = 0
+
+    def _get_async_client(self):
+        if self._async_client is None:
+            import httpx
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(AI_READ_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=AI_POOL_SIZE, max_keepalive_connections=AI_POOL_SIZE),
+            )
+        return self._async_client
+
+    async def aclose(self):
+        """关闭连接池（应用关闭时调用）"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    @staticmethod
+    def _build_payload(prompt: str, system_prompt: str = None, temperature: float = 0.3,
+                       stream: bool = False) -> Dict[str, Any]:
+        messages = []
+
+        # 添加系统提示
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+
+        # 添加用户消息
+        messages.append({
+            "role": "user",
+            "content": prompt
+        })
+
+        return {
+            "model": AI_MODEL,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": 1500,  # 减少token数量避免超限
+            "stream": stream
+        }
+
+    def _retry_delay(self, attempt: int, reason: str) -> float:
+        """第 attempt 次重试前的等待时间（指数退避加抖动）"""
+        self.retries += 1
+        delay = AI_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.0)
+        print(f"🔁 {reason}，{delay:.2f} 秒后重试 ({attempt + 1}/{AI_MAX_RETRIES})")
+        return delay
+
+    @staticmethod
+    def _parse_completion(status_code: int, text: str, result_loader) -> Dict[str, Any]:
+        """把接口响应转换为统一的结果字典"""
+        print(f"📊 API响应状态: {status_code}")
+
+        if status_code != 200:
+            print(f"❌ API错误响应: {text}")
+            return {"error": f"API调用失败: {status_code} - {text}"}
+
+        result = result_loader()
+        print(f"✅ API调用成功")
+
+        # 提取AI回复内容
+        if "choices" in result and len(result["choices"]) > 0:
+            content = result["choices"][0]["message"]["content"]
+
+            # 直接返回文本内容，不要尝试解析JSON
+            return {
+                "text": content,
+                "raw_response": True,
+                "model_used": result.get("model", AI_MODEL),
+                "tokens_used": result.get("usage", {}).get("total_tokens", 0)
+            }
+        else:
+            print(f"❌ API返回格式异常: {result}")
+            return {"error": "API返回格式异常"}
+
+    @staticmethod
+    def _circuit_open_result() -> Dict[str, Any]:
+        print(f"⚡ AI服务熔断中，跳过上游调用")
+        return {"error": "AI服务暂时不可用，请稍后重试", "circuit_open": True}
+
+    def _record_result(self, result: Dict[str, Any], elapsed: float):
+        if result.get("busy"):
+            self.breaker.release()
+        else:
+            self.breaker.record("error" not in result, elapsed)
+
+    @staticmethod
+    def _flight_key(payload: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    async def chat_with_ai_async(self, prompt: str, system_prompt: str = None, temperature: float = 0.3) -> Dict[str, Any]:
+        """
+        调用AI API进行对话，等待接口响应时不占用线程。熔断器打开时立即返回错误（带 circuit_open 标记）。
+        与正在进行的相同请求合并：只发一次上游请求，所有调用方得到同一结果的副本。
+        """
+        payload = self._build_payload(prompt, system_prompt, temperature)
+        key = self._flight_key(payload)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._guarded_chat_async(payload))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            print(f"🔗 合并到进行中的相同AI请求")
+
+        # shield：某个调用方被取消（如客户端断开）时，不影响其他等待同一结果的调用方
+        return dict(await asyncio.shield(task))
+
+    async def _guarded_chat_async(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """经过熔断器的一次上游调用（合并后的多个调用方共用一次熔断判断和记录）"""
+        if not self.breaker.allow():
+            return self._circuit_open_result()
+
+        timer = _UpstreamTimer()
+        result = await self._post_chat_async(payload, timer)
+        self._record_result(result, timer.elapsed)
+        return result
+
+    async def _post_chat_async(self, payload: Dict[str, Any], timer: _UpstreamTimer) -> Dict[str, Any]:
+        import httpx
+        try:
+            print(f"🔄 发送AI请求...")
+            print(f"📝 Prompt长度: {len(payload['messages'][-1]['content'])} 字符")
+
+            for attempt in range(AI_MAX_RETRIES + 1):
+                try:
+                    async with self.limiter.slot_async():
+                        with timer.attempt():
+                            response = await self._get_async_client().post(self.api_url, json=payload)
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if attempt == AI_MAX_RETRIES:
+                        raise
+                    await asyncio.sleep(self._retry_delay(attempt, "网络连接失败"))
+                    continue
+                if response.status_code in AI_RETRY_STATUS_CODES and attempt < AI_MAX_RETRIES:
+                    await asyncio.sleep(self._retry_delay(attempt, f"API返回 {response.status_code}"))
+                    continue
+                return self._parse_completion(response.status_code, response.text, response.json)
+
+        except AIServiceBusy as e:
+            print(f"❌ {e}")
+            return {"error": str(e), "busy": True}
+        except httpx.TimeoutException:
+            print("❌ 请求超时")
+            return {"error": "请求超时，请稍后重试"}
+        except httpx.ConnectError:
+            print("❌ 网络连接错误")
+            return {"error": "网络连接失败"}
+        except httpx.HTTPError as e:
+            print(f"❌ 网络请求错误: {str(e)}")
+            return {"error": f"网络请求失败: {str(e)}"}
+        except json.JSONDecodeError as e:
+            print(f"❌ JSON解析错误: {str(e)}")
+            return {"error": f"响应解析失败: {str(e)}"}
+        except Exception as e:
+            print(f"❌ 未知错误: {str(e)}")
+            return {"error": f"AI API调用失败: {str(e)}"}
+
+    async def stream_chat_async(self, prompt: str, system_prompt: str = None,
+                                temperature: float = 0.3) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式对话：逐段产出 {"delta": 文本}，结束时产出 {"done": True, "model_used": 模型}，
+        出错时产出 {"error": 错误信息} 后结束。
+        与正在进行的相同流式请求合并：后加入的调用方先收到已生成的片段，再与其他调用方同步接收。
+        """
+        payload = self._build_payload(prompt, system_prompt, temperature, stream=True)
+        key = self._flight_key(payload)
+
+        broadcast = self._inflight_streams.get(key)
+        if broadcast is None:
+            broadcast = self._inflight_streams[key] = _StreamBroadcast()
+            # 上游读取在独立任务中进行，调用方断开不会中断其他调用方的流
+            broadcast.task = asyncio.ensure_future(self._relay_stream(key, payload, broadcast))
+        else:
+            self.coalesced_streams += 1
+            print(f"🔗 合并到进行中的相同AI流式请求")
+
+        async for event in broadcast.subscribe():
+            yield event
+
+    async def _relay_stream(self, key: str, payload: Dict[str, Any], broadcast: _StreamBroadcast):
+        if not self.breaker.allow():
+            await broadcast.publish(self._circuit_open_result())
+            self._inflight_streams.pop(key, None)
+            await broadcast.publish(finished=True)
+            return
+
+        # 以首个片段的到达时间判断是否过慢；首个片段、错误或结束三者中最先出现的记入熔断器
+        timer = _UpstreamTimer()
+        recorded = False
+        try:
+            async for event in self._stream_upstream_async(payload, timer):
+                if not recorded and ("delta" in event or "error" in event or event.get("done")):
+                    self._record_result(event, timer.elapsed)
+                    recorded = True
+                await broadcast.publish(event)
+        except Exception as e:
+            print(f"❌ 未知错误: {str(e)}")
+            if not recorded:
+                self.breaker.record(False, timer.elapsed)
+            await broadcast.publish({"error": f"AI API调用失败: {str(e)}"})
+        finally:
+            self._inflight_streams.pop(key, None)
+            await broadcast.publish(finished=True)
+
+    async def _stream_upstream_async(self, payload: Dict[str, Any],
+                                     timer: _UpstreamTimer) -> AsyncIterator[Dict[str, Any]]:
+        import httpx
+        model_used = AI_MODEL
+
+        print(f"🔄 发送AI流式请求...")
+        print(f"📝 Prompt长度: {len(payload['messages'][-1]['content'])} 字符")
+
+        try:
+            # 只在收到响应正文之前重试，已经产出的片段无法撤回
+            for attempt in range(AI_MAX_RETRIES + 1):
+                retry_reason = None
+                try:
+                    # 整个流式响应期间占用一个上游并发槽位
+                    async with self.limiter.slot_async():
+                        with timer.attempt():
+                            async with self._get_async_client().stream("POST", self.api_url, json=payload) as response:
+                                print(f"📊 API响应状态: {response.status_code}")
+                                if response.status_code in AI_RETRY_STATUS_CODES and attempt < AI_MAX_RETRIES:
+                                    retry_reason = f"API返回 {response.status_code}"
+                                elif response.status_code != 200:
+                                    text = (await response.aread()).decode("utf-8", errors="replace")
+                                    print(f"❌ API错误响应: {text}")
+                                    yield {"error": f"API调用失败: {response.status_code} - {text}"}
+                                    return
+                                else:
+                                    # 上游为SSE格式：每个事件一行 "data: {...}"，以 "data: [DONE]" 结束
+                                    async for line in response.aiter_lines():
+                                        if not line.startswith("data:"):
+                                            continue
+                                        data = line[5:].strip()
+                                        if data == "[DONE]":
+                                            break
+                                        chunk = json.loads(data)
+                                        model_used = chunk.get("model", model_used)
+                                        choices = chunk.get("choices") or [{}]
+                                        delta = (choices[0].get("delta") or {}).get("content")
+                                        if delta:
+                                            yield {"delta": delta}
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if attempt == AI_MAX_RETRIES:
+                        raise
+                    retry_reason = "网络连接失败"
+
+                if retry_reason is None:
+                    break
+                await asyncio.sleep(self._retry_delay(attempt, retry_reason))
+
+            print(f"✅ API流式调用完成")
+            yield {"done": True, "model_used": model_used}
+
+        except AIServiceBusy as e:
+            print(f"❌ {e}")
+            yield {"error": str(e), "busy": True}
+        except httpx.TimeoutException:
+            print("❌ 请求超时")
+            yield {"error": "请求超时，请稍后重试"}
+        except httpx.ConnectError:
+            print("❌ 网络连接错误")
+            yield {"error": "网络连接失败"}
+        except httpx.HTTPError as e:
+            print(f"❌ 网络请求错误: {str(e)}")
+            yield {"error": f"网络请求失败: {str(e)}"}
+        except json.JSONDecodeError as e:
+            print(f"❌ JSON解析错误: {str(e)}")
+            yield {"error": f"响应解析失败: {str(e)}"}
+
+    def stats(self) -> Dict[str, Any]:
+        """上游并发、请求合并和分析缓存的统计"""
+        return {
+            "limiter": self.limiter.stats(),
+            "in_flight_requests": len(self._inflight),
+            "in_flight_streams": len(self._inflight_streams),
+            "coalesced_requests": self.coalesced,
+            "coalesced_streams": self.coalesced_streams,
+            "retries": self.retries,
+            "api_url": self.api_url,
+            "offline": AI_OFFLINE,
+            "breaker": self.breaker.stats(),
+            "cache": self.cache.stats(),
+        }
+
+    @staticmethod
+    def _build_trend_prompt(city: str, area: Optional[str], data: pd.DataFrame) -> Tuple[str, str, Dict[str, Any]]:
+        """计算最近12个月的基础统计并生成分析提示，返回 (系统提示, 用户提示, 基础统计)"""
+        # 数据预处理和统计计算
+        data_sorted = data.sort_values('date')
+        recent_data = data_sorted.tail(12)  # 最近12个月
+
+        # 计算基础统计
+        current_price = float(recent_data['price'].iloc[-1]) if not recent_data.empty else None
+        avg_price = float(recent_data['price'].mean()) if not recent_data.empty else None
+
+        return AIService._trend_prompt(
+            city, area, current_price, float(recent_data['price'].iloc[0]), avg_price, len(recent_data),
+            float(recent_data['price'].min()), float(recent_data['price'].max())
+        )
+
+    @staticmethod
+    def summarize_area_trends(data: pd.DataFrame) -> pd.DataFrame:
+        """
+        一次分组计算每个区域最近12个月的统计，结果与逐个区域调用 _build_trend_prompt 时相同。
+        返回以区域为索引的 DataFrame，列为 current/first/average/min/max/months
+        """
+        recent = data.sort_values(['area', 'date'], kind='mergesort').groupby('area', sort=False).tail(12)
+        prices = recent.groupby('area')['price']
+        return pd.DataFrame({
+            "current": prices.last(),
+            "first": prices.first(),
+            "average": prices.mean(),
+            "min": prices.min(),
+            "max": prices.max(),
+            "months": prices.size(),
+        })
+
+    @staticmethod
+    def _trend_prompt(city: str, area: Optional[str], current_price: float, first_price: float, avg_price: float,
+                      months: int, min_price: float, max_price: float) -> Tuple[str, str, Dict[str, Any]]:
+        price_change = None
+        price_change_pct = None
+
+        if months >= 2:
+            old_price = first_price
+            price_change = current_price - old_price
+            price_change_pct = (price_change / old_price) * 100
+
+        location = AIService._location_name(city, area)
+
+        # 简化的分析提示，避免过长
+        system_prompt = """你是专业的房地产分析师。请用中文分析房价数据，提供简洁实用的分析和建议。"""
+
+        user_prompt = f"""分析{location}房价趋势：
+
+当前价格：{current_price:.0f}元/㎡
+平均价格：{avg_price:.0f}元/㎡
+价格变化：{price_change_pct:.1f}%
+数据期间：{months}个月
+
+请提供：
+1. 趋势判断（上涨/下跌/平稳）
+2. 价格水平评估
+3. 投资建议（3-4条）
+4. 风险提示
+
+请用简洁专业的语言回答，重点突出。"""
+
+        basic_stats = {
+            "current_price": round(current_price, 2) if current_price else None,
+            "average_price": round(avg_price, 2) if avg_price else None,
+            "price_change": round(price_change, 2) if price_change else None,
+            "price_change_percentage": round(price_change_pct, 2) if price_change_pct else None,
+            "sample_count": months,
+            "price_range": {
+                "min": round(min_price, 2),
+                "max": round(max_price, 2)
+            }
+        }
+        print(f"🤖 开始AI分析: {location}")
+        return system_prompt, user_prompt, basic_stats
+
+    @staticmethod
+    def _finish_trend_result(result: Dict[str, Any], basic_stats: Dict[str, Any]) -> Dict[str, Any]:
+        # 处理AI响应
+        if "error" not in result:
+            # 添加基础统计数据
+            result["basic_stats"] = basic_stats
+            print(f"✅ AI分析完成")
+        else:
+            print(f"❌ AI分析失败: {result['error']}")
+        return result
+
+    @staticmethod
+    def _location_name(city: str, area: Optional[str]) -> str:
+        return f"{city}市{area}区域" if area else f"{city}市"
+
+    @staticmethod
+    def _location_key(city: str, area: Optional[str]) -> str:
+        return f"{city}/{area}" if area else city
+
+    def _fallback_result(self, city: str, area: Optional[str], basic_stats: Dict[str, Any]) -> Dict[str, Any]:
+        """熔断期间返回的本地模板分析"""
+        print(f"⚡ 使用本地模板分析")
+        return {
+            "text": build_fallback_analysis(self._location_name(city, area), basic_stats),
+            "raw_response": True,
+            "model_used": "rule-based",
+            "tokens_used": 0,
+            "fallback": True,
+        }
+
+    @staticmethod
+    def _cached_result(cached: Dict[str, Any]) -> Dict[str, Any]:
+        print(f"✅ 命中AI分析缓存")
+        return {**cached, "raw_response": True, "cached": True}
+
+    async def analyze_housing_trend_async(self, city: str, area: Optional[str], data: pd.DataFrame,
+                                          dataset_version: str = "") -> Dict[str, Any]:
+        """
+        使用AI分析房价趋势，缓存读写在线程池中执行。
+        dataset_version 为数据文件版本，参与缓存键计算，数据更新后缓存自然失效
+        """
+        try:
+            if data.empty:
+                return {"error": "没有足够的数据进行分析"}
+
+            system_prompt, user_prompt, basic_stats = self._build_trend_prompt(city, area, data)
+            return await self._analyze_prompt_async(city, area, system_prompt, user_prompt, basic_stats, dataset_version)
+
+        except Exception as e:
+            print(f"❌ 房价趋势分析出错: {str(e)}")
+            return {"error": f"分析失败: {str(e)}"}
+
+    async def _analyze_prompt_async(self, city: str, area: Optional[str], system_prompt: str, user_prompt: str,
+                                    basic_stats: Dict[str, Any], dataset_version: str) -> Dict[str, Any]:
+        """已生成提示词的趋势分析：查缓存、调用接口（熔断时模板分析）、写缓存"""
+        loop = asyncio.get_running_loop()
+        cache_key = self.cache.make_key(system_prompt, user_prompt, AI_MODEL, dataset_version)
+        cached = await loop.run_in_executor(None, self.cache.get, cache_key)
+        if cached is not None:
+            return self._finish_trend_result(self._cached_result(cached), basic_stats)
+
+        result = await self.chat_with_ai_async(user_prompt, system_prompt)
+        if result.get("circuit_open"):
+            result = self._fallback_result(city, area, basic_stats)
+        elif "error" not in result:
+            await loop.run_in_executor(
+                None, self.cache.put, cache_key, self._location_key(city, area), dataset_version, result
+            )
+        return self._finish_trend_result(result, basic_stats)
+
+    async def analyze_city_areas_async(self, city: str, data: pd.DataFrame, dataset_version: str = "",
+                                       max_concurrency: int = AI_BATCH_CONCURRENCY) -> AsyncIterator[Dict[str, Any]]:
+        """
+        批量分析一个城市的所有区域：一次分组计算全部区域的统计，
+        再并发发起分析（同时最多 max_concurrency 个，且受全局上游并发限制），按完成顺序逐个产出。
+        先产出 {"areas": [...]}，之后每个区域产出 {"area": 区域, ...分析结果}
+        """
+        summary = self.summarize_area_trends(data)
+        yield {"areas": summary.index.tolist()}
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def analyze(area: str, row) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    system_prompt, user_prompt, basic_stats = self._trend_prompt(
+                        city, area, float(row["current"]), float(row["first"]), float(row["average"]),
+                        int(row["months"]), float(row["min"]), float(row["max"])
+                    )
+                    result = await self._analyze_prompt_async(
+                        city, area, system_prompt, user_prompt, basic_stats, dataset_version
+                    )
+                except Exception as e:
+                    print(f"❌ 房价趋势分析出错: {str(e)}")
+                    result = {"error": f"分析失败: {str(e)}"}
+            return {"area": area, **result}
+
+        tasks = [asyncio.ensure_future(analyze(area, row)) for area, row in summary.iterrows()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 客户端提前断开时取消尚未完成的分析
+            for task in tasks:
+                task.cancel()
+
+    async def stream_housing_trend_async(self, city: str, area: Optional[str], data: pd.DataFrame,
+                                         dataset_version: str = "") -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式趋势分析：先产出 {"basic_stats": ...}，再转发 stream_chat_async 的事件。
+        命中缓存时整段文本作为一个片段产出；未命中时在流结束后把完整文本写入缓存。
+        熔断期间产出本地模板分析。
+        """
+        if data.empty:
+            yield {"error": "没有足够的数据进行分析"}
+            return
+
+        try:
+            system_prompt, user_prompt, basic_stats = self._build_trend_prompt(city, area, data)
+        except Exception as e:
+            print(f"❌ 房价趋势分析出错: {str(e)}")
+            yield {"error": f"分析失败: {str(e)}"}
+            return
+
+        yield {"basic_stats": basic_stats}
+
+        loop = asyncio.get_running_loop()
+        cache_key = self.cache.make_key(system_prompt, user_prompt, AI_MODEL, dataset_version)
+        cached = await loop.run_in_executor(None, self.cache.get, cache_key)
+        if cached is not None:
+            print(f"✅ 命中AI分析缓存")
+            yield {"delta": cached["text"]}
+            yield {"done": True, "model_used": cached.get("model_used", AI_MODEL), "cached": True}
+            return
+
+        parts = []
+        async for event in self.stream_chat_async(user_prompt, system_prompt):
+            if event.get("circuit_open"):
+                fallback = self._fallback_result(city, area, basic_stats)
+                yield {"delta": fallback["text"]}
+                yield {"done": True, "model_used": fallback["model_used"], "fallback": True}
+                return
+            if "delta" in event:
+                parts.append(event["delta"])
+            elif event.get("done") and parts:
+                result = {"text": "".join(parts), "model_used": event.get("model_used", AI_MODEL)}
+                await loop.run_in_executor(
+                    None, self.cache.put, cache_key, self._location_key(city, area), dataset_version, result
+                )
+            yield event
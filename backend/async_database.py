@@ -0,0 +1,115 @@
+"""
+异步用户管理 - 供 async 接口使用的 SQLiteUserManager 包装
+
+sqlite3 是阻塞驱动。这里不占用 Starlette 的默认线程池，而是使用专用执行器：
+- 写操作（注册、签发令牌、修改状态）全部交给单个写线程串行执行，避免写锁争用；
+- 读操作（查询用户、验证令牌、用户列表）交给固定数量的读线程，每个线程复用自己的持久连接；
+- 令牌缓存命中、签名令牌验证等纯内存路径直接在事件循环中完成；
+- 密码哈希使用 password_service 的异步接口，在哈希线程池中计算。
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from backend.database import SQLiteUserManager, revoke_db_token, revoke_signed_token, token_cache
+from backend.security import InvalidToken, PasswordHashingBusy, password_service, token_signer
+
+# 数据库读线程数
+DB_READER_THREADS = max(1, int(os.environ.get("HOUSING_DB_READER_THREADS", "4")))
+
+
+class AsyncSQLiteUserManager:
+    """SQLiteUserManager 的异步版本，方法与返回值结构保持一致"""
+
+    def __init__(self, reader_threads: int = DB_READER_THREADS):
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="db-reader")
+        self.reader_threads = reader_threads
+
+    async def _read(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(func, *args, **kwargs))
+
+    async def _write(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(func, *args, **kwargs))
+
+    async def create_user(self, username: str, email: str, password: str, full_name: str = None) -> Dict[str, Any]:
+        """创建新用户"""
+        try:
+            if await self._read(SQLiteUserManager._user_exists, username, email):
+                return {"success": False, "message": "用户名或邮箱已存在"}
+
+            hashed_password = await password_service.hash_async(password)
+            return await self._write(SQLiteUserManager._insert_user, username, email, hashed_password, full_name)
+
+        except PasswordHashingBusy as e:
+            return {"success": False, "message": str(e), "busy": True}
+        except Exception as e:
+            return {"success": False, "message": f"创建用户失败: {str(e)}"}
+
+    async def authenticate_user(self, username: str, password: str) -> Dict[str, Any]:
+        """用户登录认证"""
+        try:
+            for candidate in await self._read(SQLiteUserManager._find_login_candidates, username):
+                password_hash = candidate.pop('password_hash')
+                if not await password_service.verify_async(password, password_hash):
+                    continue
+
+                new_password_hash = None
+                if password_service.needs_rehash(password_hash):
+                    new_password_hash = await password_service.hash_async(password)
+                return await self._write(SQLiteUserManager._issue_token, candidate, new_password_hash)
+
+            return {"success": False, "message": "用户名/邮箱或密码错误"}
+
+        except PasswordHashingBusy as e:
+            return {"success": False, "message": str(e), "busy": True}
+        except Exception as e:
+            return {"success": False, "message": f"登录失败: {str(e)}"}
+
+    async def verify_token(self, token: str) -> Dict[str, Any]:
+        """验证访问令牌：签名令牌、标签/吊销预检和缓存命中在事件循环中直接返回，否则交给读线程查询"""
+        if token_signer.looks_signed(token):
+            return SQLiteUserManager._verify_signed_token(token)
+
+        # 伪造或已登出的令牌在内存中直接拒绝
+        rejected = SQLiteUserManager._precheck_db_token(token)
+        if rejected:
+            return rejected
+
+        cached_user = token_cache.get(token)
+        if cached_user is not None:
+            return {"success": True, "user": cached_user}
+        return await self._read(SQLiteUserManager._verify_db_token, token)
+
+    async def invalidate_token(self, token: str):
+        """令牌失效（登出时调用）"""
+        if token_signer.looks_signed(token):
+            try:
+                claims = token_signer.verify(token)
+            except InvalidToken:
+                return
+            await self._write(revoke_signed_token, claims["jti"], claims["exp"])
+            return
+        await self._write(revoke_db_token, token)
+
+    async def set_user_active(self, user_id: int, is_active: bool) -> Dict[str, Any]:
+        return await self._write(SQLiteUserManager.set_user_active, user_id, is_active)
+
+    async def get_user_list(self, **filters) -> Dict[str, Any]:
+        return await self._read(SQLiteUserManager.get_user_list, **filters)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "writer_threads": 1,
+            "reader_threads": self.reader_threads,
+            "writer_queue": self._writer._work_queue.qsize(),
+            "reader_queue": self._readers._work_queue.qsize(),
+        }
+
+
+# 全局异步用户管理实例
+async_user_manager = AsyncSQLiteUserManager()
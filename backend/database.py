@@ -1,23 +1,239 @@
 """
 SQLite数据库适配器 - PostgreSQL编码问题的替代方案
 """
+import base64
 import sqlite3
 import hashlib
 import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 import json
 import os
+import queue
+
+from backend.security import (
+    InvalidToken, PasswordHashingBusy, TOKEN_MODE, TOKEN_REQUIRE_TAG, password_service, revocation_list,
+    token_signer
+)
 
 # SQLite数据库路径
 DB_PATH = os.path.join(os.path.dirname(__file__), 'housing_price.db')
 
+# 连接配置：锁等待超时（毫秒）和每个连接缓存的预编译语句数量
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("HOUSING_DB_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("HOUSING_DB_STATEMENT_CACHE_SIZE", "128"))
+
+class SQLiteConnectionPool:
+    """
+    SQLite连接池：每个线程持有一个持久连接，避免每次操作都重新打开数据库。
+    连接启用WAL日志模式，读写可以并发进行，减少 "database is locked" 错误。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._opened = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            check_same_thread=False,  # 仅用于关闭时跨线程回收，正常使用时连接只在所属线程内访问
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """获取当前线程的连接，首次使用时创建"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._prune_dead_threads()
+                self._connections[threading.get_ident()] = conn
+                self._opened += 1
+        return conn
+
+    def _prune_dead_threads(self):
+        """关闭已退出线程遗留的连接"""
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._connections if ident not in alive]:
+            try:
+                self._connections.pop(ident).close()
+            except sqlite3.Error:
+                pass
+
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        """
+        在当前线程连接上执行一个事务，正常结束提交，异常时回滚。
+        immediate=True 时以 BEGIN IMMEDIATE 开始，先取得写锁再读取，避免多个进程基于同一份读取结果写入
+        """
+        conn = self.connection()
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close_all(self):
+        """关闭所有连接（应用关闭时调用）"""
+        with self._lock:
+            for conn in self._connections.values():
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections.clear()
+        # 新的线程局部对象，关闭后再次使用时会重新建立连接
+        self._local = threading.local()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open_connections": len(self._connections),
+                "connections_opened": self._opened,
+                "busy_timeout_ms": DB_BUSY_TIMEOUT_MS,
+                "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            }
+
+# 全局连接池，所有用户管理函数共用
+db_pool = SQLiteConnectionPool(DB_PATH)
+
+# 令牌验证缓存：最多缓存的令牌数量和单条缓存的最长存活时间（秒）
+TOKEN_CACHE_SIZE = int(os.environ.get("HOUSING_TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.environ.get("HOUSING_TOKEN_CACHE_TTL_SECONDS", "300"))
+
+def hash_token(token: str) -> str:
+    """令牌摘要，缓存中不保存令牌明文"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class TokenCache:
+    """
+    已验证令牌的进程内缓存（LRU + TTL）。
+    缓存条目的存活时间不超过 TTL，也不超过令牌本身的 expires_at。
+    用户在条目写入后被整体吊销（其他进程停用用户，经吊销列表同步到本进程）时条目视为未命中，
+    由调用方回到数据库重新验证。
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # 令牌摘要 -> (用户信息, 失效时间戳, 写入时间戳)
+        self._user_index: Dict[int, set] = {}  # 用户ID -> 令牌摘要集合，用于按用户失效
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = hash_token(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, valid_until, cached_at = entry
+            if valid_until <= time.time() or revocation_list.is_user_revoked_since(user["id"], cached_at):
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(user)
+
+    def peek(self, token: str) -> Optional[Dict[str, Any]]:
+        """读取缓存但不更新命中统计和LRU顺序（供限流等旁路逻辑使用）"""
+        with self._lock:
+            entry = self._entries.get(hash_token(token))
+        if entry is None or entry[1] <= time.time():
+            return None
+        return dict(entry[0])
+
+    def put(self, token: str, user: Dict[str, Any], expires_at: str, cached_at: Optional[float] = None):
+        """cached_at 为验证开始（查询数据库之前）的时间，查询期间发生的吊销也能使条目失效"""
+        if self.max_size <= 0:
+            return
+        now = time.time()
+        cached_at = now if cached_at is None else cached_at
+        valid_until = min(now + self.ttl_seconds, datetime.fromisoformat(expires_at).timestamp())
+        key = hash_token(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (dict(user), valid_until, cached_at)
+            self._user_index.setdefault(user["id"], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._remove(hash_token(token))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in list(self._user_index.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_index.clear()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._user_index.get(entry[0]["id"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_index[entry[0]["id"]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS)
+
 def init_sqlite_database():
     """初始化SQLite数据库"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = db_pool.connection()
         cursor = conn.cursor()
         
+        # 启用增量回收，删除过期数据后可以分批归还空闲页。
+        # 切换模式需要VACUUM：新建的空数据库VACUUM瞬间完成，直接切换；已有数据库的整库VACUUM
+        # 耗时且持有排他锁，不在启动时执行，改由 enable_incremental_vacuum() 一次性迁移
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if cursor.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+                cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                cursor.execute("VACUUM")
+            else:
+                print("⚠️ 数据库未启用增量回收，定期维护不会归还空闲页；"
+                      "停止服务后运行一次 python -m backend.database --enable-incremental-vacuum 完成迁移")
+        
         # 创建用户表
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -54,14 +270,97 @@ def init_sqlite_database():
             )
         """)
         
+        # 签名令牌吊销记录：jti 非空为单个令牌吊销，否则为用户级吊销（not_before 之前签发的令牌失效）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS token_revocations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                jti TEXT,
+                user_id INTEGER,
+                not_before REAL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        
+        # 限流令牌桶快照（可选持久化）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        
+        # 活动日志汇总表：由后台任务从上次处理到的日志id开始增量刷新
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS activity_hourly_rollup (
+                hour TEXT NOT NULL,
+                activity_type TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, activity_type)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS activity_location_rollup (
+                city TEXT NOT NULL,
+                area TEXT NOT NULL DEFAULT '',
+                activity_type TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                last_seen_at TIMESTAMP,
+                PRIMARY KEY (city, area, activity_type)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS activity_rollup_state (
+                name TEXT PRIMARY KEY,
+                last_log_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP
+            )
+        """)
+        
+        # AI趋势分析缓存：键为提示词、模型和数据集版本的哈希，按最近命中时间淘汰
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ai_analysis_cache (
+                cache_key TEXT PRIMARY KEY,
+                location TEXT NOT NULL,
+                model TEXT NOT NULL,
+                dataset_version TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        
         # 创建索引
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_tokens_token ON user_tokens(token)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_tokens_expires_at ON user_tokens(expires_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_revocations_expires_at ON token_revocations(expires_at)")
+        # 用户列表按 (created_at, id) 做游标分页，状态筛选使用组合索引
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at_id ON users(created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_active_created_at_id ON users(is_active, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ai_analysis_cache_last_hit ON ai_analysis_cache(last_hit_at)")
+        
+        # 服务端密钥：未配置签名密钥时，各工作进程共享这里生成的令牌签名密钥
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS server_secrets (
+                name TEXT PRIMARY KEY,
+                value BLOB NOT NULL
+            )
+        """)
+        cursor.execute(
+            "INSERT OR IGNORE INTO server_secrets (name, value) VALUES ('token_signing_key', ?)",
+            (secrets.token_bytes(32),)
+        )
+        shared_key = cursor.execute(
+            "SELECT value FROM server_secrets WHERE name = 'token_signing_key'"
+        ).fetchone()[0]
         
         conn.commit()
         cursor.close()
-        conn.close()
+        
+        token_signer.use_shared_key("db", bytes(shared_key))
         
         print(f"SQLite数据库初始化成功: {DB_PATH}")
         return True
@@ -70,189 +369,821 @@ def init_sqlite_database():
         print(f"SQLite数据库初始化失败: {e}")
         return False
 
+# 用户列表分页大小
+USER_LIST_DEFAULT_LIMIT = 50
+USER_LIST_MAX_LIMIT = 500
+
+
+def encode_user_cursor(created_at: str, user_id: int) -> str:
+    """把分页位置 (created_at, id) 编码为不透明的游标字符串"""
+    return base64.urlsafe_b64encode(json.dumps([created_at, user_id]).encode()).decode()
+
+
+def decode_user_cursor(cursor: str) -> tuple:
+    try:
+        created_at, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), int(user_id)
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+
+# 访问令牌有效期
+TOKEN_LIFETIME = timedelta(days=7)
+
+# 签名令牌吊销列表从数据库同步的间隔（秒），多进程/多主机部署时决定吊销生效的延迟
+TOKEN_REVOCATION_SYNC_SECONDS = float(os.environ.get("HOUSING_TOKEN_REVOCATION_SYNC_SECONDS", "5"))
+
+_revocation_sync_state = {"last_id": 0}
+
+def revoke_signed_token(jti: str, expires_at: float):
+    """吊销单个签名令牌：立即在本进程生效，并写入数据库供其他进程同步"""
+    revocation_list.revoke(jti, expires_at)
+    with db_pool.transaction() as conn:
+        conn.execute("INSERT INTO token_revocations (jti, expires_at) VALUES (?, ?)", (jti, expires_at))
+
+def db_token_id(token: str) -> str:
+    """数据库令牌在吊销集合中的键（只保存摘要，不保存令牌明文）"""
+    return "db:" + hash_token(token)
+
+def revoke_db_token(token: str):
+    """删除数据库令牌，并把摘要加入吊销集合，之后的请求在内存中直接拒绝"""
+    token_cache.invalidate(token)
+    with db_pool.transaction() as conn:
+        row = conn.execute("SELECT expires_at FROM user_tokens WHERE token = ?", (token,)).fetchone()
+        if row is None:
+            return
+        conn.execute("DELETE FROM user_tokens WHERE token = ?", (token,))
+        expires_at = datetime.fromisoformat(row["expires_at"]).timestamp()
+        # 写入吊销记录，其他工作进程同步后同样无需查询令牌表
+        conn.execute("INSERT INTO token_revocations (jti, expires_at) VALUES (?, ?)", (db_token_id(token), expires_at))
+    revocation_list.revoke(db_token_id(token), expires_at)
+
+def revoke_user_signed_tokens(user_id: int):
+    """
+    吊销某用户此前签发的全部签名令牌；其他进程同步后，缓存中该用户的数据库令牌也会回到数据库重新验证
+    """
+    now = time.time()
+    expires_at = now + TOKEN_LIFETIME.total_seconds()
+    revocation_list.revoke_user(user_id, now, expires_at)
+    with db_pool.transaction() as conn:
+        conn.execute(
+            "INSERT INTO token_revocations (user_id, not_before, expires_at) VALUES (?, ?, ?)",
+            (user_id, now, expires_at)
+        )
+
+def sync_token_revocations() -> Dict[str, Any]:
+    """增量加载其他进程写入的吊销记录，并清理已过期的条目"""
+    conn = db_pool.connection()
+    rows = conn.execute("""
+        SELECT id, jti, user_id, not_before, expires_at FROM token_revocations
+        WHERE id > ? AND expires_at > ? ORDER BY id
+    """, (_revocation_sync_state["last_id"], time.time())).fetchall()
+    for row in rows:
+        if row["jti"]:
+            revocation_list.revoke(row["jti"], row["expires_at"])
+        else:
+            revocation_list.revoke_user(row["user_id"], row["not_before"], row["expires_at"])
+    if rows:
+        _revocation_sync_state["last_id"] = rows[-1]["id"]
+    purged = revocation_list.purge()
+    return {"loaded": len(rows), "purged": purged, **revocation_list.stats()}
+
+
 class SQLiteUserManager:
     """SQLite用户管理类"""
     
     @staticmethod
     def hash_password(password: str) -> str:
-        """密码哈希"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """密码哈希（加盐KDF，在专用线程池中计算）"""
+        return password_service.hash(password)
     
     @staticmethod
     def generate_token() -> str:
         """生成访问令牌"""
         return secrets.token_urlsafe(32)
     
+    @staticmethod
+    def _user_exists(username: str, email: str) -> bool:
+        row = db_pool.connection().execute(
+            "SELECT id FROM users WHERE username = ? OR email = ?", (username, email)
+        ).fetchone()
+        return row is not None
+    
+    @staticmethod
+    def _insert_user(username: str, email: str, password_hash: str, full_name: str = None) -> Dict[str, Any]:
+        """写入新用户；用户名/邮箱的唯一约束兜底处理并发注册"""
+        created_at = datetime.now().isoformat()
+        try:
+            with db_pool.transaction() as conn:
+                cursor = conn.execute("""
+                    INSERT INTO users (username, email, password_hash, full_name, created_at, is_active)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (username, email, password_hash, full_name, created_at, 1))
+                
+                # 获取创建的用户信息
+                user = dict(conn.execute("SELECT * FROM users WHERE id = ?", (cursor.lastrowid,)).fetchone())
+        except sqlite3.IntegrityError:
+            return {"success": False, "message": "用户名或邮箱已存在"}
+        
+        return {
+            "success": True, 
+            "message": "用户创建成功",
+            "user": user
+        }
+    
     @staticmethod
     def create_user(username: str, email: str, password: str, full_name: str = None) -> Dict[str, Any]:
         """创建新用户"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # 检查用户名是否已存在
-            cursor.execute("SELECT id FROM users WHERE username = ? OR email = ?", (username, email))
-            if cursor.fetchone():
-                conn.close()
+            # 检查用户名是否已存在（在计算哈希之前，避免为重复注册浪费CPU）
+            if SQLiteUserManager._user_exists(username, email):
                 return {"success": False, "message": "用户名或邮箱已存在"}
             
-            # 创建用户
+            # 哈希计算不占用数据库事务
             hashed_password = SQLiteUserManager.hash_password(password)
-            created_at = datetime.now().isoformat()
-            
-            cursor.execute("""
-                INSERT INTO users (username, email, password_hash, full_name, created_at, is_active)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (username, email, hashed_password, full_name, created_at, 1))
-            
-            user_id = cursor.lastrowid
-            
-            # 获取创建的用户信息
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-            user = dict(cursor.fetchone())
-            
-            conn.commit()
-            conn.close()
-            
-            return {
-                "success": True, 
-                "message": "用户创建成功",
-                "user": user
-            }
+            return SQLiteUserManager._insert_user(username, email, hashed_password, full_name)
             
+        except PasswordHashingBusy as e:
+            return {"success": False, "message": str(e), "busy": True}
         except Exception as e:
             return {"success": False, "message": f"创建用户失败: {str(e)}"}
     
     @staticmethod
-    def authenticate_user(username: str, password: str) -> Dict[str, Any]:
-        """用户登录认证"""
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            hashed_password = SQLiteUserManager.hash_password(password)
-            cursor.execute("""
-                SELECT id, username, email, full_name, created_at, last_login
-                FROM users 
-                WHERE (username = ? OR email = ?) AND password_hash = ? AND is_active = 1
-            """, (username, username, hashed_password))
-            
-            user_row = cursor.fetchone()
-            if not user_row:
-                conn.close()
-                return {"success": False, "message": "用户名/邮箱或密码错误"}
-            
-            user = dict(user_row)
-            
-            # 生成访问令牌
-            token = SQLiteUserManager.generate_token()
-            expires_at = datetime.now() + timedelta(days=7)  # 7天过期
-            
-            # 保存令牌
-            cursor.execute("""
-                INSERT INTO user_tokens (user_id, token, expires_at)
-                VALUES (?, ?, ?)
-            """, (user['id'], token, expires_at.isoformat()))
+    def _find_login_candidates(username: str) -> list:
+        """按用户名或邮箱查找可登录的用户（含密码哈希）"""
+        rows = db_pool.connection().execute("""
+            SELECT id, username, email, full_name, created_at, last_login, password_hash
+            FROM users 
+            WHERE (username = ? OR email = ?) AND is_active = 1
+        """, (username, username)).fetchall()
+        return [dict(row) for row in rows]
+    
+    @staticmethod
+    def _issue_token(user: Dict[str, Any], new_password_hash: str = None) -> Dict[str, Any]:
+        """生成并保存访问令牌，更新最后登录时间；需要时顺带升级密码哈希"""
+        expires_at = datetime.now() + TOKEN_LIFETIME
+        
+        if TOKEN_MODE == "signed":
+            # 自包含的签名令牌，不写入令牌表
+            token = token_signer.issue(user, expires_at.timestamp())["token"]
+        else:
+            # 生成访问令牌（带HMAC标签，伪造的令牌无需查询数据库即可拒绝）
+            token = token_signer.tag(SQLiteUserManager.generate_token())
+        
+        with db_pool.transaction() as conn:
+            if TOKEN_MODE != "signed":
+                # 保存令牌
+                conn.execute("""
+                    INSERT INTO user_tokens (user_id, token, expires_at)
+                    VALUES (?, ?, ?)
+                """, (user['id'], token, expires_at.isoformat()))
             
             # 更新最后登录时间
-            cursor.execute("""
+            conn.execute("""
                 UPDATE users SET last_login = ? WHERE id = ?
             """, (datetime.now().isoformat(), user['id']))
             
-            conn.commit()
-            conn.close()
+            # 旧格式哈希透明升级为当前算法
+            if new_password_hash:
+                conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_password_hash, user['id']))
+        
+        return {
+            "success": True,
+            "message": "登录成功",
+            "user": user,
+            "token": token,
+            "expires_at": expires_at.isoformat()
+        }
+    
+    @staticmethod
+    def authenticate_user(username: str, password: str) -> Dict[str, Any]:
+        """用户登录认证"""
+        try:
+            for candidate in SQLiteUserManager._find_login_candidates(username):
+                password_hash = candidate.pop('password_hash')
+                if not password_service.verify(password, password_hash):
+                    continue
+                
+                new_password_hash = None
+                if password_service.needs_rehash(password_hash):
+                    new_password_hash = password_service.hash(password)
+                return SQLiteUserManager._issue_token(candidate, new_password_hash)
             
-            return {
-                "success": True,
-                "message": "登录成功",
-                "user": user,
-                "token": token,
-                "expires_at": expires_at.isoformat()
-            }
+            return {"success": False, "message": "用户名/邮箱或密码错误"}
             
+        except PasswordHashingBusy as e:
+            return {"success": False, "message": str(e), "busy": True}
         except Exception as e:
             return {"success": False, "message": f"登录失败: {str(e)}"}
     
     @staticmethod
     def verify_token(token: str) -> Dict[str, Any]:
-        """验证访问令牌"""
+        """验证访问令牌（签名令牌在内存中验证，数据库令牌优先查询进程内缓存）"""
+        if token_signer.looks_signed(token):
+            return SQLiteUserManager._verify_signed_token(token)
+        
+        rejected = SQLiteUserManager._precheck_db_token(token)
+        if rejected:
+            return rejected
+        
+        cached_user = token_cache.get(token)
+        if cached_user is not None:
+            return {"success": True, "user": cached_user}
+        return SQLiteUserManager._verify_db_token(token)
+    
+    @staticmethod
+    def _precheck_db_token(token: str) -> Optional[Dict[str, Any]]:
+        """数据库令牌的内存预检：标签无效或已登出的令牌直接拒绝，返回 None 表示需要继续验证"""
+        tag_valid = token_signer.check_tag(token)
+        if tag_valid is False or (tag_valid is None and TOKEN_REQUIRE_TAG):
+            return {"success": False, "message": "令牌无效或已过期"}
+        if revocation_list.is_token_revoked(db_token_id(token)):
+            return {"success": False, "message": "令牌已吊销"}
+        return None
+    
+    @staticmethod
+    def _verify_db_token(token: str) -> Dict[str, Any]:
+        """在数据库中查询令牌，验证通过后写入缓存"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            # 在查询之前取时间：查询与写入缓存之间用户被停用时，吊销时间晚于该时间，缓存条目随之失效
+            verified_at = time.time()
+            conn = db_pool.connection()
+            result = conn.execute("""
                 SELECT ut.user_id, ut.expires_at, u.username, u.email, u.full_name
                 FROM user_tokens ut
                 JOIN users u ON ut.user_id = u.id
                 WHERE ut.token = ? AND ut.expires_at > ? AND u.is_active = 1
-            """, (token, datetime.now().isoformat()))
-            
-            result = cursor.fetchone()
-            conn.close()
+            """, (token, datetime.now().isoformat())).fetchone()
             
             if not result:
                 return {"success": False, "message": "令牌无效或已过期"}
             
             result_dict = dict(result)
+            user = {
+                "id": result_dict['user_id'],
+                "username": result_dict['username'],
+                "email": result_dict['email'],
+                "full_name": result_dict['full_name']
+            }
+            token_cache.put(token, user, result_dict['expires_at'], cached_at=verified_at)
             return {
                 "success": True,
-                "user": {
-                    "id": result_dict['user_id'],
-                    "username": result_dict['username'],
-                    "email": result_dict['email'],
-                    "full_name": result_dict['full_name']
-                }
+                "user": user
             }
             
         except Exception as e:
             return {"success": False, "message": f"令牌验证失败: {str(e)}"}
     
     @staticmethod
-    def get_user_list() -> Dict[str, Any]:
-        """获取用户列表"""
+    def _verify_signed_token(token: str) -> Dict[str, Any]:
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            claims = token_signer.verify(token)
+        except InvalidToken as e:
+            return {"success": False, "message": str(e)}
+        if revocation_list.is_revoked(claims):
+            return {"success": False, "message": "令牌已吊销"}
+        return {
+            "success": True,
+            "user": {
+                "id": claims["uid"],
+                "username": claims["usr"],
+                "email": claims["eml"],
+                "full_name": claims["nam"]
+            }
+        }
+    
+    @staticmethod
+    def invalidate_token(token: str):
+        """令牌失效（登出时调用）：签名令牌加入吊销列表，数据库令牌删除并加入吊销集合"""
+        if token_signer.looks_signed(token):
+            try:
+                claims = token_signer.verify(token)
+            except InvalidToken:
+                return
+            revoke_signed_token(claims["jti"], claims["exp"])
+            return
+        revoke_db_token(token)
+    
+    @staticmethod
+    def set_user_active(user_id: int, is_active: bool) -> Dict[str, Any]:
+        """启用/停用用户，停用时该用户的令牌立即从缓存中失效"""
+        try:
+            with db_pool.transaction() as conn:
+                cursor = conn.execute("UPDATE users SET is_active = ? WHERE id = ?", (1 if is_active else 0, user_id))
+                if cursor.rowcount == 0:
+                    return {"success": False, "message": "用户不存在"}
+            token_cache.invalidate_user(user_id)
+            if not is_active:
+                revoke_user_signed_tokens(user_id)
+            return {"success": True, "message": "用户已启用" if is_active else "用户已停用"}
+        except Exception as e:
+            return {"success": False, "message": f"更新用户状态失败: {str(e)}"}
+    
+    @staticmethod
+    def get_user_list(limit: int = USER_LIST_DEFAULT_LIMIT, cursor: str = None, is_active: bool = None,
+                      username_prefix: str = None, created_from: str = None, created_to: str = None,
+                      include_total: bool = False) -> Dict[str, Any]:
+        """
+        获取用户列表（按创建时间倒序的游标分页）。
+        cursor 为上一页返回的 next_cursor；include_total 为真时额外统计满足筛选条件的总数。
+        """
+        try:
+            limit = max(1, min(int(limit), USER_LIST_MAX_LIMIT))
+            try:
+                after = decode_user_cursor(cursor) if cursor else None
+            except ValueError:
+                return {"success": False, "message": "无效的分页游标", "invalid": True}
+            
+            conditions, params = [], []
+            if is_active is not None:
+                conditions.append("is_active = ?")
+                params.append(1 if is_active else 0)
+            if username_prefix:
+                # 前缀匹配改写为范围条件，可以使用用户名索引
+                conditions.append("username >= ? AND username < ?")
+                params.extend([username_prefix, username_prefix[:-1] + chr(ord(username_prefix[-1]) + 1)])
+            if created_from:
+                conditions.append("created_at >= ?")
+                params.append(created_from)
+            if created_to:
+                conditions.append("created_at < ?")
+                params.append(created_to)
+            
+            page_conditions, page_params = list(conditions), list(params)
+            if after:
+                page_conditions.append("(created_at, id) < (?, ?)")
+                page_params.extend(after)
             
-            cursor.execute("""
+            where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+            conn = db_pool.connection()
+            # 多取一行用于判断是否还有下一页
+            rows = conn.execute(f"""
                 SELECT id, username, email, full_name, created_at, last_login, is_active
                 FROM users
-                ORDER BY created_at DESC
-            """)
+                {where}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            """, (*page_params, limit + 1)).fetchall()
             
-            users = [dict(user) for user in cursor.fetchall()]
-            conn.close()
+            users = [dict(user) for user in rows[:limit]]
+            has_more = len(rows) > limit
             
-            return {
+            result = {
                 "success": True,
-                "users": users
+                "users": users,
+                "next_cursor": encode_user_cursor(users[-1]["created_at"], users[-1]["id"]) if has_more else None,
+                "has_more": has_more,
             }
+            if include_total:
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+                result["total"] = conn.execute(f"SELECT COUNT(*) FROM users {where}", params).fetchone()[0]
+            return result
             
         except Exception as e:
             return {"success": False, "message": f"获取用户列表失败: {str(e)}"}
 
+# 活动日志异步写入配置：队列容量、每批写入条数、最长刷新间隔（秒）
+ACTIVITY_QUEUE_SIZE = int(os.environ.get("HOUSING_ACTIVITY_QUEUE_SIZE", "10000"))
+ACTIVITY_BATCH_SIZE = int(os.environ.get("HOUSING_ACTIVITY_BATCH_SIZE", "200"))
+ACTIVITY_FLUSH_INTERVAL_SECONDS = float(os.environ.get("HOUSING_ACTIVITY_FLUSH_INTERVAL_SECONDS", "1.0"))
+
+ACTIVITY_INSERT_SQL = """
+    INSERT INTO user_activity_logs (user_id, activity_type, activity_data, created_at)
+    VALUES (?, ?, ?, ?)
+"""
+
+class ActivityLogWriter:
+    """
+    用户活动日志的后台批量写入器。
+    请求线程只把事件放入内存队列，后台线程按批量大小或时间间隔用 executemany 合并提交，
+    把每次请求一次的提交（fsync）移出请求处理路径。
+    """
+
+    def __init__(self, pool: SQLiteConnectionPool, max_queue: int, batch_size: int, flush_interval: float):
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_at: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """停止写入线程，退出前写完队列中剩余的事件"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def log(self, user_id: int, activity_type: str, activity_data: dict = None):
+        # created_at 与表默认值 CURRENT_TIMESTAMP 格式一致（UTC），记录的是事件发生时间而不是写入时间
+        event = (
+            user_id,
+            activity_type,
+            json.dumps(activity_data) if activity_data else None,
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        )
+
+        # 写入线程未启动（如命令行脚本）时直接同步写入
+        if not self.running:
+            self._write_batch([event])
+            return
+
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _collect_batch(self) -> list:
+        """等待第一个事件，然后在刷新间隔内尽量凑满一批"""
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                # 停止时不再等待，只取走已在队列中的事件
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch: list):
+        try:
+            with self.pool.transaction() as conn:
+                conn.executemany(ACTIVITY_INSERT_SQL, batch)
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+                self.last_flush_at = datetime.now().isoformat(timespec="seconds")
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            print(f"记录用户活动失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self.running,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "batch_size": self.batch_size,
+                "flush_interval_seconds": self.flush_interval,
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "last_flush_at": self.last_flush_at,
+            }
+
+activity_writer = ActivityLogWriter(db_pool, ACTIVITY_QUEUE_SIZE, ACTIVITY_BATCH_SIZE, ACTIVITY_FLUSH_INTERVAL_SECONDS)
+
+# 数据库维护任务配置（秒/行数/页数）
+TOKEN_PURGE_INTERVAL_SECONDS = float(os.environ.get("HOUSING_TOKEN_PURGE_INTERVAL_SECONDS", "600"))
+TOKEN_PURGE_BATCH_SIZE = int(os.environ.get("HOUSING_TOKEN_PURGE_BATCH_SIZE", "500"))
+TOKEN_PURGE_MAX_BATCHES = int(os.environ.get("HOUSING_TOKEN_PURGE_MAX_BATCHES", "100"))
+DB_OPTIMIZE_INTERVAL_SECONDS = float(os.environ.get("HOUSING_DB_OPTIMIZE_INTERVAL_SECONDS", "3600"))
+DB_INCREMENTAL_VACUUM_PAGES = int(os.environ.get("HOUSING_DB_INCREMENTAL_VACUUM_PAGES", "1000"))
+
+class MaintenanceScheduler:
+    """后台维护线程：按各自的间隔依次执行注册的周期任务，并记录每个任务的执行情况"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_job(self, name: str, interval: float, func, run_immediately: bool = True):
+        with self._lock:
+            self._jobs[name] = {
+                "func": func,
+                "interval": interval,
+                "next_run": time.monotonic() + (0 if run_immediately else interval),
+                "runs": 0,
+                "errors": 0,
+                "last_run_at": None,
+                "last_duration_seconds": None,
+                "last_result": None,
+                "last_error": None,
+            }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def run_job(self, name: str):
+        """立即执行一个任务（维护线程和管理接口共用）"""
+        job = self._jobs[name]
+        started = time.perf_counter()
+        try:
+            result = job["func"]()
+            with self._lock:
+                job["last_result"] = result
+                job["last_error"] = None
+        except Exception as e:
+            result = None
+            with self._lock:
+                job["errors"] += 1
+                job["last_error"] = str(e)
+            print(f"数据库维护任务 {name} 失败: {e}")
+        with self._lock:
+            job["runs"] += 1
+            job["last_run_at"] = datetime.now().isoformat(timespec="seconds")
+            job["last_duration_seconds"] = round(time.perf_counter() - started, 3)
+            job["next_run"] = time.monotonic() + job["interval"]
+        return result
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                due = [name for name, job in self._jobs.items() if job["next_run"] <= time.monotonic()]
+                next_run = min((job["next_run"] for job in self._jobs.values()), default=time.monotonic() + 60)
+            for name in due:
+                if self._stop.is_set():
+                    break
+                self.run_job(name)
+            if not due:
+                self._stop.wait(max(0.1, min(next_run - time.monotonic(), 60)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self.running,
+                "jobs": {
+                    name: {key: value for key, value in job.items() if key not in ("func", "next_run")}
+                    for name, job in self._jobs.items()
+                },
+            }
+
+def purge_expired_tokens(batch_size: int = TOKEN_PURGE_BATCH_SIZE, max_batches: int = TOKEN_PURGE_MAX_BATCHES) -> Dict[str, Any]:
+    """
+    分批删除过期令牌。每批一个短事务，写锁只被短暂持有，不会阻塞登录和令牌验证。
+    """
+    deleted = 0
+    batches = 0
+    now = datetime.now().isoformat()
+    while batches < max_batches:
+        with db_pool.transaction() as conn:
+            cursor = conn.execute("""
+                DELETE FROM user_tokens WHERE id IN (
+                    SELECT id FROM user_tokens WHERE expires_at <= ? LIMIT ?
+                )
+            """, (now, batch_size))
+            count = cursor.rowcount
+        deleted += count
+        batches += 1
+        if count < batch_size:
+            break
+    
+    # 过期令牌的吊销记录已无意义
+    with db_pool.transaction() as conn:
+        revocations = conn.execute("DELETE FROM token_revocations WHERE expires_at <= ?", (time.time(),)).rowcount
+    return {"deleted": deleted, "batches": batches, "revocations_deleted": revocations}
+
+def enable_incremental_vacuum() -> Dict[str, Any]:
+    """
+    把已有数据库切换为增量回收模式（一次性迁移）。
+    需要整库VACUUM：重写整个文件并持有排他锁，应在服务停止时运行
+    """
+    conn = db_pool.connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return {"changed": False, "auto_vacuum": "incremental"}
+    started = time.perf_counter()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return {
+        "changed": conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2,
+        "auto_vacuum": "incremental",
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+def optimize_database(vacuum_pages: int = DB_INCREMENTAL_VACUUM_PAGES) -> Dict[str, Any]:
+    """更新查询规划器统计信息并增量回收空闲页"""
+    conn = db_pool.connection()
+    conn.execute("ANALYZE")
+    conn.commit()
+    freelist_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # incremental_vacuum 每执行一步只回收一页，executescript 会把语句执行到底
+    conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)});")
+    freelist_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {"pages_reclaimed": freelist_before - freelist_after, "freelist_pages": freelist_after}
+
+_table_stats: Dict[str, Any] = {}
+
+def collect_table_stats() -> Dict[str, Any]:
+    """统计各表行数和数据库文件大小；结果缓存起来，查询接口不需要每次扫表"""
+    conn = db_pool.connection()
+    tables = {}
+    for table in ("users", "user_tokens", "token_revocations", "user_activity_logs",
+                  "activity_hourly_rollup", "activity_location_rollup", "ai_analysis_cache"):
+        tables[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    expired_tokens = conn.execute(
+        "SELECT COUNT(*) FROM user_tokens WHERE expires_at <= ?", (datetime.now().isoformat(),)
+    ).fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    _table_stats.clear()
+    _table_stats.update({
+        "row_counts": tables,
+        "expired_tokens": expired_tokens,
+        "database_bytes": page_size * page_count,
+        "free_bytes": page_size * freelist,
+        "collected_at": datetime.now().isoformat(timespec="seconds"),
+    })
+    return dict(_table_stats)
+
+def get_table_stats() -> Dict[str, Any]:
+    """最近一次统计的表大小（尚未统计时立即统计一次）"""
+    return dict(_table_stats) if _table_stats else collect_table_stats()
+
+# 活动日志汇总刷新间隔（秒）和每批处理的日志条数
+ACTIVITY_ROLLUP_INTERVAL_SECONDS = float(os.environ.get("HOUSING_ACTIVITY_ROLLUP_INTERVAL_SECONDS", "60"))
+ACTIVITY_ROLLUP_BATCH_SIZE = int(os.environ.get("HOUSING_ACTIVITY_ROLLUP_BATCH_SIZE", "5000"))
+ACTIVITY_ROLLUP_MAX_BATCHES = int(os.environ.get("HOUSING_ACTIVITY_ROLLUP_MAX_BATCHES", "100"))
+
+def refresh_activity_rollups(batch_size: int = ACTIVITY_ROLLUP_BATCH_SIZE,
+                             max_batches: int = ACTIVITY_ROLLUP_MAX_BATCHES) -> Dict[str, Any]:
+    """
+    从上次处理到的日志id开始，分批把新日志累加进小时汇总和城市/区域汇总表。
+    每批的汇总累加与进度更新在同一事务内提交，中途失败不会重复计数。
+    日志只由 activity_writer 的单个后台线程按id递增写入，因此不会有更小的id在之后才提交。
+    每个工作进程都会运行这个任务，每批在读取进度前先取得写锁（BEGIN IMMEDIATE），
+    多个进程不会读到同一个进度而重复累加同一段日志。
+    """
+    processed = 0
+    batches = 0
+    while batches < max_batches:
+        with db_pool.transaction(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT last_log_id FROM activity_rollup_state WHERE name = 'activity'"
+            ).fetchone()
+            last_id = row[0] if row else 0
+            upper_id = conn.execute(
+                "SELECT MAX(id) FROM (SELECT id FROM user_activity_logs WHERE id > ? ORDER BY id LIMIT ?)",
+                (last_id, batch_size)
+            ).fetchone()[0]
+            if upper_id is None:
+                break
+            
+            # WHERE 1 用于消除 INSERT ... SELECT 与 ON CONFLICT 的语法歧义
+            conn.execute("""
+                INSERT INTO activity_hourly_rollup (hour, activity_type, count)
+                SELECT substr(created_at, 1, 13) || ':00', activity_type, COUNT(*)
+                FROM user_activity_logs
+                WHERE id > ? AND id <= ?
+                GROUP BY 1, 2
+                ON CONFLICT (hour, activity_type) DO UPDATE SET count = count + excluded.count
+            """, (last_id, upper_id))
+            conn.execute("""
+                INSERT INTO activity_location_rollup (city, area, activity_type, count, last_seen_at)
+                SELECT city, area, activity_type, COUNT(*), MAX(created_at)
+                FROM (
+                    SELECT json_extract(activity_data, '$.city') AS city,
+                           COALESCE(json_extract(activity_data, '$.area'), '') AS area,
+                           activity_type, created_at
+                    FROM user_activity_logs
+                    WHERE id > ? AND id <= ? AND json_valid(activity_data)
+                )
+                WHERE city IS NOT NULL
+                GROUP BY city, area, activity_type
+                ON CONFLICT (city, area, activity_type) DO UPDATE SET
+                    count = count + excluded.count,
+                    last_seen_at = MAX(COALESCE(last_seen_at, ''), excluded.last_seen_at)
+            """, (last_id, upper_id))
+            count = conn.execute(
+                "SELECT COUNT(*) FROM user_activity_logs WHERE id > ? AND id <= ?", (last_id, upper_id)
+            ).fetchone()[0]
+            conn.execute("""
+                INSERT INTO activity_rollup_state (name, last_log_id, updated_at) VALUES ('activity', ?, ?)
+                ON CONFLICT (name) DO UPDATE SET last_log_id = excluded.last_log_id, updated_at = excluded.updated_at
+            """, (upper_id, datetime.now().isoformat(timespec="seconds")))
+        processed += count
+        batches += 1
+        if count < batch_size:
+            break
+    return {"processed": processed, "batches": batches}
+
+def get_activity_rollups(hours: int = 24, top: int = 10) -> Dict[str, Any]:
+    """
+    读取活动汇总：最近若干小时的分类型计数和被查询最多的城市/区域。
+    只读取汇总表，耗时与日志总量无关。
+    """
+    conn = db_pool.connection()
+    # 日志时间为UTC，小时键格式为 'YYYY-MM-DD HH:00'
+    since = time.strftime("%Y-%m-%d %H:00", time.gmtime(time.time() - (hours - 1) * 3600))
+    hourly = [dict(row) for row in conn.execute("""
+        SELECT hour, activity_type, count FROM activity_hourly_rollup
+        WHERE hour >= ? ORDER BY hour, activity_type
+    """, (since,))]
+    
+    totals: Dict[str, int] = {}
+    for row in hourly:
+        totals[row["activity_type"]] = totals.get(row["activity_type"], 0) + row["count"]
+    
+    top_cities = [dict(row) for row in conn.execute("""
+        SELECT city, SUM(count) AS count, MAX(last_seen_at) AS last_seen_at
+        FROM activity_location_rollup
+        GROUP BY city ORDER BY count DESC LIMIT ?
+    """, (top,))]
+    top_areas = [dict(row) for row in conn.execute("""
+        SELECT city, area, SUM(count) AS count, MAX(last_seen_at) AS last_seen_at
+        FROM activity_location_rollup
+        WHERE area != ''
+        GROUP BY city, area ORDER BY count DESC LIMIT ?
+    """, (top,))]
+    
+    state = conn.execute(
+        "SELECT last_log_id, updated_at FROM activity_rollup_state WHERE name = 'activity'"
+    ).fetchone()
+    latest_log_id = conn.execute("SELECT MAX(id) FROM user_activity_logs").fetchone()[0] or 0
+    last_log_id = state["last_log_id"] if state else 0
+    
+    return {
+        "window_hours": hours,
+        "since": since,
+        "hourly": hourly,
+        "totals": totals,
+        "top_cities": top_cities,
+        "top_areas": top_areas,
+        "last_log_id": last_log_id,
+        "pending_logs": latest_log_id - last_log_id,
+        "refreshed_at": state["updated_at"] if state else None,
+    }
+
+maintenance_scheduler = MaintenanceScheduler()
+maintenance_scheduler.add_job("purge_expired_tokens", TOKEN_PURGE_INTERVAL_SECONDS, purge_expired_tokens)
+maintenance_scheduler.add_job("table_stats", TOKEN_PURGE_INTERVAL_SECONDS, collect_table_stats)
+maintenance_scheduler.add_job("token_revocations", TOKEN_REVOCATION_SYNC_SECONDS, sync_token_revocations)
+maintenance_scheduler.add_job("activity_rollups", ACTIVITY_ROLLUP_INTERVAL_SECONDS, refresh_activity_rollups)
+maintenance_scheduler.add_job("optimize", DB_OPTIMIZE_INTERVAL_SECONDS, optimize_database, run_immediately=False)
+
 def log_sqlite_user_activity(user_id: int, activity_type: str, activity_data: dict = None):
-    """记录用户活动日志"""
+    """记录用户活动日志（放入后台写入队列）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO user_activity_logs (user_id, activity_type, activity_data)
-            VALUES (?, ?, ?)
-        """, (user_id, activity_type, json.dumps(activity_data) if activity_data else None))
-        
-        conn.commit()
-        conn.close()
-        
+        activity_writer.log(user_id, activity_type, activity_data)
     except Exception as e:
         print(f"记录用户活动失败: {e}")
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="初始化SQLite数据库并创建测试管理员账户")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="把已有数据库一次性迁移为增量回收模式（整库VACUUM，需先停止服务）")
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        print(f"增量回收迁移: {enable_incremental_vacuum()}")
+
     # 初始化数据库
     if init_sqlite_database():
         print("SQLite数据库初始化完成")
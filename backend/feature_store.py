@@ -0,0 +1,154 @@
+"""
+特征仓库 - 按数据集版本为每个 (城市, 区域) 序列预计算一次日历、滞后和滚动特征
+
+所有序列的数组都切片自同一组按 (city, area, date) 排序的连续只读数组，
+滞后矩阵和回看窗口通过 stride tricks 生成视图，训练和推理直接读取而不复制数据。
+"""
+import os
+import threading
+from functools import cached_property
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'housing_data.csv')
+
+# 预计算的滞后阶数与滚动窗口（月）
+MAX_LAG = 12
+ROLLING_WINDOWS = (3, 6, 12)
+
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+class SeriesFeatures:
+    """单个 (城市, 区域) 的时间序列特征，所有数组均为只读"""
+
+    def __init__(self, city: str, area: str, dates: np.ndarray, price: np.ndarray,
+                 calendar: np.ndarray, rolling_mean: Dict[int, np.ndarray]):
+        self.city = city
+        self.area = area
+        self.dates = dates          # datetime64[ns]，按时间升序
+        self.price = price          # float64
+        self.calendar = calendar    # (n, 2) int64: [month, year]
+        self.rolling_mean = rolling_mean  # {窗口: 数组}，窗口不足处为 NaN
+
+    def __len__(self) -> int:
+        return len(self.price)
+
+    @property
+    def month(self) -> np.ndarray:
+        return self.calendar[:, 0]
+
+    @property
+    def year(self) -> np.ndarray:
+        return self.calendar[:, 1]
+
+    @property
+    def last_date(self) -> pd.Timestamp:
+        return pd.Timestamp(self.dates[-1])
+
+    def lags(self, max_lag: int = MAX_LAG) -> np.ndarray:
+        """
+        滞后矩阵视图，形状 (n - max_lag, max_lag + 1)：
+        第 i 行对应时刻 t = i + max_lag，列 k 为 price[t - k]
+        """
+        return sliding_window_view(self.price, max_lag + 1)[:, ::-1]
+
+    def windows(self, lookback: int, values: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        回看窗口视图，形状 (n - lookback + 1, lookback)，第 i 行为 values[i:i+lookback]。
+        values 默认为原始价格，也可传入同长度的缩放后序列。
+        """
+        return sliding_window_view(self.price if values is None else values, lookback)
+
+    @cached_property
+    def frame(self) -> pd.DataFrame:
+        """兼容需要DataFrame的模型（如Prophet）"""
+        return pd.DataFrame({"date": self.dates, "price": self.price})
+
+
+class FeatureStore:
+    """一个数据集版本对应的全部序列特征"""
+
+    def __init__(self, df: pd.DataFrame, version: str):
+        self.version = version
+        self._series: Dict[Tuple[str, str], SeriesFeatures] = {}
+        self._build(df)
+
+    def _build(self, df: pd.DataFrame):
+        ordered = df.sort_values(['city', 'area', 'date'], kind='stable')
+        dates = pd.to_datetime(ordered['date']).values
+        date_index = pd.DatetimeIndex(dates)
+
+        # 全量连续数组，各序列的特征都是其中的切片视图
+        price = _readonly(ordered['price'].to_numpy(dtype=np.float64, copy=True))
+        dates = _readonly(np.array(dates, dtype='datetime64[ns]'))
+        calendar = _readonly(np.column_stack([date_index.month, date_index.year]).astype(np.int64))
+
+        keys = ordered[['city', 'area']].to_numpy()
+        # 序列边界：city 或 area 发生变化的位置
+        if len(keys):
+            changed = np.any(keys[1:] != keys[:-1], axis=1)
+            starts = np.concatenate([[0], np.flatnonzero(changed) + 1])
+        else:
+            starts = np.array([], dtype=np.int64)
+        ends = np.append(starts[1:], len(keys))
+
+        for start, end in zip(starts, ends):
+            series_price = price[start:end]
+            rolling = {}
+            for window in ROLLING_WINDOWS:
+                values = np.full(len(series_price), np.nan)
+                if len(series_price) >= window:
+                    values[window - 1:] = sliding_window_view(series_price, window).mean(axis=1)
+                rolling[window] = _readonly(values)
+
+            city, area = keys[start]
+            self._series[(city, area)] = SeriesFeatures(
+                city=city,
+                area=area,
+                dates=dates[start:end],
+                price=series_price,
+                calendar=calendar[start:end],
+                rolling_mean=rolling,
+            )
+
+    def get_series(self, city: str, area: str) -> Optional[SeriesFeatures]:
+        return self._series.get((city, area))
+
+    def series_keys(self):
+        return list(self._series.keys())
+
+
+def dataset_version(path: str) -> str:
+    """根据文件大小和修改时间生成数据集版本号，文件更新后版本随之变化"""
+    stat = os.stat(path)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+_store_lock = threading.Lock()
+_stores: Dict[str, FeatureStore] = {}
+
+
+def get_feature_store(path: str = DEFAULT_DATA_PATH) -> FeatureStore:
+    """获取数据文件当前版本的特征仓库，版本变化时重新构建"""
+    path = os.path.abspath(path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"CSV文件不存在: {path}")
+
+    version = dataset_version(path)
+    store = _stores.get(path)
+    if store is not None and store.version == version:
+        return store
+
+    with _store_lock:
+        store = _stores.get(path)
+        if store is None or store.version != version:
+            store = FeatureStore(pd.read_csv(path), version)
+            _stores[path] = store
+        return store
@@ -0,0 +1,181 @@
+"""
+轻量CPU推理运行时 - 将训练好的Keras模型导出为NumPy权重并用纯NumPy前向计算
+
+导出文件为 .npz 格式，加载和推理都不需要导入 TensorFlow，
+可显著降低预测接口的冷启动时间和工作进程内存占用。
+"""
+import json
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+# 运行时格式版本，前向计算逻辑变化时递增
+RUNTIME_FORMAT_VERSION = 1
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0.0),
+    "tanh": np.tanh,
+    "sigmoid": _sigmoid,
+}
+
+
+class MinMaxParams:
+    """MinMaxScaler 的最小替代，只保留推理所需的 scale_/min_ 参数"""
+
+    def __init__(self, scale: np.ndarray, min_: np.ndarray):
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+        self.min_ = np.asarray(min_, dtype=np.float64)
+
+    def transform(self, X) -> np.ndarray:
+        return np.asarray(X, dtype=np.float64) * self.scale_ + self.min_
+
+    def inverse_transform(self, X) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.min_) / self.scale_
+
+
+class NumpySequential:
+    """Sequential 模型的纯NumPy前向计算，支持 Dense 与 LSTM 层（Dropout 推理时为恒等映射）"""
+
+    def __init__(self, spec: List[Dict[str, Any]], weights: List[List[np.ndarray]]):
+        self.spec = spec
+        self.weights = weights
+
+    def predict(self, x, verbose: int = 0) -> np.ndarray:
+        out = np.asarray(x, dtype=np.float32)
+        for layer, params in zip(self.spec, self.weights):
+            if layer["type"] == "dense":
+                kernel, bias = params
+                out = ACTIVATIONS[layer["activation"]](out @ kernel + bias)
+            elif layer["type"] == "lstm":
+                out = self._lstm_forward(layer, params, out)
+            else:
+                raise ValueError(f"不支持的层类型: {layer['type']}")
+        return out
+
+    @staticmethod
+    def _lstm_forward(layer: Dict[str, Any], params: List[np.ndarray], x: np.ndarray) -> np.ndarray:
+        # Keras 门顺序: input, forget, cell, output
+        kernel, recurrent_kernel, bias = params
+        units = layer["units"]
+        act = ACTIVATIONS[layer["activation"]]
+        rec_act = ACTIVATIONS[layer["recurrent_activation"]]
+
+        batch, steps, _ = x.shape
+        h = np.zeros((batch, units), dtype=x.dtype)
+        c = np.zeros((batch, units), dtype=x.dtype)
+        # 输入投影与时间步无关，一次性批量计算
+        x_proj = x @ kernel + bias
+        outputs = []
+        for t in range(steps):
+            z = x_proj[:, t, :] + h @ recurrent_kernel
+            i = rec_act(z[:, :units])
+            f = rec_act(z[:, units:2 * units])
+            c_bar = act(z[:, 2 * units:3 * units])
+            o = rec_act(z[:, 3 * units:])
+            c = f * c + i * c_bar
+            h = o * act(c)
+            if layer["return_sequences"]:
+                outputs.append(h)
+        return np.stack(outputs, axis=1) if layer["return_sequences"] else h
+
+
+def _export_layers(model) -> tuple:
+    """从Keras Sequential模型提取层结构和权重"""
+    spec, weights = [], []
+    for layer in model.layers:
+        layer_type = layer.__class__.__name__
+        config = layer.get_config()
+        if layer_type == "Dense":
+            spec.append({"type": "dense", "activation": config.get("activation", "linear")})
+        elif layer_type == "LSTM":
+            spec.append({
+                "type": "lstm",
+                "units": int(config["units"]),
+                "return_sequences": bool(config.get("return_sequences", False)),
+                "activation": config.get("activation", "tanh"),
+                "recurrent_activation": config.get("recurrent_activation", "sigmoid"),
+            })
+        elif layer_type == "Dropout":
+            continue
+        else:
+            raise ValueError(f"不支持导出的层类型: {layer_type}")
+
+        if spec[-1]["activation"] not in ACTIVATIONS or \
+                spec[-1].get("recurrent_activation", "sigmoid") not in ACTIVATIONS:
+            raise ValueError(f"不支持导出的激活函数: {spec[-1]}")
+        weights.append([np.asarray(w, dtype=np.float32) for w in layer.get_weights()])
+    return spec, weights
+
+
+def export_runtime_model(model_data: Dict[str, Any], model_type: str, path: str) -> None:
+    """将 train_dnn_model / train_lstm_model 的结果导出为 .npz 推理文件"""
+    spec, weights = _export_layers(model_data["model"])
+
+    arrays = {}
+    for i, params in enumerate(weights):
+        for j, w in enumerate(params):
+            arrays[f"layer{i}_{j}"] = w
+
+    meta = {
+        "format_version": RUNTIME_FORMAT_VERSION,
+        "model_type": model_type,
+        "spec": spec,
+        "param_counts": [len(p) for p in weights],
+    }
+
+    if model_type == "DNN":
+        scalers = {"X": model_data["X_scaler"], "y": model_data["y_scaler"]}
+    elif model_type == "LSTM":
+        scalers = {"scaler": model_data["scaler"]}
+        meta["lookback"] = int(model_data["lookback"])
+    else:
+        raise ValueError(f"不支持导出的模型类型: {model_type}")
+
+    for name, scaler in scalers.items():
+        arrays[f"scaler_{name}_scale"] = np.asarray(scaler.scale_, dtype=np.float64)
+        arrays[f"scaler_{name}_min"] = np.asarray(scaler.min_, dtype=np.float64)
+
+    arrays["meta"] = np.array(json.dumps(meta))
+
+    # 先写临时文件再替换，避免并发请求读到半个文件
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_runtime_model(path: str) -> Dict[str, Any]:
+    """加载 .npz 推理文件，返回与训练函数结构一致的 model_data 字典"""
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data["meta"]))
+        if meta.get("format_version") != RUNTIME_FORMAT_VERSION:
+            raise ValueError(f"推理文件版本不匹配: {meta.get('format_version')}")
+
+        weights = [
+            [data[f"layer{i}_{j}"] for j in range(count)]
+            for i, count in enumerate(meta["param_counts"])
+        ]
+
+        def scaler(name):
+            return MinMaxParams(data[f"scaler_{name}_scale"], data[f"scaler_{name}_min"])
+
+        model = NumpySequential(meta["spec"], weights)
+        if meta["model_type"] == "DNN":
+            return {
+                "model": model,
+                "X_scaler": scaler("X"),
+                "y_scaler": scaler("y"),
+                "runtime": "numpy",
+            }
+        return {
+            "model": model,
+            "scaler": scaler("scaler"),
+            "lookback": meta["lookback"],
+            "runtime": "numpy",
+        }
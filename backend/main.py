@@ -1,4 +1,6 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import pandas as pd
@@ -10,187 +12,35 @@ import json
 from typing import Optional
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 import pandas as pd
 import numpy as np
 import os
 import joblib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 # 导入数据库模块（使用SQLite）
-from backend.database import init_sqlite_database, SQLiteUserManager, log_sqlite_user_activity
+from backend.database import (
+    init_sqlite_database, SQLiteUserManager, log_sqlite_user_activity,
+    db_pool, token_cache, activity_writer, maintenance_scheduler, get_table_stats,
+    get_activity_rollups, USER_LIST_DEFAULT_LIMIT, USER_LIST_MAX_LIMIT
+)
+from backend.ai_service import ASSISTANT_SYSTEM_PROMPT, AIService
+from backend.async_database import async_user_manager
+from backend.feature_store import SeriesFeatures, dataset_version, get_feature_store
+from backend.query_router import QueryRouter
+from backend.rate_limit import (
+    RATE_LIMIT_PERSIST, RATE_LIMIT_SNAPSHOT_SECONDS, RATE_LIMITS, RateLimitMiddleware, rate_limiter
+)
+from backend.security import TOKEN_MODE, password_service, revocation_list, token_signer
+from backend.user_import import USER_IMPORT_MAX_BYTES, UserImportError, import_users, parse_user_file
+from backend.training_governor import TrainingQueueFull, apply_tensorflow_thread_budget, training_governor
 UserManager = SQLiteUserManager
+AsyncUserManager = async_user_manager
 log_user_activity = log_sqlite_user_activity
 DB_TYPE = "sqlite"
 
-import os
-import json
-import requests
-from typing import Dict, Any, Optional
-import pandas as pd
-
-class AIService:
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key or "MDc3YWI0YjUtMDdlYi00Y2Y3LTgzMTAtZTA4OGQ5NTBkOGFh"
-        self.api_url = "https://chat3.eqing.tech/v1/chat/completions"
-
-        if not self.api_key:
-            raise ValueError("AI API密钥未设置")
-
-    def chat_with_ai(self, prompt: str, system_prompt: str = None, temperature: float = 0.3) -> Dict[str, Any]:
-        """
-        调用AI API进行对话 - 修复版本
-        """
-        try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-
-            messages = []
-
-            # 添加系统提示
-            if system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
-
-            # 添加用户消息
-            messages.append({
-                "role": "user",
-                "content": prompt
-            })
-
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": 1500,  # 减少token数量避免超限
-                "stream": False
-            }
-
-            print(f"🔄 发送AI请求...")
-            print(f"📝 Prompt长度: {len(prompt)} 字符")
-
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-
-            print(f"📊 API响应状态: {response.status_code}")
-
-            if response.status_code != 200:
-                print(f"❌ API错误响应: {response.text}")
-                return {"error": f"API调用失败: {response.status_code} - {response.text}"}
-
-            result = response.json()
-            print(f"✅ API调用成功")
-
-            # 提取AI回复内容
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0]["message"]["content"]
-
-                # 直接返回文本内容，不要尝试解析JSON
-                return {
-                    "text": content,
-                    "raw_response": True,
-                    "model_used": result.get("model", "gpt-3.5-turbo"),
-                    "tokens_used": result.get("usage", {}).get("total_tokens", 0)
-                }
-            else:
-                print(f"❌ API返回格式异常: {result}")
-                return {"error": "API返回格式异常"}
-
-        except requests.exceptions.Timeout:
-            print("❌ 请求超时")
-            return {"error": "请求超时，请稍后重试"}
-        except requests.exceptions.ConnectionError:
-            print("❌ 网络连接错误")
-            return {"error": "网络连接失败"}
-        except requests.exceptions.RequestException as e:
-            print(f"❌ 网络请求错误: {str(e)}")
-            return {"error": f"网络请求失败: {str(e)}"}
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON解析错误: {str(e)}")
-            return {"error": f"响应解析失败: {str(e)}"}
-        except Exception as e:
-            print(f"❌ 未知错误: {str(e)}")
-            return {"error": f"AI API调用失败: {str(e)}"}
-
-    def analyze_housing_trend(self, city: str, area: Optional[str], data: pd.DataFrame) -> Dict[str, Any]:
-        """
-        使用AI分析房价趋势 - 修复版本
-        """
-        try:
-            if data.empty:
-                return {"error": "没有足够的数据进行分析"}
-
-            # 数据预处理和统计计算
-            data_sorted = data.sort_values('date')
-            recent_data = data_sorted.tail(12)  # 最近12个月
-
-            # 计算基础统计
-            current_price = float(recent_data['price'].iloc[-1]) if not recent_data.empty else None
-            avg_price = float(recent_data['price'].mean()) if not recent_data.empty else None
-            price_change = None
-            price_change_pct = None
-
-            if len(recent_data) >= 2:
-                old_price = float(recent_data['price'].iloc[0])
-                price_change = current_price - old_price
-                price_change_pct = (price_change / old_price) * 100
-
-            location = f"{city}市{area}区域" if area else f"{city}市"
-
-            # 简化的分析提示，避免过长
-            system_prompt = """你是专业的房地产分析师。请用中文分析房价数据，提供简洁实用的分析和建议。"""
-
-            user_prompt = f"""分析{location}房价趋势：
-
-当前价格：{current_price:.0f}元/㎡
-平均价格：{avg_price:.0f}元/㎡
-价格变化：{price_change_pct:.1f}%
-数据期间：{len(recent_data)}个月
-
-请提供：
-1. 趋势判断（上涨/下跌/平稳）
-2. 价格水平评估
-3. 投资建议（3-4条）
-4. 风险提示
-
-请用简洁专业的语言回答，重点突出。"""
-
-            print(f"🤖 开始AI分析: {location}")
-
-            # 调用AI API
-            result = self.chat_with_ai(user_prompt, system_prompt)
-
-            # 处理AI响应
-            if "error" not in result:
-                # 添加基础统计数据
-                result["basic_stats"] = {
-                    "current_price": round(current_price, 2) if current_price else None,
-                    "average_price": round(avg_price, 2) if avg_price else None,
-                    "price_change": round(price_change, 2) if price_change else None,
-                    "price_change_percentage": round(price_change_pct, 2) if price_change_pct else None,
-                    "sample_count": len(recent_data),
-                    "price_range": {
-                        "min": round(float(recent_data['price'].min()), 2),
-                        "max": round(float(recent_data['price'].max()), 2)
-                    }
-                }
-                print(f"✅ AI分析完成")
-            else:
-                print(f"❌ AI分析失败: {result['error']}")
-
-            return result
-
-        except Exception as e:
-            print(f"❌ 房价趋势分析出错: {str(e)}")
-            return {"error": f"分析失败: {str(e)}"}
-
 # 创建全局服务实例
 ai_service = AIService()
 
@@ -239,10 +89,11 @@ def validate_password(password: str) -> bool:
         return False
     return True
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """获取当前登录用户"""
-    token = credentials.credentials
-    result = UserManager.verify_token(token)
+    if not credentials:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    result = await AsyncUserManager.verify_token(credentials.credentials)
     if not result.get("success"):
         raise HTTPException(status_code=401, detail="Invalid token")
     return result["user"]
@@ -252,7 +103,7 @@ def is_admin_user(user: dict) -> bool:
     """检查用户是否为管理员"""
     return user.get("full_name") == "管理员"
 
-def require_admin_permission(current_user: dict = Depends(get_current_user)):
+async def require_admin_permission(current_user: dict = Depends(get_current_user)):
     """要求管理员权限的依赖项"""
     if not is_admin_user(current_user):
         raise HTTPException(
@@ -261,17 +112,20 @@ def require_admin_permission(current_user: dict = Depends(get_current_user)):
         )
     return current_user
 
-def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
     if not credentials:
         return None
     try:
-        return get_current_user(credentials)
+        return await get_current_user(credentials)
     except HTTPException:
         return None
 
 
 app = FastAPI(title="房价分析系统后端API")
 
+# 请求限流（先注册，位于CORS中间件内层，429响应同样带跨域头）
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # 允许跨域，便于前端本地开发
 app.add_middleware(
     CORSMiddleware,
@@ -289,16 +143,41 @@ async def startup_event():
     try:
         if init_sqlite_database():
             print("SQLite数据库初始化完成")
+            activity_writer.start()
+            maintenance_scheduler.add_job("rate_limit_sweep", 60, rate_limiter.buckets.sweep)
+            if RATE_LIMIT_PERSIST:
+                print(f"已恢复 {rate_limiter.load()} 个限流令牌桶")
+                maintenance_scheduler.add_job("rate_limit_snapshot", RATE_LIMIT_SNAPSHOT_SECONDS,
+                                              rate_limiter.save, run_immediately=False)
+            maintenance_scheduler.start()
         else:
             print("SQLite数据库初始化失败")
     except Exception as e:
         print(f"数据库初始化失败: {e}")
         print("系统将以基础模式运行，用户管理功能可能不可用")
 
+@app.on_event("shutdown")
+async def close_ai_clients():
+    """关闭AI服务的长连接池"""
+    await ai_service.aclose()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """应用关闭时写完剩余的活动日志并释放数据库连接"""
+    activity_writer.stop()
+    maintenance_scheduler.stop()
+    if RATE_LIMIT_PERSIST:
+        rate_limiter.save()
+    db_pool.close_all()
+
 # 数据加载
 DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'housing_data.csv')
 df = pd.read_csv(DATA_PATH)
 df['date'] = pd.to_datetime(df['date'])
+# 已加载数据的版本，AI分析缓存以此区分不同版本的数据
+DATA_VERSION = dataset_version(DATA_PATH)
+# AI助手的本地问答路由：价格查询、排名等事实性问题直接用已加载的数据回答
+query_router = QueryRouter(df)
 
 
 @app.get("/")
@@ -465,7 +344,7 @@ class AIQueryRequest(BaseModel):
 # ==================== 用户管理API接口 ====================
 
 @app.post("/auth/register", response_model=dict)
-def register_user(user_data: UserRegister):
+async def register_user(user_data: UserRegister):
     """用户注册"""
     try:
         # 验证用户名格式
@@ -482,7 +361,7 @@ def register_user(user_data: UserRegister):
                 detail="密码长度至少6位"
             )
         
-        result = UserManager.create_user(
+        result = await AsyncUserManager.create_user(
             username=user_data.username,
             email=user_data.email,
             password=user_data.password,
@@ -495,6 +374,11 @@ def register_user(user_data: UserRegister):
                 "message": result["message"],
                 "user": result["user"]
             }
+        elif result.get("busy"):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=result["message"]
+            )
         else:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -510,10 +394,10 @@ def register_user(user_data: UserRegister):
         )
 
 @app.post("/auth/login")
-def login_user(login_data: UserLogin):
+async def login_user(login_data: UserLogin):
     """用户登录"""
     try:
-        result = UserManager.authenticate_user(
+        result = await AsyncUserManager.authenticate_user(
             username=login_data.username,
             password=login_data.password
         )
@@ -533,6 +417,11 @@ def login_user(login_data: UserLogin):
                 "token": result["token"],
                 "expires_at": result["expires_at"]
             }
+        elif result.get("busy"):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=result["message"]
+            )
         else:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -548,11 +437,15 @@ def login_user(login_data: UserLogin):
         )
 
 @app.post("/auth/logout")
-def logout_user(current_user: dict = Depends(get_current_user)):
+async def logout_user(
+    current_user: dict = Depends(get_current_user),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
     """用户登出"""
     try:
-        # 注意：这里需要从请求头获取token，实际实现可能需要调整
-        # 为简化，我们记录登出活动
+        # 吊销令牌：删除数据库记录并加入内存吊销集合
+        await AsyncUserManager.invalidate_token(credentials.credentials)
+
         log_user_activity(
             user_id=current_user["id"],
             activity_type="logout"
@@ -567,7 +460,7 @@ def logout_user(current_user: dict = Depends(get_current_user)):
         )
 
 @app.get("/auth/me")
-def get_current_user_info(current_user: dict = Depends(get_current_user)):
+async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     """获取当前用户信息"""
     # 添加管理员身份标识
     user_info = current_user.copy()
@@ -579,22 +472,50 @@ def get_current_user_info(current_user: dict = Depends(get_current_user)):
     }
 
 @app.get("/auth/users")
-def get_all_users(current_user: dict = Depends(require_admin_permission)):
-    """获取所有用户列表（管理员功能）"""
+async def get_all_users(
+    limit: int = Query(USER_LIST_DEFAULT_LIMIT, ge=1, le=USER_LIST_MAX_LIMIT, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    is_active: Optional[bool] = Query(None, description="按账户状态筛选"),
+    username_prefix: Optional[str] = Query(None, description="用户名前缀"),
+    created_from: Optional[str] = Query(None, description="创建时间下界（含），如 2024-01-01"),
+    created_to: Optional[str] = Query(None, description="创建时间上界（不含）"),
+    include_total: bool = Query(False, description="是否统计符合条件的总数"),
+    current_user: dict = Depends(require_admin_permission)
+):
+    """分页获取用户列表（管理员功能）"""
     try:
-        result = UserManager.get_user_list()
+        result = await AsyncUserManager.get_user_list(
+            limit=limit,
+            cursor=cursor,
+            is_active=is_active,
+            username_prefix=username_prefix,
+            created_from=created_from,
+            created_to=created_to,
+            include_total=include_total
+        )
         
         if result["success"]:
-            # 记录查看用户列表活动
-            log_user_activity(
-                user_id=current_user["id"],
-                activity_type="view_users"
-            )
+            # 只在首页记录查看用户列表活动，翻页不重复记录
+            if not cursor:
+                log_user_activity(
+                    user_id=current_user["id"],
+                    activity_type="view_users"
+                )
             
-            return {
+            response = {
                 "success": True,
-                "users": result["users"]
+                "users": result["users"],
+                "next_cursor": result["next_cursor"],
+                "has_more": result["has_more"]
             }
+            if "total" in result:
+                response["total"] = result["total"]
+            return response
+        elif result.get("invalid"):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=result["message"]
+            )
         else:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -609,6 +530,115 @@ def get_all_users(current_user: dict = Depends(require_admin_permission)):
             detail=f"获取用户列表失败: {str(e)}"
         )
 
+class UserStatusUpdate(BaseModel):
+    is_active: bool
+
+@app.post("/auth/users/{user_id}/status")
+async def update_user_status(user_id: int, status_data: UserStatusUpdate, current_user: dict = Depends(require_admin_permission)):
+    """启用/停用用户（管理员功能），停用后该用户的令牌立即失效"""
+    if user_id == current_user["id"] and not status_data.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="不能停用当前登录的管理员账户"
+        )
+
+    result = await AsyncUserManager.set_user_active(user_id, status_data.is_active)
+    if not result["success"]:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND if result["message"] == "用户不存在" else status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=result["message"]
+        )
+
+    log_user_activity(
+        user_id=current_user["id"],
+        activity_type="update_user_status",
+        activity_data={"target_user_id": user_id, "is_active": status_data.is_active}
+    )
+    return result
+
+@app.get("/admin/db/stats")
+def get_db_stats(current_user: dict = Depends(require_admin_permission)):
+    """数据库运行状态（管理员功能）：连接池、令牌缓存、活动日志写入队列、表大小和维护任务"""
+    return {
+        "success": True,
+        "connection_pool": db_pool.stats(),
+        "token_cache": token_cache.stats(),
+        "activity_writer": activity_writer.stats(),
+        "async_executors": AsyncUserManager.stats(),
+        "tables": get_table_stats(),
+        "maintenance": maintenance_scheduler.stats(),
+        "password_hashing": password_service.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "tokens": {"mode": TOKEN_MODE, "active_kid": token_signer.active_kid, **revocation_list.stats()},
+        "ai": {**ai_service.stats(), "query_router": query_router.stats()}
+    }
+
+@app.delete("/admin/ai/cache")
+def clear_ai_cache(current_user: dict = Depends(require_admin_permission)):
+    """清空AI趋势分析缓存（管理员功能）"""
+    return {"success": True, "deleted": ai_service.cache.clear()}
+
+@app.post("/admin/users/import")
+async def import_users_endpoint(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|json)$", description="请求体格式：csv 或 json"),
+    dry_run: bool = Query(False, description="只校验，不写入"),
+    current_user: dict = Depends(require_admin_permission)
+):
+    """
+    批量导入用户（管理员功能）。请求体为CSV或JSON文件内容，
+    列为 username, email, password（可选，缺省时生成临时密码）, full_name（可选）。
+    """
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"导入文件不能超过 {USER_IMPORT_MAX_BYTES // 1024} KB"
+    )
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > USER_IMPORT_MAX_BYTES:
+        raise too_large
+    # 未声明长度（分块传输）时边读边计数，超出上限立即停止读取
+    chunks, received = [], 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > USER_IMPORT_MAX_BYTES:
+            raise too_large
+        chunks.append(chunk)
+    
+    # 解析、校验、哈希和写入都是阻塞操作，放到线程池中执行，不阻塞事件循环
+    try:
+        df = await run_in_threadpool(parse_user_file, b"".join(chunks), format)
+    except UserImportError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    result = await run_in_threadpool(import_users, df, dry_run)
+    if not result["success"]:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE if result.get("busy") else status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=result["message"]
+        )
+    
+    log_user_activity(
+        user_id=current_user["id"],
+        activity_type="import_users",
+        activity_data={"total": result["total"], "created": result["created"], "dry_run": dry_run}
+    )
+    return result
+
+@app.get("/admin/activity/rollups")
+def get_activity_summary(
+    hours: int = Query(24, ge=1, le=24 * 30, description="统计最近多少小时"),
+    top: int = Query(10, ge=1, le=100, description="热门城市/区域数量"),
+    current_user: dict = Depends(require_admin_permission)
+):
+    """用户活动汇总（管理员功能）：按小时的活动类型计数和热门查询城市/区域，数据来自后台增量汇总表"""
+    try:
+        return {"success": True, **get_activity_rollups(hours=hours, top=top)}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取活动汇总失败: {str(e)}"
+        )
+
 # ==================== 需要登录的房价分析接口 ====================
 
 @app.get("/protected/search")
@@ -647,6 +677,8 @@ class PredictionRequest(BaseModel):
     model_type: str = "DNN"  # DNN, LSTM, Prophet
     periods: int = 6  # 预测未来几个月
     features: List[str] = ["month", "year", "price"]
+    intervals: Optional[List[int]] = None  # 预测区间置信水平(%)，如 [80, 95]；为空则只返回点预测
+    n_samples: int = 500  # 蒙特卡洛模拟路径数
 
 # 预测结果模型
 class PredictionResponse(BaseModel):
@@ -655,13 +687,11 @@ class PredictionResponse(BaseModel):
     predictions: Optional[List[dict]] = None
     metrics: Optional[dict] = None
 
-# 加载房价数据
-def load_housing_data():
-    csv_path = os.path.join("data", "housing_data.csv")
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"CSV文件不存在: {csv_path}")
-
-    return pd.read_csv(csv_path)
+# 推理运行时: "numpy" 时DNN/LSTM优先从导出的NumPy权重推理（无需导入TensorFlow），"keras" 时始终加载完整模型
+INFERENCE_RUNTIME = os.environ.get("HOUSING_INFERENCE_RUNTIME", "numpy").lower()
+RUNTIME_EXPORTABLE_MODELS = ("DNN", "LSTM")
+SUPPORTED_MODEL_TYPES = ("DNN", "LSTM", "Prophet")
+MODEL_MAX_AGE_DAYS = 7
 
 # 获取预训练模型路径
 def get_model_path(city: str, area: str, model_type: str):
@@ -671,45 +701,130 @@ def get_model_path(city: str, area: str, model_type: str):
     filename = f"{model_type.lower()}_model.pkl"
     return os.path.join(model_dir, filename)
 
-# 训练并获取模型
-def get_or_train_model(city: str, area: str, model_type: str, df: pd.DataFrame):
+# 获取轻量推理文件路径
+def get_runtime_path(city: str, area: str, model_type: str):
+    model_dir = os.path.join("models", city, area)
+    os.makedirs(model_dir, exist_ok=True)
+
+    filename = f"{model_type.lower()}_runtime.npz"
+    return os.path.join(model_dir, filename)
+
+def is_model_fresh(path: str) -> bool:
+    """模型文件存在且不超过有效期"""
+    if not os.path.exists(path):
+        return False
+    model_time = os.path.getmtime(path)
+    return (datetime.now() - datetime.fromtimestamp(model_time)).days < MODEL_MAX_AGE_DAYS
+
+def export_runtime(city: str, area: str, model_type: str, model_data, source_path: str = None):
+    """导出轻量推理文件，失败时不影响预测（回退到Keras推理）"""
+    from backend.inference import export_runtime_model
+
+    runtime_path = get_runtime_path(city, area, model_type)
+    try:
+        export_runtime_model(model_data, model_type, runtime_path)
+        # 推理文件沿用源模型的时间戳，保证两者同时过期
+        if source_path:
+            model_time = os.path.getmtime(source_path)
+            os.utime(runtime_path, (model_time, model_time))
+    except Exception as e:
+        print(f"⚠️ 导出推理文件失败({city}{area} {model_type}): {e}")
+
+def load_cached_model(city: str, area: str, model_type: str, fit_info: dict):
+    """加载未过期的模型，没有可用模型时返回 None"""
     model_path = get_model_path(city, area, model_type)
+    use_runtime = INFERENCE_RUNTIME == "numpy" and model_type in RUNTIME_EXPORTABLE_MODELS
+
+    # 优先使用导出的NumPy推理文件，整个预测过程不导入TensorFlow
+    if use_runtime:
+        runtime_path = get_runtime_path(city, area, model_type)
+        if is_model_fresh(runtime_path):
+            from backend.inference import load_runtime_model
+            try:
+                model = load_runtime_model(runtime_path)
+                fit_info["model_source"] = "runtime"
+                return model
+            except Exception as e:
+                print(f"⚠️ 加载推理文件失败，回退到完整模型: {e}")
 
     # 如果模型已存在并且不超过7天，则直接加载
-    if os.path.exists(model_path):
-        model_time = os.path.getmtime(model_path)
-        if (datetime.now() - datetime.fromtimestamp(model_time)).days < 7:
-            return joblib.load(model_path)
+    if is_model_fresh(model_path):
+        model = joblib.load(model_path)
+        if use_runtime:
+            export_runtime(city, area, model_type, model, source_path=model_path)
+        fit_info["model_source"] = "cache"
+        return model
+
+    return None
+
+# 训练并获取模型
+def get_or_train_model(city: str, area: str, model_type: str, series: SeriesFeatures, fit_info: dict = None):
+    """
+    获取可用模型，必要时重新训练。
+    fit_info 若传入字典，会写入模型来源(model_source)、训练耗时(fit_time_seconds)、是否热启动(warm_start)
+    以及训练排队信息(queue_position, queue_wait_seconds)
+    """
+    if fit_info is None:
+        fit_info = {}
+    fit_info.update({"model_source": "cache", "fit_time_seconds": 0.0, "warm_start": False})
+
+    model = load_cached_model(city, area, model_type, fit_info)
+    if model is not None:
+        return model
 
-    # 否则重新训练模型
+    # 否则在训练调度器分配的槽位中重新训练模型
+    with training_governor.slot(f"{city}{area} {model_type}") as job:
+        fit_info["queue_position"] = job.initial_position
+        fit_info["queue_wait_seconds"] = round(job.wait_seconds, 3)
+
+        # 排队期间其他请求可能已训练好同一个模型
+        model = load_cached_model(city, area, model_type, fit_info)
+        if model is not None:
+            return model
+
+        return train_and_save_model(city, area, model_type, series, fit_info)
+
+def train_and_save_model(city: str, area: str, model_type: str, series: SeriesFeatures, fit_info: dict):
+    model_path = get_model_path(city, area, model_type)
+    use_runtime = INFERENCE_RUNTIME == "numpy" and model_type in RUNTIME_EXPORTABLE_MODELS
+
+    fit_info["model_source"] = "trained"
+    fit_start = time.perf_counter()
     if model_type == "DNN":
-        model = train_dnn_model(df)
+        model = train_dnn_model(series)
     elif model_type == "LSTM":
-        model = train_lstm_model(df)
+        model = train_lstm_model(series)
     elif model_type == "Prophet":
-        model = train_prophet_model(df)
+        # 过期的旧模型用于热启动
+        previous_model = None
+        if os.path.exists(model_path):
+            try:
+                previous_model = joblib.load(model_path)
+            except Exception as e:
+                print(f"⚠️ 加载旧Prophet模型失败，将从头训练: {e}")
+        model = train_prophet_model(series, previous_model=previous_model, fit_info=fit_info)
     else:
         raise ValueError(f"不支持的模型类型: {model_type}")
+    fit_info["fit_time_seconds"] = round(time.perf_counter() - fit_start, 3)
 
     # 保存模型
     joblib.dump(model, model_path)
+    if use_runtime:
+        export_runtime(city, area, model_type, model)
     return model
 
 # DNN模型训练函数
-def train_dnn_model(df):
+def train_dnn_model(series: SeriesFeatures):
     # 简化版实现，实际项目中需要更复杂的模型
     from sklearn.preprocessing import MinMaxScaler
-    from sklearn.model_selection import train_test_split
     from tensorflow.keras.models import Sequential
     from tensorflow.keras.layers import Dense, Dropout
 
-    # 特征工程
-    df['month'] = pd.to_datetime(df['date']).dt.month
-    df['year'] = pd.to_datetime(df['date']).dt.year
+    apply_tensorflow_thread_budget()
 
-    # 准备数据
-    X = df[['month', 'year']].values
-    y = df['price'].values
+    # 准备数据（月份/年份特征由特征仓库预先计算）
+    X = series.calendar
+    y = series.price
 
     # 归一化
     X_scaler = MinMaxScaler()
@@ -737,30 +852,24 @@ def train_dnn_model(df):
     }
 
 # LSTM模型训练函数
-def train_lstm_model(df):
+def train_lstm_model(series: SeriesFeatures):
     from tensorflow.keras.models import Sequential
     from tensorflow.keras.layers import LSTM, Dense, Dropout
     from sklearn.preprocessing import MinMaxScaler
-    import numpy as np
 
-    # 准备数据
-    df = df.sort_values('date')
-    prices = df['price'].values.reshape(-1, 1)
+    apply_tensorflow_thread_budget()
+
+    # 准备数据（特征仓库中的序列已按日期排序）
+    prices = series.price.reshape(-1, 1)
 
     # 归一化
     scaler = MinMaxScaler()
-    prices_scaled = scaler.fit_transform(prices)
+    prices_scaled = scaler.fit_transform(prices).ravel()
 
-    # 创建序列数据
+    # 创建序列数据：滑动窗口视图，第i个样本为 prices_scaled[i:i+lookback]，目标为其后一个点
     lookback = 6
-    X, y = [], []
-
-    for i in range(len(prices_scaled) - lookback):
-        X.append(prices_scaled[i:i+lookback])
-        y.append(prices_scaled[i+lookback])
-
-    X = np.array(X)
-    y = np.array(y)
+    X = series.windows(lookback, prices_scaled[:-1])[..., np.newaxis]
+    y = prices_scaled[lookback:].reshape(-1, 1)
 
     # 模型定义
     model = Sequential([
@@ -780,59 +889,126 @@ def train_lstm_model(df):
         'lookback': lookback
     }
 
+# Prophet拟合线程池：限制同时进行的Stan优化数量，避免并发请求抢占全部CPU核心
+PROPHET_FIT_WORKERS = max(1, int(os.environ.get("HOUSING_PROPHET_FIT_WORKERS", "2")))
+prophet_fit_pool = ThreadPoolExecutor(max_workers=PROPHET_FIT_WORKERS, thread_name_prefix="prophet-fit")
+
+def prophet_warm_start_params(model) -> dict:
+    """提取已拟合Prophet模型的参数，作为下一次拟合的Stan初始值"""
+    params = {}
+    for name in ['k', 'm', 'sigma_obs']:
+        if model.mcmc_samples == 0:
+            params[name] = model.params[name][0][0]
+        else:
+            params[name] = np.mean(model.params[name])
+    for name in ['delta', 'beta']:
+        if model.mcmc_samples == 0:
+            params[name] = model.params[name][0]
+        else:
+            params[name] = np.mean(model.params[name], axis=0)
+    return params
+
+def series_only_grew(previous_model, prophet_df: pd.DataFrame) -> bool:
+    """判断新序列是否只是在旧模型训练数据之后追加了新数据点"""
+    history = getattr(previous_model, 'history', None)
+    if history is None or len(prophet_df) < len(history):
+        return False
+    head = prophet_df.head(len(history))
+    return (
+        np.array_equal(head['ds'].values, history['ds'].values)
+        and np.allclose(head['y'].values, history['y'].values)
+    )
+
 # Prophet模型训练函数
-def train_prophet_model(df):
+def train_prophet_model(series: SeriesFeatures, previous_model=None, fit_info: dict = None):
     from prophet import Prophet
 
     # 准备数据
-    prophet_df = df[['date', 'price']].rename(columns={'date': 'ds', 'price': 'y'})
+    prophet_df = series.frame.rename(columns={'date': 'ds', 'price': 'y'})
+
+    # 序列只增长时用旧模型参数热启动，Stan优化从接近最优的位置开始
+    init = None
+    if previous_model is not None and series_only_grew(previous_model, prophet_df):
+        try:
+            init = prophet_warm_start_params(previous_model)
+        except Exception as e:
+            print(f"⚠️ 提取Prophet热启动参数失败: {e}")
+
+    if init is not None:
+        try:
+            model = Prophet()
+            prophet_fit_pool.submit(model.fit, prophet_df, init=init).result()
+            if fit_info is not None:
+                fit_info["warm_start"] = True
+            return model
+        except Exception as e:
+            # 参数维度可能因季节项/变点数量变化而不匹配，回退到冷启动
+            print(f"⚠️ Prophet热启动失败，改为从头训练: {e}")
 
     # 训练模型
     model = Prophet()
-    model.fit(prophet_df)
+    prophet_fit_pool.submit(model.fit, prophet_df).result()
 
     return model
 
-# 预测接口
+# 预测接口（同步函数，由线程池执行，训练排队时不会阻塞事件循环）
 @prediction_router.post("/predict", response_model=PredictionResponse)
-async def predict_prices(request: PredictionRequest):
+def predict_prices(request: PredictionRequest):
+    # 参数校验放在获取数据和训练槽位之前，无效请求不占用训练队列
+    if request.model_type not in SUPPORTED_MODEL_TYPES:
+        return {"success": False, "message": f"不支持的模型类型: {request.model_type}"}
+    levels = sorted({int(level) for level in request.intervals or []})
+    if any(level <= 0 or level >= 100 for level in levels):
+        return {"success": False, "message": "预测区间置信水平必须在1-99之间"}
+
     try:
-        # 从CSV加载数据
+        # 从特征仓库获取序列（按数据集版本缓存，各模型共享）
         try:
-            all_data = load_housing_data()
+            store = get_feature_store(DATA_PATH)
         except FileNotFoundError as e:
             return {"success": False, "message": str(e)}
 
-        # 筛选指定城市和区域的数据
-        df = all_data[(all_data['city'] == request.city) & (all_data['area'] == request.area)]
-
-        if df.empty:
+        series = store.get_series(request.city, request.area)
+        if series is None or len(series) == 0:
             return {"success": False, "message": f"没有找到{request.city}{request.area}的历史数据"}
 
-        # 确保日期列为日期类型
-        df['date'] = pd.to_datetime(df['date'])
-
         # 获取或训练模型
-        model_data = get_or_train_model(request.city, request.area, request.model_type, df)
+        fit_info = {}
+        try:
+            model_data = get_or_train_model(request.city, request.area, request.model_type, series, fit_info=fit_info)
+        except TrainingQueueFull as e:
+            return {"success": False, "message": str(e)}
 
         # 生成预测
-        last_date = df['date'].max()
+        last_date = series.last_date
         future_dates = pd.date_range(start=last_date + pd.Timedelta(days=30), periods=request.periods, freq='M')
 
         if request.model_type == "DNN":
             predictions = predict_with_dnn(model_data, future_dates)
         elif request.model_type == "LSTM":
-            predictions = predict_with_lstm(model_data, df, future_dates)
-        elif request.model_type == "Prophet":
-            predictions = predict_with_prophet(model_data, future_dates)
+            predictions = predict_with_lstm(model_data, series, future_dates)
         else:
-            return {"success": False, "message": f"不支持的模型类型: {request.model_type}"}
+            predictions = predict_with_prophet(model_data, future_dates)
 
         # 评估指标
-        metrics = calculate_metrics(df)
+        metrics = calculate_metrics(series)
+        metrics.update(fit_info)
+        metrics["dataset_version"] = store.version
+
+        # 预测区间（残差自助法，整批向量化模拟）
+        message = None
+        if levels:
+            n_samples = min(max(request.n_samples, MIN_INTERVAL_SAMPLES), MAX_INTERVAL_SAMPLES)
+            try:
+                paths = simulate_prediction_paths(request.model_type, model_data, series, predictions, n_samples)
+                attach_prediction_intervals(predictions, paths, levels)
+                metrics["interval_samples"] = n_samples
+            except ValueError as e:
+                message = f"预测区间计算失败: {str(e)}"
 
         return {
             "success": True,
+            "message": message,
             "predictions": predictions,
             "metrics": metrics
         }
@@ -871,13 +1047,13 @@ def predict_with_dnn(model_data, future_dates):
     return predictions
 
 # LSTM预测函数
-def predict_with_lstm(model_data, df, future_dates):
+def predict_with_lstm(model_data, series: SeriesFeatures, future_dates):
     model = model_data['model']
     scaler = model_data['scaler']
     lookback = model_data['lookback']
 
     # 准备最后一个序列
-    prices = df['price'].values.reshape(-1, 1)
+    prices = series.price[-lookback:].reshape(-1, 1)
     prices_scaled = scaler.transform(prices)
     last_sequence = prices_scaled[-lookback:].reshape(1, lookback, 1)
 
@@ -918,17 +1094,100 @@ def predict_with_prophet(model, future_dates):
 
     return predictions
 
+# 预测区间模拟路径数上下限
+MIN_INTERVAL_SAMPLES = 50
+MAX_INTERVAL_SAMPLES = 5000
+
+def dnn_residuals(model_data, series: SeriesFeatures) -> np.ndarray:
+    """DNN在历史数据上的残差（一次批量前向计算）"""
+    fitted_scaled = model_data['model'].predict(model_data['X_scaler'].transform(series.calendar))
+    fitted = model_data['y_scaler'].inverse_transform(fitted_scaled).ravel()
+    return series.price - fitted
+
+def prophet_residuals(model, series: SeriesFeatures) -> np.ndarray:
+    """Prophet在历史数据上的残差"""
+    forecast = model.predict(pd.DataFrame({"ds": series.dates}))
+    return series.price - forecast['yhat'].values
+
+def simulate_lstm_paths(model_data, series: SeriesFeatures, periods: int, n_samples: int, rng) -> np.ndarray:
+    """
+    LSTM递归预测的蒙特卡洛模拟：所有路径作为一个批次，每个预测步只做一次前向计算，
+    每步叠加从历史残差中抽样的扰动
+    """
+    model = model_data['model']
+    scaler = model_data['scaler']
+    lookback = model_data['lookback']
+
+    prices_scaled = scaler.transform(series.price.reshape(-1, 1)).ravel()
+    if len(prices_scaled) <= lookback:
+        raise ValueError("历史数据不足，无法估计LSTM残差")
+
+    # 历史滑动窗口的一步预测残差（缩放空间）
+    windows = series.windows(lookback, prices_scaled[:-1])
+    fitted = model.predict(windows[..., np.newaxis]).ravel()
+    residuals = prices_scaled[lookback:] - fitted
+
+    sequences = np.repeat(prices_scaled[-lookback:][np.newaxis, :], n_samples, axis=0)
+    noise = rng.choice(residuals, size=(n_samples, periods))
+    paths_scaled = np.empty((n_samples, periods))
+    for step in range(periods):
+        next_values = model.predict(sequences[..., np.newaxis]).ravel() + noise[:, step]
+        paths_scaled[:, step] = next_values
+        sequences = np.concatenate([sequences[:, 1:], next_values[:, np.newaxis]], axis=1)
+
+    return scaler.inverse_transform(paths_scaled.reshape(-1, 1)).reshape(n_samples, periods)
+
+def simulate_prediction_paths(model_type: str, model_data, series: SeriesFeatures, predictions, n_samples: int, rng=None) -> np.ndarray:
+    """生成 (n_samples, periods) 的模拟预测路径矩阵"""
+    rng = rng or np.random.default_rng()
+    point = np.array([p["predicted_price"] for p in predictions])
+
+    if model_type == "LSTM":
+        return simulate_lstm_paths(model_data, series, len(point), n_samples, rng)
+
+    # DNN/Prophet的预测只依赖日期，直接对点预测叠加自助抽样的残差
+    if model_type == "DNN":
+        residuals = dnn_residuals(model_data, series)
+    elif model_type == "Prophet":
+        residuals = prophet_residuals(model_data, series)
+    else:
+        raise ValueError(f"不支持的模型类型: {model_type}")
+
+    if len(residuals) == 0:
+        raise ValueError("历史数据不足，无法估计残差")
+    return point[np.newaxis, :] + rng.choice(residuals, size=(n_samples, len(point)))
+
+def attach_prediction_intervals(predictions, paths: np.ndarray, levels: List[int]):
+    """按置信水平计算分位数，写入每条预测的 lower_XX / upper_XX 字段"""
+    quantiles = []
+    for level in levels:
+        tail = (100 - level) / 2
+        quantiles.extend([tail, 100 - tail])
+    bounds = np.percentile(paths, quantiles, axis=0)
+
+    for i, level in enumerate(levels):
+        lower, upper = bounds[2 * i], bounds[2 * i + 1]
+        for j, prediction in enumerate(predictions):
+            prediction[f"lower_{level}"] = float(lower[j])
+            prediction[f"upper_{level}"] = float(upper[j])
+
 # 计算评估指标
-def calculate_metrics(df):
+def calculate_metrics(series: SeriesFeatures):
     # 简单计算统计指标
+    prices = series.price
     return {
-        "data_points": len(df),
-        "mean_price": float(df['price'].mean()),
-        "min_price": float(df['price'].min()),
-        "max_price": float(df['price'].max()),
-        "std_price": float(df['price'].std())
+        "data_points": len(prices),
+        "mean_price": float(prices.mean()),
+        "min_price": float(prices.min()),
+        "max_price": float(prices.max()),
+        "std_price": float(prices.std(ddof=1)) if len(prices) > 1 else None
     }
 
+@prediction_router.get("/training/status")
+def get_training_status():
+    """训练资源使用情况：运行中/排队中的任务、槽位利用率和线程预算"""
+    return training_governor.status()
+
 # 将路由添加到主应用
 app.include_router(prediction_router, tags=["prediction"])
 
@@ -936,10 +1195,47 @@ class AIChatRequest(BaseModel):
     query: str
     city: Optional[str] = None
     area: Optional[str] = None
+    stream: bool = False  # 为真时以SSE流式返回
     # 可拓展更多上下文字段
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def relay_ai_stream(events):
+    """
+    把AI服务的流式事件转换为SSE：stats（基础统计）、delta（文本片段）、done（结束）、error（错误）
+    """
+    async for event in events:
+        if "basic_stats" in event:
+            yield sse_event("stats", event["basic_stats"])
+        elif "delta" in event:
+            yield sse_event("delta", {"text": event["delta"]})
+        elif "error" in event:
+            yield sse_event("error", {"error": event["error"]})
+        elif event.get("done"):
+            yield sse_event("done", {
+                "model_used": event.get("model_used"),
+                "cached": event.get("cached", False),
+                "fallback": event.get("fallback", False),
+                "routed": event.get("routed", False)
+            })
+
+async def single_result_stream(result: Dict[str, Any]):
+    """把已有的完整结果包装成流式事件"""
+    yield {"delta": result["text"]}
+    yield {"done": True, "model_used": result.get("model_used"), "routed": result.get("routed", False)}
+
+def streaming_ai_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        relay_ai_stream(events),
+        media_type="text/event-stream",
+        # 禁止代理缓冲，保证每个片段立即送达
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/ai/assistant")
-def ai_assistant(
+async def ai_assistant(
     req: AIChatRequest,
     current_user: Optional[dict] = Depends(get_optional_user)
 ):
@@ -957,12 +1253,86 @@ def ai_assistant(
             area_df = area_df[area_df['area'] == req.area]
         if area_df.empty:
             return {"error": f"未找到{req.city}{req.area or ''}的房价数据"}
-        result = ai_service.analyze_housing_trend(req.city, req.area, area_df)
+        if req.stream:
+            return streaming_ai_response(
+                ai_service.stream_housing_trend_async(req.city, req.area, area_df, DATA_VERSION)
+            )
+        result = await ai_service.analyze_housing_trend_async(req.city, req.area, area_df, DATA_VERSION)
         return result
     else:
+        # 价格查询、排名等事实性问题直接用本地数据回答，不调用大模型
+        routed = query_router.route(req.query)
+        if routed is not None:
+            return streaming_ai_response(single_result_stream(routed)) if req.stream else routed
+
         # 通用AI对话
-        ai_result = ai_service.chat_with_ai(prompt=req.query, system_prompt="你是专业的房地产智能助手，请用中文简明回答用户问题。")
+        if req.stream:
+            return streaming_ai_response(
+                ai_service.stream_chat_async(prompt=req.query, system_prompt=ASSISTANT_SYSTEM_PROMPT)
+            )
+        ai_result = await ai_service.chat_with_ai_async(prompt=req.query, system_prompt=ASSISTANT_SYSTEM_PROMPT)
         return ai_result
+class AIBatchRequest(BaseModel):
+    city: str
+    areas: Optional[List[str]] = None  # 为空时分析该城市的全部区域
+
+async def relay_batch_stream(city: str, results):
+    """
+    批量分析结果转换为SSE：start（区域列表）、result（每个区域完成时一条）、done（汇总）
+    """
+    started = time.perf_counter()
+    completed = failed = 0
+    async for item in results:
+        if "areas" in item:
+            yield sse_event("start", {"city": city, "areas": item["areas"], "total": len(item["areas"])})
+            continue
+        if "error" in item:
+            failed += 1
+        else:
+            completed += 1
+        yield sse_event("result", item)
+    yield sse_event("done", {
+        "completed": completed,
+        "failed": failed,
+        "elapsed_seconds": round(time.perf_counter() - started, 2)
+    })
+
+@app.post("/ai/assistant/batch")
+async def ai_assistant_batch(
+    req: AIBatchRequest,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    批量AI分析一个城市所有（或指定）区域的房价趋势，以SSE按完成顺序逐个返回。
+    需要登录；每个区域都是一次上游调用，按区域数扣除限流令牌（ai_batch 类别）
+    """
+    city_df = df[df['city'] == req.city]
+    if req.areas:
+        city_df = city_df[city_df['area'].isin(req.areas)]
+    if city_df.empty:
+        return {"error": f"未找到{req.city}的房价数据"}
+
+    area_count = city_df['area'].nunique()
+    max_areas = int(RATE_LIMITS["ai_batch"][1])
+    if area_count > max_areas:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"单次最多分析 {max_areas} 个区域")
+    # 中间件已为请求本身扣除一个令牌，这里补扣其余区域
+    wait = rate_limiter.charge(request, "ai_batch", area_count - 1)
+    if wait > 0:
+        retry_after = max(1, int(wait + 0.999))
+        raise HTTPException(
+            status_code=429,
+            detail=f"请求过于频繁，请在 {retry_after} 秒后重试",
+            headers={"Retry-After": str(retry_after), "X-RateLimit-Class": "ai_batch"}
+        )
+
+    return StreamingResponse(
+        relay_batch_stream(req.city, ai_service.analyze_city_areas_async(req.city, city_df, DATA_VERSION)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/cities")
 def get_cities():
     """获取所有城市列表"""
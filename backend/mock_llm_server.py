@@ -0,0 +1,187 @@
+"""
+本地模拟大模型服务 - 模仿 OpenAI 兼容的 chat-completions 接口
+
+用于离线环境下的压测和稳定性测试：不需要访问外网即可完整走通 /ai/assistant 的调用链路，
+包括流式响应、超时和重试。延迟、错误率和超时率都可以配置。
+
+命令行用法:
+    python -m backend.mock_llm_server [--port 8001] [--latency-ms 300] [--error-rate 0.05]
+
+后端配合使用:
+    HOUSING_AI_OFFLINE=1 python -m uvicorn backend.main:app --port 8000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_LLM_HOST = os.environ.get("HOUSING_MOCK_LLM_HOST", "127.0.0.1")
+MOCK_LLM_PORT = int(os.environ.get("HOUSING_MOCK_LLM_PORT", "8001"))
+
+
+class MockLLMSettings:
+    """模拟服务的行为参数，可在运行时通过 /mock/config 修改"""
+
+    def __init__(self):
+        # 返回首个结果前的基础延迟和随机抖动（毫秒）
+        self.latency_ms = float(os.environ.get("HOUSING_MOCK_LLM_LATENCY_MS", "300"))
+        self.jitter_ms = float(os.environ.get("HOUSING_MOCK_LLM_JITTER_MS", "100"))
+        # 流式响应中相邻片段的间隔（毫秒）
+        self.chunk_delay_ms = float(os.environ.get("HOUSING_MOCK_LLM_CHUNK_DELAY_MS", "30"))
+        # 返回 5xx 错误的比例，以及挂起不响应（触发客户端超时）的比例
+        self.error_rate = float(os.environ.get("HOUSING_MOCK_LLM_ERROR_RATE", "0"))
+        self.timeout_rate = float(os.environ.get("HOUSING_MOCK_LLM_TIMEOUT_RATE", "0"))
+        self.hang_seconds = float(os.environ.get("HOUSING_MOCK_LLM_HANG_SECONDS", "120"))
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(vars(self))
+
+
+settings = MockLLMSettings()
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "streams": 0, "errors": 0, "timeouts": 0}
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def build_reply(prompt: str) -> str:
+    """根据提示词生成固定模板的回复；趋势分析提示会带上地点和价格信息"""
+    first_line = prompt.strip().splitlines()[0] if prompt.strip() else ""
+    facts = [line.strip() for line in prompt.splitlines() if "：" in line and "元/㎡" in line]
+    lines = [f"【模拟回复】{first_line}"]
+    if facts:
+        lines.append("根据提供的数据：" + "；".join(facts) + "。")
+        lines.extend([
+            "1. 趋势判断：价格整体平稳，短期波动有限。",
+            "2. 价格水平：处于近一年区间的中位附近。",
+            "3. 投资建议：关注核心地段；控制杠杆；分批入市；结合自住需求决策。",
+            "4. 风险提示：政策调整和市场情绪变化可能带来波动。",
+        ])
+    else:
+        lines.append("这是本地模拟服务返回的回复，用于离线测试，不代表真实分析结果。")
+    return "\n".join(lines)
+
+
+def _split_chunks(text: str, size: int = 8):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+async def _simulate_latency():
+    delay = settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)
+    await asyncio.sleep(max(0.0, delay) / 1000)
+
+
+app = FastAPI(title="Mock LLM Server")
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(body: Dict[str, Any]):
+    _count("requests")
+    model = body.get("model") or "mock-llm"
+    messages = body.get("messages") or []
+    prompt = messages[-1].get("content", "") if messages else ""
+
+    roll = random.random()
+    if roll < settings.timeout_rate:
+        _count("timeouts")
+        await asyncio.sleep(settings.hang_seconds)
+    elif roll < settings.timeout_rate + settings.error_rate:
+        _count("errors")
+        await _simulate_latency()
+        return JSONResponse(
+            status_code=random.choice([500, 502, 503]),
+            content={"error": {"message": "mock upstream error", "type": "server_error"}}
+        )
+
+    await _simulate_latency()
+    reply = build_reply(prompt)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    usage = {"prompt_tokens": len(prompt), "completion_tokens": len(reply), "total_tokens": len(prompt) + len(reply)}
+
+    if not body.get("stream"):
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    _count("streams")
+
+    async def events():
+        for piece in _split_chunks(reply):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(settings.chunk_delay_ms / 1000)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+@app.get("/mock/stats")
+def mock_stats():
+    with _stats_lock:
+        return {**_stats, "settings": settings.to_dict()}
+
+
+@app.post("/mock/config")
+def update_config(changes: Dict[str, float]):
+    """运行中调整延迟、错误率等参数，便于在一次压测中模拟故障和恢复"""
+    for name, value in changes.items():
+        if hasattr(settings, name):
+            setattr(settings, name, float(value))
+    return settings.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动本地模拟大模型服务（OpenAI chat-completions 兼容）")
+    parser.add_argument("--host", default=MOCK_LLM_HOST)
+    parser.add_argument("--port", type=int, default=MOCK_LLM_PORT)
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms, help="基础响应延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=settings.jitter_ms, help="延迟随机抖动（毫秒）")
+    parser.add_argument("--chunk-delay-ms", type=float, default=settings.chunk_delay_ms, help="流式片段间隔（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate, help="返回5xx错误的比例")
+    parser.add_argument("--timeout-rate", type=float, default=settings.timeout_rate, help="挂起不响应的比例")
+    parser.add_argument("--hang-seconds", type=float, default=settings.hang_seconds, help="挂起时长（秒）")
+    args = parser.parse_args()
+
+    settings.latency_ms = args.latency_ms
+    settings.jitter_ms = args.jitter_ms
+    settings.chunk_delay_ms = args.chunk_delay_ms
+    settings.error_rate = args.error_rate
+    settings.timeout_rate = args.timeout_rate
+    settings.hang_seconds = args.hang_seconds
+
+    import uvicorn
+    print(f"🚀 模拟大模型服务: http://{args.host}:{args.port}/v1/chat/completions")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
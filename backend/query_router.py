@@ -0,0 +1,242 @@
+"""
+AI助手问题路由 - 简单的事实查询直接用内存中的房价数据回答
+
+"北京海淀区现在多少钱"、"哪个城市最贵"这类问题只需要查一下最新月份的数据，
+不必调用大模型。路由器基于数据集中的城市/区域名称建立索引（含"海淀"这类省略"区"的别名），
+用一个按长度降序的正则一次扫描出问题中提到的地点，再按关键词判断意图：
+- 价格查询：提到地点且询问价格 → 返回最新月份价格及环比、同比变化
+- 排名查询：最贵/最便宜，或"房价最高/排名"这类带价格关键词的问题 → 返回城市或区域按最新价格的排序
+趋势、预测、建议等开放性问题以及无法识别的问题返回 None，由调用方交给大模型。
+"""
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# 出现这些词说明需要分析或判断，交给大模型
+OPEN_ENDED_KEYWORDS = (
+    "趋势", "走势", "预测", "未来", "以后", "明年", "建议", "分析", "为什么", "原因", "怎么样", "如何",
+    "值得", "投资", "政策", "会不会", "会涨", "会跌", "影响", "推荐", "介绍",
+)
+PRICE_KEYWORDS = ("房价", "价格", "均价", "单价", "每平", "一平", "行情")
+# 单独的"多少"可能问的是区县数、人口等，只有紧挨着钱/元/价/平米时才算询问价格
+PRICE_AMOUNT_PATTERN = re.compile(r"多少(?:钱|元|价|平米)|(?:钱|元|价|平米)多少")
+# 贵/便宜本身就是在比较价格
+HIGH_KEYWORDS = ("最贵", "贵的", "更贵", "哪个贵", "哪里贵")
+LOW_KEYWORDS = ("最便宜", "便宜的", "更便宜", "哪个便宜", "哪里便宜")
+# "最高的楼"、"GDP最高"、"大学排名"等与房价无关，这些词必须和价格关键词同时出现
+RANK_KEYWORDS = ("最高", "最低", "排名", "排行", "排序")
+AREA_SCOPE_KEYWORDS = ("哪个区", "哪些区", "哪个区域", "哪些区域", "各区", "区域")
+
+CHINESE_NUMBERS = {"一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+TOP_N_PATTERN = re.compile(r"前\s*(\d+|[一二两三四五六七八九十])")
+
+LOCAL_MODEL_NAME = "local-data"
+
+
+def _area_aliases(area: str) -> List[str]:
+    """区域名称及其省略后缀的别名，如 浦东新区 -> 浦东新区/浦东"""
+    aliases = [area]
+    for suffix in ("新区", "区"):
+        if area.endswith(suffix) and len(area) - len(suffix) >= 2:
+            aliases.append(area[:-len(suffix)])
+            break
+    return aliases
+
+
+class QueryRouter:
+    """基于城市/区域词表的问题路由器，数据在构造时预先汇总为每个区域的最新价格"""
+
+    def __init__(self, data: pd.DataFrame):
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.passed = 0
+        self._build(data)
+
+    def _build(self, data: pd.DataFrame):
+        ordered = data.sort_values(["city", "area", "date"])
+        prices = ordered.groupby(["city", "area"], sort=False)["price"]
+        # 每个区域最新一期的价格，以及上一期和12期之前的价格（数据按月）
+        ordered = ordered.assign(previous=prices.shift(1), year_ago=prices.shift(12))
+        latest = ordered.groupby(["city", "area"], sort=False).tail(1).set_index(["city", "area"])
+
+        self.areas = pd.DataFrame({
+            "price": latest["price"].astype(float),
+            "date": pd.to_datetime(latest["date"]).dt.strftime("%Y-%m"),
+            "mom_pct": (latest["price"] / latest["previous"] - 1) * 100,
+            "yoy_pct": (latest["price"] / latest["year_ago"] - 1) * 100,
+        })
+        self.cities = self.areas.groupby(level="city").agg(
+            price=("price", "mean"), areas=("price", "size"), date=("date", "max")
+        )
+        self.latest_month = str(self.areas["date"].max()) if not self.areas.empty else ""
+
+        # 名称索引：别名 -> [(城市, 区域或None)]
+        index: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        for city in self.cities.index:
+            for alias in (city, f"{city}市"):
+                index.setdefault(alias, []).append((city, None))
+        for city, area in self.areas.index:
+            for alias in _area_aliases(area):
+                index.setdefault(alias, []).append((city, area))
+        self._index = index
+        names = sorted(index, key=len, reverse=True)
+        self._pattern = re.compile("|".join(re.escape(name) for name in names)) if names else None
+
+    def find_locations(self, query: str) -> List[Tuple[str, Optional[str]]]:
+        """按出现顺序返回问题中提到的 (城市, 区域)；同名区域优先匹配已提到的城市"""
+        if self._pattern is None:
+            return []
+        matches = [self._index[m.group(0)] for m in self._pattern.finditer(query)]
+        mentioned_cities = {candidates[0][0] for candidates in matches if candidates[0][1] is None}
+
+        locations = []
+        for candidates in matches:
+            if len(candidates) > 1:
+                preferred = [c for c in candidates if c[0] in mentioned_cities]
+                candidates = preferred or candidates
+            location = candidates[0]
+            if location not in locations:
+                locations.append(location)
+        # 同时提到城市和它的区域时（如"北京海淀区"），只保留区域
+        areas_of = {city for city, area in locations if area is not None}
+        return [(city, area) for city, area in locations if area is not None or city not in areas_of]
+
+    def route(self, query: str) -> Optional[Dict[str, Any]]:
+        """能用本地数据回答时返回与AI对话接口相同结构的结果，否则返回 None"""
+        text = query.strip()
+        result = None
+        if text and not any(keyword in text for keyword in OPEN_ENDED_KEYWORDS):
+            locations = self.find_locations(text)
+            if self._asks_ranking(text):
+                result = self._answer_ranking(text, locations)
+            elif locations and self._asks_price(text):
+                result = self._answer_lookup(locations)
+
+        with self._lock:
+            if result is None:
+                self.passed += 1
+            else:
+                self.routed += 1
+        return result
+
+    @staticmethod
+    def _asks_price(text: str) -> bool:
+        return any(keyword in text for keyword in PRICE_KEYWORDS) or PRICE_AMOUNT_PATTERN.search(text) is not None
+
+    @classmethod
+    def _asks_ranking(cls, text: str) -> bool:
+        if any(keyword in text for keyword in HIGH_KEYWORDS + LOW_KEYWORDS):
+            return True
+        return any(keyword in text for keyword in RANK_KEYWORDS) and cls._asks_price(text)
+
+    @staticmethod
+    def _top_n(text: str) -> Optional[int]:
+        match = TOP_N_PATTERN.search(text)
+        if not match:
+            return None
+        value = match.group(1)
+        return int(value) if value.isdigit() else CHINESE_NUMBERS[value]
+
+    @staticmethod
+    def _format_change(label: str, value) -> str:
+        return f"{label} {value:+.1f}%" if pd.notna(value) else f"{label} 暂无数据"
+
+    def _result(self, intent: str, text: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "text": f"{text}\n\n（数据来自系统房价数据，最新月份 {self.latest_month}）",
+            "raw_response": True,
+            "model_used": LOCAL_MODEL_NAME,
+            "tokens_used": 0,
+            "routed": True,
+            "intent": intent,
+            "data": data,
+        }
+
+    def _answer_lookup(self, locations: List[Tuple[str, Optional[str]]]) -> Dict[str, Any]:
+        lines, items = [], []
+        for city, area in locations:
+            if area is not None:
+                row = self.areas.loc[(city, area)]
+                lines.append(
+                    f"- **{city}市{area}** {row['date']} 房价 **{row['price']:,.0f} 元/㎡**，"
+                    f"{self._format_change('环比', row['mom_pct'])}，{self._format_change('同比', row['yoy_pct'])}"
+                )
+                items.append({"city": city, "area": area, "price": round(float(row["price"]), 2), "date": row["date"]})
+            else:
+                city_areas = self.areas.loc[city]["price"]
+                row = self.cities.loc[city]
+                lines.append(
+                    f"- **{city}市** {row['date']} 各区域均价 **{row['price']:,.0f} 元/㎡**"
+                    f"（{int(row['areas'])}个区域，最高 {city_areas.idxmax()} {city_areas.max():,.0f}，"
+                    f"最低 {city_areas.idxmin()} {city_areas.min():,.0f}）"
+                )
+                items.append({"city": city, "area": None, "price": round(float(row["price"]), 2), "date": row["date"]})
+        return self._result("price_lookup", "\n".join(lines), {"items": items})
+
+    def _answer_ranking(self, text: str, locations: List[Tuple[str, Optional[str]]]) -> Optional[Dict[str, Any]]:
+        ascending = any(keyword in text for keyword in LOW_KEYWORDS) or "最低" in text
+        cities = [city for city, area in locations if area is None]
+        named_areas = [(city, area) for city, area in locations if area is not None]
+        focus = None
+
+        if len(named_areas) >= 2:
+            # 比较指定的几个区域
+            prices = self.areas.loc[named_areas, "price"]
+            labels = [f"{city}{area}" for city, area in prices.index]
+            scope = "所提区域"
+        elif len(named_areas) == 1:
+            # 只提到一个区域（如"海淀区房价排名"）：在所属城市内排名并标出该区域的位置；
+            # 同时提到其他城市时比较对象不明确，交给大模型
+            if cities:
+                return None
+            city, focus = named_areas[0]
+            prices = self.areas.loc[city, "price"]
+            labels = list(prices.index)
+            scope = f"{city}市各区域"
+        elif len(cities) == 1 or (len(cities) == 0 and any(k in text for k in AREA_SCOPE_KEYWORDS)):
+            # 某个城市内（或全部城市）的区域排名
+            prices = self.areas.loc[cities[0], "price"] if cities else self.areas["price"]
+            labels = list(prices.index) if cities else [f"{city}{area}" for city, area in prices.index]
+            scope = f"{cities[0]}市各区域" if cities else "所有区域"
+        else:
+            # 城市排名（提到多个城市时只比较这些城市）
+            prices = self.cities.loc[cities, "price"] if cities else self.cities["price"]
+            labels = list(prices.index)
+            scope = "所提城市（各区域均价）" if cities else "各城市（各区域均价）"
+
+        if prices.empty:
+            return None
+        ranking = pd.Series(prices.to_numpy(), index=labels).sort_values(ascending=ascending)
+        # 名次始终按价格从高到低计算，与问"最贵"还是"最便宜"无关
+        focus_rank = int((prices > prices[focus]).sum()) + 1 if focus is not None else None
+        top_n = self._top_n(text)
+        if top_n:
+            ranking = ranking.head(top_n)
+
+        order = "从低到高" if ascending else "从高到低"
+        headline = f"{scope}中{'最便宜' if ascending else '最贵'}的是 **{ranking.index[0]}**，{ranking.iloc[0]:,.0f} 元/㎡。"
+        if focus is not None:
+            headline += f"{focus} {prices[focus]:,.0f} 元/㎡，在 {len(prices)} 个区域中房价排第 **{focus_rank}** 位。"
+        lines = [headline, "", f"{self.latest_month} {scope}房价{order}："]
+        lines.extend(
+            f"{i}. {'**' + label + '**' if label == focus else label} {price:,.0f} 元/㎡"
+            for i, (label, price) in enumerate(ranking.items(), 1)
+        )
+        data = {"order": "asc" if ascending else "desc",
+                "ranking": [{"name": label, "price": round(float(price), 2)} for label, price in ranking.items()]}
+        if focus is not None:
+            data["focus"] = {"name": focus, "rank": focus_rank, "of": len(prices)}
+        return self._result("ranking", "\n".join(lines), data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "routed": self.routed,
+                "passed_to_llm": self.passed,
+                "cities": len(self.cities),
+                "areas": len(self.areas),
+                "aliases": len(self._index),
+                "latest_month": self.latest_month,
+            }
@@ -0,0 +1,282 @@
+"""
+请求限流 - 按令牌、用户ID和客户端IP的令牌桶限流
+
+每类接口（预测、AI助手、登录注册、其他）有各自的速率和突发容量。
+令牌桶保存在按键哈希分片的字典中，每个分片一把锁，检查与扣减都是 O(1)。
+可选地定期把未满的令牌桶快照到SQLite，进程重启后限流状态不丢失。
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from backend.database import db_pool, hash_token, token_cache
+from backend.security import InvalidToken, token_signer
+
+RATE_LIMIT_ENABLED = os.environ.get("HOUSING_RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_SHARDS = max(1, int(os.environ.get("HOUSING_RATE_LIMIT_SHARDS", "16")))
+# 位于反向代理之后时，从 X-Forwarded-For 取客户端IP
+RATE_LIMIT_TRUST_PROXY = os.environ.get("HOUSING_RATE_LIMIT_TRUST_PROXY", "0") == "1"
+# 是否把令牌桶状态持久化到SQLite，以及快照间隔（秒）
+RATE_LIMIT_PERSIST = os.environ.get("HOUSING_RATE_LIMIT_PERSIST", "0") == "1"
+RATE_LIMIT_SNAPSHOT_SECONDS = float(os.environ.get("HOUSING_RATE_LIMIT_SNAPSHOT_SECONDS", "30"))
+# 按IP限流的额度倍数：同一IP后可能有多个用户（如NAT）
+RATE_LIMIT_IP_MULTIPLIER = float(os.environ.get("HOUSING_RATE_LIMIT_IP_MULTIPLIER", "4"))
+# 不按IP限流的可信来源（逗号分隔），如代所有用户转发请求的Streamlit前端服务器，只按令牌和用户ID限流
+RATE_LIMIT_TRUSTED_IPS = frozenset(
+    ip.strip() for ip in os.environ.get("HOUSING_RATE_LIMIT_TRUSTED_IPS", "").split(",") if ip.strip()
+)
+
+
+def _parse_limit(name: str, default: str) -> Tuple[float, float]:
+    """环境变量格式 "每分钟请求数/突发容量"，如 "10/5" """
+    value = os.environ.get(f"HOUSING_RATE_LIMIT_{name.upper()}", default)
+    per_minute, _, burst = value.partition("/")
+    return float(per_minute) / 60.0, float(burst or per_minute)
+
+
+# 接口分类：(类别, 路径前缀)，按顺序匹配
+ENDPOINT_CLASSES = [
+    ("predict", "/predict"),
+    ("ai_batch", "/ai/assistant/batch"),
+    ("ai", "/ai/"),
+    ("auth", "/auth/login"),
+    ("auth", "/auth/register"),
+]
+
+# 各类别的 (每秒补充令牌数, 桶容量)
+# 批量AI分析单独计算，一个令牌对应一个区域的分析（每个区域都是一次上游调用）
+RATE_LIMITS = {
+    "predict": _parse_limit("predict", "10/5"),
+    "ai": _parse_limit("ai", "20/5"),
+    "ai_batch": _parse_limit("ai_batch", "20/12"),
+    "auth": _parse_limit("auth", "20/10"),
+    "default": _parse_limit("default", "300/60"),
+}
+
+
+def classify_path(path: str) -> str:
+    for name, prefix in ENDPOINT_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return "default"
+
+
+def bucket_limits(key: str) -> Tuple[float, float]:
+    """令牌桶键格式 "类别:身份类型:身份"，返回该桶的 (每秒补充令牌数, 容量)"""
+    endpoint_class, kind, _ = key.split(":", 2)
+    rate, capacity = RATE_LIMITS[endpoint_class]
+    if kind == "ip":
+        return rate * RATE_LIMIT_IP_MULTIPLIER, capacity * RATE_LIMIT_IP_MULTIPLIER
+    return rate, capacity
+
+
+class ShardedTokenBuckets:
+    """分片的令牌桶集合：键 -> [剩余令牌, 上次更新时间戳]"""
+
+    def __init__(self, shards: int):
+        self._shards: List[Tuple[threading.Lock, Dict[str, list]]] = [
+            (threading.Lock(), {}) for _ in range(shards)
+        ]
+        self.allowed = 0
+        self.limited = 0
+
+    def _shard(self, key: str):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def consume(self, key: str, rate: float, capacity: float, now: float, amount: float = 1) -> float:
+        """尝试取 amount 个令牌，成功返回0，否则返回需要等待的秒数"""
+        lock, buckets = self._shard(key)
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = [capacity, now]
+            else:
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= amount:
+                bucket[0] -= amount
+                return 0.0
+            return (amount - bucket[0]) / rate
+
+    def refund(self, key: str, capacity: float, amount: float = 1):
+        lock, buckets = self._shard(key)
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(capacity, bucket[0] + amount)
+
+    def acquire(self, keys: List[str], amount: float = 1) -> float:
+        """所有键都取到令牌才放行；任一键被限流时退还已扣的令牌，返回需要等待的秒数"""
+        now = time.time()
+        taken = []
+        for key in keys:
+            rate, capacity = bucket_limits(key)
+            wait = self.consume(key, rate, capacity, now, amount)
+            if wait > 0:
+                for taken_key in taken:
+                    self.refund(taken_key, bucket_limits(taken_key)[1], amount)
+                self.limited += 1
+                return wait
+            taken.append(key)
+        self.allowed += 1
+        return 0.0
+
+    def sweep(self) -> int:
+        """清除已经补满的令牌桶（与新建的桶等价），控制内存占用"""
+        now = time.time()
+        removed = 0
+        for lock, buckets in self._shards:
+            with lock:
+                full = []
+                for key, (tokens, updated) in buckets.items():
+                    rate, capacity = bucket_limits(key)
+                    if tokens + (now - updated) * rate >= capacity:
+                        full.append(key)
+                for key in full:
+                    del buckets[key]
+                removed += len(full)
+        return removed
+
+    def snapshot(self) -> List[tuple]:
+        rows = []
+        for lock, buckets in self._shards:
+            with lock:
+                rows.extend((key, tokens, updated) for key, (tokens, updated) in buckets.items())
+        return rows
+
+    def restore(self, rows):
+        for key, tokens, updated in rows:
+            lock, buckets = self._shard(key)
+            with lock:
+                buckets[key] = [tokens, updated]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buckets": sum(len(buckets) for _, buckets in self._shards),
+            "shards": len(self._shards),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class RateLimiter:
+    """按接口类别和请求身份（令牌、用户ID、IP）限流"""
+
+    def __init__(self, buckets: ShardedTokenBuckets):
+        self.buckets = buckets
+
+    @staticmethod
+    def client_ip(request) -> str:
+        if RATE_LIMIT_TRUST_PROXY:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    @staticmethod
+    def resolve_user_id(token: str) -> Optional[int]:
+        """只用内存信息确定用户ID（签名令牌载荷或令牌缓存），不查询数据库"""
+        if token_signer.looks_signed(token):
+            try:
+                return token_signer.verify(token)["uid"]
+            except InvalidToken:
+                return None
+        cached = token_cache.peek(token)
+        return cached["id"] if cached else None
+
+    def identity_keys(self, endpoint_class: str, request) -> List[str]:
+        """
+        已识别出用户的请求只按令牌和用户ID限流：同一IP后的多个用户（如都经由Streamlit前端服务器）
+        不再共用一份IP额度。匿名请求和无法识别的令牌（随机伪造的令牌不能借此绕过限流）按IP限流。
+        """
+        keys = []
+        user_id = None
+        authorization = request.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            token = authorization[7:].strip()
+            if token:
+                keys.append(f"{endpoint_class}:token:{hash_token(token)[:32]}")
+                user_id = self.resolve_user_id(token)
+                if user_id is not None:
+                    keys.append(f"{endpoint_class}:user:{user_id}")
+        client_ip = self.client_ip(request)
+        if user_id is None and client_ip not in RATE_LIMIT_TRUSTED_IPS:
+            keys.insert(0, f"{endpoint_class}:ip:{client_ip}")
+        return keys
+
+    def check(self, request) -> Tuple[str, float]:
+        """返回 (接口类别, 需等待秒数)，等待秒数为0表示放行"""
+        endpoint_class = classify_path(request.url.path)
+        return endpoint_class, self.buckets.acquire(self.identity_keys(endpoint_class, request))
+
+    def charge(self, request, endpoint_class: str, amount: float) -> float:
+        """
+        在中间件按请求扣除的一个令牌之外，再为同一身份额外扣除 amount 个令牌
+        （如批量接口按实际处理的条目计费），返回需要等待的秒数，0表示放行
+        """
+        if not RATE_LIMIT_ENABLED or amount <= 0:
+            return 0.0
+        return self.buckets.acquire(self.identity_keys(endpoint_class, request), amount)
+
+    def save(self) -> Dict[str, Any]:
+        """把未补满的令牌桶快照到SQLite"""
+        removed = self.buckets.sweep()
+        rows = self.buckets.snapshot()
+        with db_pool.transaction() as conn:
+            conn.execute("DELETE FROM rate_limit_buckets")
+            conn.executemany(
+                "INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?)", rows
+            )
+        return {"saved": len(rows), "swept": removed}
+
+    def load(self) -> int:
+        rows = db_pool.connection().execute(
+            "SELECT bucket_key, tokens, updated_at FROM rate_limit_buckets"
+        ).fetchall()
+        self.buckets.restore(
+            (row["bucket_key"], row["tokens"], row["updated_at"]) for row in rows
+            if row["bucket_key"].split(":", 1)[0] in RATE_LIMITS
+        )
+        return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "ip_multiplier": RATE_LIMIT_IP_MULTIPLIER,
+            "trusted_ips": sorted(RATE_LIMIT_TRUSTED_IPS),
+            "limits": {
+                name: {"per_minute": round(rate * 60, 2), "burst": capacity}
+                for name, (rate, capacity) in RATE_LIMITS.items()
+            },
+            **self.buckets.stats(),
+        }
+
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """超出限额的请求直接返回 429，并在 Retry-After 中给出建议等待秒数"""
+
+    def __init__(self, app, limiter: RateLimiter):
+        super().__init__(app)
+        self.limiter = limiter
+
+    async def dispatch(self, request, call_next):
+        if not RATE_LIMIT_ENABLED or request.method == "OPTIONS":
+            return await call_next(request)
+
+        endpoint_class, wait = self.limiter.check(request)
+        if wait > 0:
+            retry_after = max(1, int(wait + 0.999))
+            return JSONResponse(
+                status_code=429,
+                content={"detail": f"请求过于频繁，请在 {retry_after} 秒后重试"},
+                headers={"Retry-After": str(retry_after), "X-RateLimit-Class": endpoint_class},
+            )
+        return await call_next(request)
+
+
+# 全局限流器实例
+rate_limiter = RateLimiter(ShardedTokenBuckets(RATE_LIMIT_SHARDS))
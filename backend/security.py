@@ -0,0 +1,418 @@
+"""
+安全相关工具 - 密码哈希与签名令牌
+
+密码使用加盐的内存困难KDF（默认scrypt）存储，哈希计算在独立的有界线程池中执行，
+并限制同时排队的任务数量，避免登录/注册高峰时CPU被哈希计算占满而拖垮整个服务。
+
+签名令牌模式下，访问令牌自带用户信息、过期时间和密钥ID，由HMAC签名保护，
+各工作进程只需共享签名密钥即可在内存中完成验证，不再每次请求都查询数据库。
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+# 哈希算法与成本参数
+PASSWORD_HASHER = os.environ.get("HOUSING_PASSWORD_HASHER", "scrypt").lower()
+SCRYPT_N = int(os.environ.get("HOUSING_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("HOUSING_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("HOUSING_SCRYPT_P", "1"))
+PBKDF2_ITERATIONS = int(os.environ.get("HOUSING_PBKDF2_ITERATIONS", "600000"))
+
+# 哈希线程池大小、最大排队任务数和排队等待超时（秒）
+PASSWORD_HASH_WORKERS = max(1, int(os.environ.get("HOUSING_PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))))
+PASSWORD_HASH_MAX_PENDING = max(1, int(os.environ.get("HOUSING_PASSWORD_HASH_MAX_PENDING", "64")))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get("HOUSING_PASSWORD_HASH_QUEUE_TIMEOUT", "5"))
+# 批量哈希（导入用户）最多同时占用的排队名额，其余留给交互式的注册/登录
+PASSWORD_HASH_BATCH_MAX_PENDING = int(os.environ.get(
+    "HOUSING_PASSWORD_HASH_BATCH_MAX_PENDING", str(max(1, PASSWORD_HASH_MAX_PENDING // 4))
+))
+
+SALT_BYTES = 16
+
+
+class PasswordHashingBusy(Exception):
+    """密码哈希队列已满"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+class ScryptHasher:
+    """scrypt（内存困难），编码格式: scrypt$n$r$p$salt$hash"""
+
+    algorithm = "scrypt"
+
+    def __init__(self, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P):
+        self.n, self.r, self.p = n, r, p
+
+    def _derive(self, password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        # maxmem 需要覆盖 128 * n * r * p 字节的工作内存
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p, dklen=32)
+
+    def hash(self, password: str) -> str:
+        salt = secrets.token_bytes(SALT_BYTES)
+        digest = self._derive(password, salt, self.n, self.r, self.p)
+        return f"scrypt${self.n}${self.r}${self.p}${_b64encode(salt)}${_b64encode(digest)}"
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, n, r, p, salt, digest = encoded.split("$")
+        actual = self._derive(password, _b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(actual, _b64decode(digest))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        parts = encoded.split("$")
+        return parts[0] != self.algorithm or tuple(map(int, parts[1:4])) != (self.n, self.r, self.p)
+
+
+class PBKDF2Hasher:
+    """PBKDF2-HMAC-SHA256（scrypt不可用时的备选），编码格式: pbkdf2_sha256$iterations$salt$hash"""
+
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations: int = PBKDF2_ITERATIONS):
+        self.iterations = iterations
+
+    def hash(self, password: str) -> str:
+        salt = secrets.token_bytes(SALT_BYTES)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, self.iterations)
+        return f"{self.algorithm}${self.iterations}${_b64encode(salt)}${_b64encode(digest)}"
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, iterations, salt, digest = encoded.split("$")
+        actual = hashlib.pbkdf2_hmac("sha256", password.encode(), _b64decode(salt), int(iterations))
+        return hmac.compare_digest(actual, _b64decode(digest))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        parts = encoded.split("$")
+        return parts[0] != self.algorithm or int(parts[1]) != self.iterations
+
+
+class LegacySHA256Hasher:
+    """旧版无盐SHA-256哈希，只用于验证（不提供 hash，也不在 HASHERS 中），验证通过后应重新哈希"""
+
+    algorithm = "sha256"
+
+    def verify(self, password: str, encoded: str) -> bool:
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return True
+
+
+HASHERS = {
+    ScryptHasher.algorithm: ScryptHasher,
+    PBKDF2Hasher.algorithm: PBKDF2Hasher,
+}
+
+
+def identify_hasher(encoded: str):
+    """根据存储的哈希格式选择验证算法"""
+    algorithm = encoded.split("$", 1)[0]
+    if algorithm == ScryptHasher.algorithm:
+        return ScryptHasher()
+    if algorithm == PBKDF2Hasher.algorithm:
+        return PBKDF2Hasher()
+    if len(encoded) == 64 and all(c in "0123456789abcdef" for c in encoded):
+        return LegacySHA256Hasher()
+    raise ValueError("无法识别的密码哈希格式")
+
+
+class PasswordHashingService:
+    """在专用线程池中执行密码哈希，限制并发与排队数量"""
+
+    def __init__(self, hasher, workers: int, max_pending: int, queue_timeout: float,
+                 batch_max_pending: Optional[int] = None):
+        self.hasher = hasher
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        # 批量任务的名额至少比总名额少一个，保证导入期间交互式请求仍能排上队
+        if batch_max_pending is None:
+            batch_max_pending = max_pending // 4
+        self.batch_max_pending = max(1, min(batch_max_pending, max_pending - 1))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._batch_slots = threading.BoundedSemaphore(self.batch_max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _submit(self, func, *args, wait: bool = True) -> Future:
+        # 异步调用不能阻塞事件循环，排队已满时立即拒绝
+        acquired = self._slots.acquire(timeout=self.queue_timeout) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashingBusy("密码验证请求过多，请稍后重试")
+        with self._lock:
+            self.pending += 1
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future: Future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+        self._slots.release()
+
+    @staticmethod
+    def _verify(password: str, encoded: str) -> bool:
+        try:
+            return identify_hasher(encoded).verify(password, encoded)
+        except ValueError:
+            return False
+
+    def needs_rehash(self, encoded: str) -> bool:
+        try:
+            hasher = identify_hasher(encoded)
+        except ValueError:
+            return True
+        if hasher.algorithm != self.hasher.algorithm:
+            return True
+        return self.hasher.needs_rehash(encoded)
+
+    def hash(self, password: str) -> str:
+        return self._submit(self.hasher.hash, password).result()
+
+    def verify(self, password: str, encoded: str) -> bool:
+        return self._submit(self._verify, password, encoded).result()
+
+    def hash_many(self, passwords) -> list:
+        """
+        批量哈希：逐个提交，同时排队的批量任务不超过 batch_max_pending 个，
+        避免大批导入占满队列后异步的注册/登录被拒绝（503）
+        """
+        futures = []
+        for password in passwords:
+            self._batch_slots.acquire()
+            try:
+                future = self._submit(self.hasher.hash, password)
+            except PasswordHashingBusy:
+                self._batch_slots.release()
+                raise
+            future.add_done_callback(lambda _: self._batch_slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(self.hasher.hash, password, wait=False))
+
+    async def verify_async(self, password: str, encoded: str) -> bool:
+        return await asyncio.wrap_future(self._submit(self._verify, password, encoded, wait=False))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "algorithm": self.hasher.algorithm,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "batch_max_pending": self.batch_max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+if PASSWORD_HASHER not in HASHERS:
+    raise ValueError(f"不支持的密码哈希算法: {PASSWORD_HASHER}")
+
+password_service = PasswordHashingService(
+    HASHERS[PASSWORD_HASHER](),
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_PENDING,
+    PASSWORD_HASH_QUEUE_TIMEOUT,
+    PASSWORD_HASH_BATCH_MAX_PENDING,
+)
+
+
+# 令牌模式：db（随机令牌存数据库）或 signed（HMAC签名的自包含令牌）
+TOKEN_MODE = os.environ.get("HOUSING_TOKEN_MODE", "db").lower()
+# 是否拒绝不带HMAC标签的旧格式数据库令牌（旧令牌全部过期后可开启）
+TOKEN_REQUIRE_TAG = os.environ.get("HOUSING_TOKEN_REQUIRE_TAG", "0") == "1"
+# 签名密钥，格式 "kid1:secret1,kid2:secret2"；新令牌使用 ACTIVE_KID 签名，其余密钥仅用于验证（轮换过渡期）
+TOKEN_SIGNING_KEYS = os.environ.get("HOUSING_TOKEN_SIGNING_KEYS", "")
+TOKEN_ACTIVE_KID = os.environ.get("HOUSING_TOKEN_ACTIVE_KID", "")
+
+SIGNED_TOKEN_PREFIX = "v1"
+
+
+class InvalidToken(Exception):
+    """签名令牌无效、过期或已吊销"""
+
+
+def parse_signing_keys(spec: str) -> Dict[str, bytes]:
+    keys = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        kid, sep, secret = item.partition(":")
+        if not sep or not kid or not secret:
+            raise ValueError("HOUSING_TOKEN_SIGNING_KEYS 格式应为 kid:secret[,kid:secret]")
+        keys[kid] = secret.encode()
+    return keys
+
+
+class TokenSigner:
+    """签发与验证 HMAC-SHA256 签名令牌，格式: v1.<载荷base64>.<签名base64>"""
+
+    def __init__(self, keys: Dict[str, bytes], active_kid: str, configured: bool = True):
+        if active_kid not in keys:
+            raise ValueError(f"签名密钥中不存在当前密钥ID: {active_kid}")
+        self.keys = keys
+        self.active_kid = active_kid
+        self.configured = configured  # 是否来自环境变量配置
+
+    def use_shared_key(self, kid: str, secret: bytes):
+        """未配置签名密钥时，改用各进程共享的密钥（由数据库生成并保存）"""
+        if not self.configured:
+            self.keys = {kid: secret}
+            self.active_kid = kid
+
+    @staticmethod
+    def looks_signed(token: str) -> bool:
+        return token.startswith(SIGNED_TOKEN_PREFIX + ".") and token.count(".") == 2
+
+    def _sign(self, kid: str, signing_input: str) -> bytes:
+        return hmac.new(self.keys[kid], signing_input.encode(), hashlib.sha256).digest()
+
+    def tag(self, value: str) -> str:
+        """为数据库令牌附加HMAC标签，格式: <随机值>.<密钥ID>.<标签>"""
+        return f"{value}.{self.active_kid}.{_b64encode(self._sign(self.active_kid, value)[:16])}"
+
+    def check_tag(self, token: str) -> Optional[bool]:
+        """校验数据库令牌的标签；旧格式（无标签）令牌返回 None"""
+        parts = token.split(".")
+        if len(parts) == 1:
+            return None
+        if len(parts) != 3 or parts[1] not in self.keys:
+            return False
+        value, kid, tag = parts
+        # 按字节比较：标签来自客户端，可能含非ASCII字符，compare_digest 不接受这样的 str
+        return hmac.compare_digest(_b64encode(self._sign(kid, value)[:16]).encode(), tag.encode())
+
+    def issue(self, user: Dict[str, Any], expires_at: float) -> Dict[str, Any]:
+        """签发令牌，返回令牌字符串和载荷"""
+        claims = {
+            "uid": user["id"],
+            "usr": user["username"],
+            "eml": user["email"],
+            "nam": user.get("full_name"),
+            "iat": round(time.time(), 3),
+            "exp": int(expires_at),
+            "kid": self.active_kid,
+            "jti": secrets.token_urlsafe(12),
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":"), ensure_ascii=False).encode())
+        signing_input = f"{SIGNED_TOKEN_PREFIX}.{payload}"
+        token = f"{signing_input}.{_b64encode(self._sign(self.active_kid, signing_input))}"
+        return {"token": token, "claims": claims}
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """校验签名和过期时间，返回载荷；不检查吊销"""
+        try:
+            prefix, payload, signature = token.split(".")
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise InvalidToken("令牌格式错误")
+        if prefix != SIGNED_TOKEN_PREFIX or not isinstance(claims, dict):
+            raise InvalidToken("令牌格式错误")
+
+        kid = claims.get("kid")
+        if kid not in self.keys:
+            raise InvalidToken("未知的签名密钥")
+        expected = self._sign(kid, f"{prefix}.{payload}")
+        try:
+            actual = _b64decode(signature)
+        except ValueError:
+            raise InvalidToken("令牌格式错误")
+        if not hmac.compare_digest(expected, actual):
+            raise InvalidToken("令牌签名无效")
+        if claims.get("exp", 0) <= time.time():
+            raise InvalidToken("令牌已过期")
+        return claims
+
+
+class RevocationList:
+    """
+    签名令牌的吊销列表：单个令牌按 jti 吊销，用户级吊销记录一个时间点，
+    早于该时间签发的令牌全部失效。条目在对应令牌过期后清除，列表保持很小。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jtis: Dict[str, float] = {}          # jti -> 令牌过期时间戳
+        self._not_before: Dict[int, tuple] = {}    # 用户ID -> (吊销时间点, 条目过期时间戳)
+
+    def revoke(self, jti: str, expires_at: float):
+        with self._lock:
+            self._jtis[jti] = expires_at
+
+    def revoke_user(self, user_id: int, not_before: float, expires_at: float):
+        with self._lock:
+            current = self._not_before.get(user_id)
+            if current is None or current[0] < not_before:
+                self._not_before[user_id] = (not_before, expires_at)
+
+    def is_token_revoked(self, token_id: str) -> bool:
+        with self._lock:
+            return token_id in self._jtis
+
+    def is_revoked(self, claims: Dict[str, Any]) -> bool:
+        with self._lock:
+            if claims.get("jti") in self._jtis:
+                return True
+            not_before = self._not_before.get(claims.get("uid"))
+            return not_before is not None and claims.get("iat", 0) <= not_before[0]
+
+    def is_user_revoked_since(self, user_id: int, since: float) -> bool:
+        """用户在 since 之后是否被整体吊销（如停用），用于判断此前缓存的验证结果是否已过时"""
+        with self._lock:
+            not_before = self._not_before.get(user_id)
+            return not_before is not None and since <= not_before[0]
+
+    def purge(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [jti for jti, exp in self._jtis.items() if exp <= now]
+            for jti in expired:
+                del self._jtis[jti]
+            expired_users = [uid for uid, (_, exp) in self._not_before.items() if exp <= now]
+            for uid in expired_users:
+                del self._not_before[uid]
+        return len(expired) + len(expired_users)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"revoked_tokens": len(self._jtis), "revoked_users": len(self._not_before)}
+
+
+def _build_token_signer() -> TokenSigner:
+    keys = parse_signing_keys(TOKEN_SIGNING_KEYS)
+    if not keys:
+        # 数据库初始化时会替换为保存在数据库中的共享密钥；多主机部署时应显式配置
+        return TokenSigner({"local": secrets.token_bytes(32)}, "local", configured=False)
+    return TokenSigner(keys, TOKEN_ACTIVE_KID or next(iter(keys)))
+
+
+if TOKEN_MODE not in ("db", "signed"):
+    raise ValueError(f"不支持的令牌模式: {TOKEN_MODE}")
+
+token_signer = _build_token_signer()
+revocation_list = RevocationList()
@@ -0,0 +1,158 @@
+"""
+训练资源调度器 - 限制同时进行的模型训练数量，为TensorFlow分配线程预算，并提供排队信息
+
+多个 /predict 请求同时触发训练时，超出并发上限的任务按先来先服务排队，
+避免每个训练会话都占满全部CPU核心，拖垮API和Streamlit进程。
+"""
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+CPU_COUNT = os.cpu_count() or 1
+
+# 同时进行的训练任务上限
+MAX_CONCURRENT_TRAININGS = max(1, int(os.environ.get("HOUSING_MAX_CONCURRENT_TRAININGS", "2")))
+# 排队任务上限，超出后直接拒绝
+TRAINING_QUEUE_SIZE = max(0, int(os.environ.get("HOUSING_TRAINING_QUEUE_SIZE", "16")))
+# 每个训练任务的TensorFlow线程预算，默认把CPU核心平均分给并发任务
+TRAINING_INTRA_OP_THREADS = max(1, int(os.environ.get(
+    "HOUSING_TRAINING_INTRA_OP_THREADS", str(max(1, CPU_COUNT // MAX_CONCURRENT_TRAININGS)))))
+TRAINING_INTER_OP_THREADS = max(1, int(os.environ.get("HOUSING_TRAINING_INTER_OP_THREADS", "2")))
+
+
+class TrainingQueueFull(Exception):
+    """训练队列已满"""
+
+
+class TrainingJob:
+    """一个训练任务的排队与运行状态"""
+
+    def __init__(self, job_id: int, description: str):
+        self.id = job_id
+        self.description = description
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.initial_position = 0  # 入队时前面的排队任务数，0表示无需等待
+
+    @property
+    def wait_seconds(self) -> float:
+        end = self.started_at if self.started_at is not None else time.time()
+        return end - self.enqueued_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "description": self.description,
+            "enqueued_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.enqueued_at)),
+            "wait_seconds": round(self.wait_seconds, 2),
+            "running_seconds": round(time.time() - self.started_at, 2) if self.started_at else None,
+        }
+
+
+class TrainingGovernor:
+    """训练并发控制：固定数量的运行槽位 + 先进先出等待队列"""
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._running: Dict[int, TrainingJob] = {}
+        self._queue: deque = deque()
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    @contextmanager
+    def slot(self, description: str):
+        """获取训练槽位，槽位已满时阻塞排队；队列已满时抛出 TrainingQueueFull"""
+        with self._cond:
+            if len(self._running) >= self.max_concurrent and len(self._queue) >= self.max_queue:
+                self._rejected += 1
+                raise TrainingQueueFull(
+                    f"训练队列已满（运行中{len(self._running)}个，排队{len(self._queue)}个），请稍后重试"
+                )
+
+            job = TrainingJob(next(self._ids), description)
+            job.initial_position = len(self._queue) + (1 if len(self._running) >= self.max_concurrent else 0)
+            self._queue.append(job)
+            while self._queue[0] is not job or len(self._running) >= self.max_concurrent:
+                self._cond.wait()
+
+            self._queue.popleft()
+            job.started_at = time.time()
+            self._running[job.id] = job
+            self._total_wait += job.wait_seconds
+            # 队首变化，唤醒下一个可能可以开始的任务
+            self._cond.notify_all()
+
+        try:
+            yield job
+        finally:
+            with self._cond:
+                self._running.pop(job.id, None)
+                self._completed += 1
+                self._total_run += time.time() - job.started_at
+                self._cond.notify_all()
+
+    def status(self) -> Dict[str, Any]:
+        """当前资源使用情况，便于运维评估机器规格"""
+        with self._cond:
+            running = [job.to_dict() for job in self._running.values()]
+            queued = [dict(job.to_dict(), position=i) for i, job in enumerate(self._queue, start=1)]
+            completed = self._completed
+            status = {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "running": len(running),
+                "queued": len(queued),
+                "utilization": round(len(running) / self.max_concurrent, 2),
+                "completed": completed,
+                "rejected": self._rejected,
+                "avg_wait_seconds": round(self._total_wait / (completed + len(running)), 2) if completed + len(running) else 0.0,
+                "avg_run_seconds": round(self._total_run / completed, 2) if completed else 0.0,
+                "running_jobs": running,
+                "queued_jobs": queued,
+            }
+
+        status["cpu_count"] = CPU_COUNT
+        status["thread_budget"] = {
+            "intra_op": TRAINING_INTRA_OP_THREADS,
+            "inter_op": TRAINING_INTER_OP_THREADS,
+        }
+        if hasattr(os, "getloadavg"):
+            status["load_average"] = [round(x, 2) for x in os.getloadavg()]
+        return status
+
+
+_tensorflow_configured = False
+_tensorflow_lock = threading.Lock()
+
+
+def apply_tensorflow_thread_budget():
+    """
+    设置TensorFlow的intra/inter-op线程数。
+    TensorFlow的线程池是进程级的，只能在运行时初始化前设置一次，因此在首次训练前调用。
+    """
+    global _tensorflow_configured
+    if _tensorflow_configured:
+        return
+    with _tensorflow_lock:
+        if _tensorflow_configured:
+            return
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(TRAINING_INTRA_OP_THREADS)
+            tf.config.threading.set_inter_op_parallelism_threads(TRAINING_INTER_OP_THREADS)
+        except RuntimeError as e:
+            print(f"⚠️ TensorFlow已初始化，线程预算未生效: {e}")
+        _tensorflow_configured = True
+
+
+# 全局调度器实例
+training_governor = TrainingGovernor(MAX_CONCURRENT_TRAININGS, TRAINING_QUEUE_SIZE)
@@ -0,0 +1,237 @@
+"""
+批量导入用户 - 从CSV/JSON（如人事系统导出）批量创建账户
+
+整批数据先用pandas做向量化校验，再用一次集合查询检查与已有用户的重复，
+最后按块用 executemany 写入，每块一个事务，并返回逐行的错误报告。
+
+命令行用法:
+    python -m backend.user_import users.csv [--format csv|json] [--dry-run]
+"""
+import argparse
+import io
+import json
+import os
+import secrets
+import sqlite3
+import sys
+from datetime import datetime
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from backend.database import db_pool, init_sqlite_database
+from backend.security import PasswordHashingBusy, password_service
+
+# 每个写入事务包含的用户数和单次导入的最大行数
+USER_IMPORT_CHUNK_SIZE = int(os.environ.get("HOUSING_USER_IMPORT_CHUNK_SIZE", "500"))
+USER_IMPORT_MAX_ROWS = int(os.environ.get("HOUSING_USER_IMPORT_MAX_ROWS", "10000"))
+# 导入文件的最大字节数，接口在读取和解析之前按此拒绝过大的请求体
+USER_IMPORT_MAX_BYTES = int(os.environ.get("HOUSING_USER_IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+
+USER_COLUMNS = ["username", "email", "password", "full_name"]
+
+# 与 /auth/register 的校验规则保持一致
+USERNAME_PATTERN = r"[A-Za-z0-9_]{3,50}"
+EMAIL_PATTERN = r"[^@\s]+@[^@\s]+\.[^@\s]+"
+MIN_PASSWORD_LENGTH = 6
+
+INSERT_USER_SQL = """
+    INSERT INTO users (username, email, password_hash, full_name, created_at, is_active)
+    VALUES (?, ?, ?, ?, ?, 1)
+"""
+
+
+class UserImportError(Exception):
+    """导入文件无法解析或不符合要求"""
+
+
+def parse_user_file(content, fmt: str = "csv") -> pd.DataFrame:
+    """把CSV或JSON（对象数组或JSON Lines）解析为包含标准列的DataFrame"""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8-sig")
+    try:
+        if fmt == "csv":
+            df = pd.read_csv(io.StringIO(content), dtype=str, keep_default_na=False)
+        elif fmt == "json":
+            stripped = content.lstrip()
+            if stripped.startswith("["):
+                records = json.loads(stripped)
+            else:
+                records = [json.loads(line) for line in content.splitlines() if line.strip()]
+            df = pd.DataFrame.from_records(records)
+        else:
+            raise UserImportError(f"不支持的文件格式: {fmt}")
+    except (ValueError, pd.errors.ParserError) as e:
+        raise UserImportError(f"文件解析失败: {e}")
+
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    missing = {"username", "email"} - set(df.columns)
+    if missing:
+        raise UserImportError(f"缺少必需的列: {', '.join(sorted(missing))}")
+    if len(df) > USER_IMPORT_MAX_ROWS:
+        raise UserImportError(f"单次最多导入 {USER_IMPORT_MAX_ROWS} 行，当前 {len(df)} 行")
+
+    for column in USER_COLUMNS:
+        if column not in df.columns:
+            df[column] = ""
+    df = df[USER_COLUMNS].fillna("").astype(str)
+    for column in ("username", "email", "full_name"):
+        df[column] = df[column].str.strip()
+    # 行号从1开始，对应文件中的数据行
+    df.index = pd.RangeIndex(1, len(df) + 1, name="row")
+    return df
+
+
+def validate_user_frame(df: pd.DataFrame) -> pd.Series:
+    """向量化校验，返回每行的错误列表（空列表表示通过）"""
+    checks = [
+        (~df["username"].str.fullmatch(USERNAME_PATTERN), "用户名格式不正确，长度3-50位，只能包含字母、数字、下划线"),
+        (~df["email"].str.fullmatch(EMAIL_PATTERN), "邮箱格式不正确"),
+        ((df["password"] != "") & (df["password"].str.len() < MIN_PASSWORD_LENGTH), "密码长度至少6位"),
+        (df["username"].duplicated(keep="first"), "用户名在文件中重复"),
+        (df["email"].duplicated(keep="first"), "邮箱在文件中重复"),
+    ]
+    errors = pd.Series([[] for _ in range(len(df))], index=df.index, dtype=object)
+    for mask, message in checks:
+        for row in mask[mask].index:
+            errors[row].append(message)
+    return errors
+
+
+def find_existing(usernames: List[str], emails: List[str]) -> Dict[str, set]:
+    """一次集合查询找出已存在的用户名和邮箱"""
+    rows = db_pool.connection().execute("""
+        SELECT username, email FROM users
+        WHERE username IN (SELECT value FROM json_each(?))
+           OR email IN (SELECT value FROM json_each(?))
+    """, (json.dumps(usernames), json.dumps(emails))).fetchall()
+    return {
+        "usernames": {row["username"] for row in rows},
+        "emails": {row["email"] for row in rows},
+    }
+
+
+def _insert_chunk(rows: List[tuple]) -> List[Dict[str, Any]]:
+    """写入一块用户，返回失败行；块内发生唯一约束冲突（并发注册）时逐行重试以定位冲突行"""
+    try:
+        with db_pool.transaction() as conn:
+            conn.executemany(INSERT_USER_SQL, [row[1:] for row in rows])
+        return []
+    except sqlite3.IntegrityError:
+        pass
+
+    failed = []
+    with db_pool.transaction() as conn:
+        for row in rows:
+            try:
+                conn.execute(INSERT_USER_SQL, row[1:])
+            except sqlite3.IntegrityError:
+                failed.append({"row": row[0], "username": row[1], "errors": ["用户名或邮箱已存在"]})
+    return failed
+
+
+def import_users(df: pd.DataFrame, dry_run: bool = False,
+                 chunk_size: int = USER_IMPORT_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    导入已解析的用户数据。未提供密码的行会生成临时密码，并在结果中返回（仅此一次）。
+    dry_run 为真时只做校验和重复检查，不写入数据库。
+    """
+    errors = validate_user_frame(df)
+
+    existing = find_existing(df["username"].tolist(), df["email"].tolist())
+    for row in df.index[df["username"].isin(existing["usernames"])]:
+        errors[row].append("用户名已存在")
+    for row in df.index[df["email"].isin(existing["emails"])]:
+        errors[row].append("邮箱已存在")
+
+    valid = df[errors.map(len) == 0].copy()
+    report = [
+        {"row": int(row), "username": df.at[row, "username"], "errors": row_errors}
+        for row, row_errors in errors.items() if row_errors
+    ]
+
+    generated = valid["password"] == ""
+    valid.loc[generated, "password"] = [secrets.token_urlsafe(9) for _ in range(int(generated.sum()))]
+
+    if dry_run:
+        return {
+            "success": True,
+            "dry_run": True,
+            "total": len(df),
+            "valid": len(valid),
+            "created": 0,
+            "failed": len(report),
+            "errors": report,
+        }
+
+    try:
+        password_hashes = password_service.hash_many(valid["password"].tolist())
+    except PasswordHashingBusy as e:
+        return {"success": False, "message": str(e), "busy": True}
+
+    created_at = datetime.now().isoformat()
+    rows = [
+        (int(row), username, email, password_hash, full_name or None, created_at)
+        for row, username, email, password_hash, full_name in zip(
+            valid.index, valid["username"], valid["email"], password_hashes, valid["full_name"]
+        )
+    ]
+
+    chunk_errors = []
+    for start in range(0, len(rows), max(1, chunk_size)):
+        chunk_errors.extend(_insert_chunk(rows[start:start + chunk_size]))
+
+    failed_rows = {item["row"] for item in chunk_errors}
+    report = sorted(report + chunk_errors, key=lambda item: item["row"])
+    temporary_passwords = [
+        {"row": int(row), "username": valid.at[row, "username"], "temporary_password": valid.at[row, "password"]}
+        for row in valid.index[generated] if int(row) not in failed_rows
+    ]
+
+    return {
+        "success": True,
+        "dry_run": False,
+        "total": len(df),
+        "valid": len(valid),
+        "created": len(rows) - len(chunk_errors),
+        "failed": len(report),
+        "errors": report,
+        "temporary_passwords": temporary_passwords,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从CSV/JSON文件批量导入用户")
+    parser.add_argument("path", help="用户文件，列: username, email, password(可选), full_name(可选)")
+    parser.add_argument("--format", choices=["csv", "json"], help="文件格式，默认按扩展名判断")
+    parser.add_argument("--dry-run", action="store_true", help="只校验，不写入数据库")
+    parser.add_argument("--chunk-size", type=int, default=USER_IMPORT_CHUNK_SIZE, help="每个事务写入的用户数")
+    args = parser.parse_args()
+
+    fmt = args.format or ("json" if args.path.lower().endswith((".json", ".jsonl")) else "csv")
+    with open(args.path, "rb") as f:
+        content = f.read()
+
+    if not init_sqlite_database():
+        sys.exit(1)
+
+    try:
+        df = parse_user_file(content, fmt)
+    except UserImportError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    result = import_users(df, dry_run=args.dry_run, chunk_size=args.chunk_size)
+    if not result["success"]:
+        print(f"❌ {result['message']}")
+        sys.exit(1)
+
+    print(f"共 {result['total']} 行，校验通过 {result['valid']} 行，创建 {result['created']} 个用户，失败 {result['failed']} 行")
+    for item in result["errors"]:
+        print(f"  第 {item['row']} 行 ({item['username']}): {'；'.join(item['errors'])}")
+    for item in result.get("temporary_passwords", []):
+        print(f"  临时密码 {item['username']}: {item['temporary_password']}")
+
+
+if __name__ == "__main__":
+    main()
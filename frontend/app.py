@@ -6,7 +6,7 @@ from streamlit_option_menu import option_menu
 import os
 import pandas as pd
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # 设置页面配置
 st.set_page_config(page_title="房价分析系统", page_icon="🏠", layout="wide")
@@ -156,6 +156,74 @@ def load_css(file_name):
 # 调用函数加载CSS
 load_css("style.css")
 
+def stream_ai_assistant(payload: dict, placeholder):
+    """
+    以SSE流式调用AI助手，边接收边在 placeholder 中渲染文本。
+    返回 (完整文本, 基础统计, 错误信息)
+    """
+    text, basic_stats, error = "", None, None
+    with requests.post(f"{BACKEND_URL}/ai/assistant", json=dict(payload, stream=True),
+                       headers=get_auth_headers(), stream=True, timeout=(5, 120)) as res:
+        if "text/event-stream" not in res.headers.get("content-type", ""):
+            # 参数错误等情况后端直接返回JSON
+            result = res.json()
+            return result.get("text", ""), result.get("basic_stats"), result.get("error")
+
+        event = None
+        for line in res.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[5:].strip())
+                if event == "delta":
+                    text += data["text"]
+                    placeholder.markdown(text + "▌")
+                elif event == "stats":
+                    basic_stats = data
+                elif event == "error":
+                    error = data["error"]
+    placeholder.markdown(text)
+    return text, basic_stats, error
+
+def stream_ai_batch(city: str):
+    """以SSE批量分析城市的所有区域，每完成一个区域就展示一个结果"""
+    progress = st.progress(0.0, text="正在分析各区域...")
+    total, finished = 0, 0
+    with requests.post(f"{BACKEND_URL}/ai/assistant/batch", json={"city": city},
+                       headers=get_auth_headers(), stream=True, timeout=(5, 300)) as res:
+        if "text/event-stream" not in res.headers.get("content-type", ""):
+            progress.empty()
+            body = res.json()
+            st.error(body.get("error") or body.get("detail") or "批量分析失败")
+            return
+
+        event = None
+        for line in res.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            data = json.loads(line[5:].strip())
+            if event == "start":
+                total = data["total"]
+            elif event == "result":
+                finished += 1
+                progress.progress(finished / max(total, 1), text=f"已完成 {finished}/{total} 个区域")
+                with st.expander(data["area"]):
+                    if "error" in data:
+                        st.error(data["error"])
+                    else:
+                        stats = data.get("basic_stats") or {}
+                        st.caption(
+                            f"当前价格 {stats.get('current_price') or 0:,.0f} 元/㎡ · "
+                            f"近{stats.get('sample_count', 0)}个月变化 {stats.get('price_change_percentage') or 0:+.2f}%"
+                        )
+                        st.markdown(data["text"])
+            elif event == "done":
+                progress.progress(1.0, text=f"分析完成：成功 {data['completed']} 个，失败 {data['failed']} 个，"
+                                            f"用时 {data['elapsed_seconds']} 秒")
+
 def render_basic_stats(stats: dict):
     """将基础统计数据友好地用中文格式化输出"""
     if not stats:
@@ -844,58 +912,56 @@ if page == "AI助手":
         areas = load_areas_for_city(city) if city else []
         area = st.selectbox("请选择区域（可选）", [""] + areas, key="ai_area")
         if st.button("让AI分析房价趋势", use_container_width=True):
-            with st.spinner("AI正在分析..."):
-                payload = {
-                    "query": "请分析该地区的房价趋势",
-                    "city": city,
-                    "area": area if area else None
-                }
-                try:
-                    res = requests.post(f"{BACKEND_URL}/ai/assistant", json=payload, headers=get_auth_headers())
-                    result = res.json()
-                    if "error" in result:
-                        st.error(result["error"])
-                    else:
-                        # 展示AI回复
-                        st.markdown("##### AI分析结果：")
-                        if "error" in result:
-                            st.error(result["error"])
-                        elif "text" in result:
-                            st.markdown(result["text"])
-                        else:
-                            st.warning("AI未返回有效内容")
-                        # 展示基础统计（可选）
-                        if "basic_stats" in result:
-                            render_basic_stats(result["basic_stats"])
-                        # 聊天历史
-                        st.session_state.ai_chat_history.append({
-                            "role": "user", "content": f"[{city} {area}] 房价趋势分析"
-                        })
-                        st.session_state.ai_chat_history.append({
-                            "role": "ai", "content": result["text"]
-                        })
-                except Exception as e:
-                    st.error(f"AI分析失败: {str(e)}")
+            payload = {
+                "query": "请分析该地区的房价趋势",
+                "city": city,
+                "area": area if area else None
+            }
+            try:
+                # 展示AI回复（流式逐段显示）
+                st.markdown("##### AI分析结果：")
+                text, basic_stats, error = stream_ai_assistant(payload, st.empty())
+                if error:
+                    st.error(error)
+                elif not text:
+                    st.warning("AI未返回有效内容")
+                # 展示基础统计（可选）
+                if basic_stats:
+                    render_basic_stats(basic_stats)
+                if text:
+                    # 聊天历史
+                    st.session_state.ai_chat_history.append({
+                        "role": "user", "content": f"[{city} {area}] 房价趋势分析"
+                    })
+                    st.session_state.ai_chat_history.append({
+                        "role": "ai", "content": text
+                    })
+            except Exception as e:
+                st.error(f"AI分析失败: {str(e)}")
+        if st.button("批量分析该城市所有区域", use_container_width=True, disabled=not st.session_state.logged_in,
+                     help=None if st.session_state.logged_in else "批量分析需要登录"):
+            try:
+                st.markdown(f"##### {city} 各区域AI分析：")
+                stream_ai_batch(city)
+            except Exception as e:
+                st.error(f"批量分析失败: {str(e)}")
     else:
         # 自由对话
         user_input = st.text_area("输入你的问题（如：介绍北京房价走势、未来房价趋势等）", key="ai_input")
         if st.button("发送", use_container_width=True):
             if user_input.strip():
-                with st.spinner("AI正在思考..."):
-                    payload = {"query": user_input}
-                    try:
-                        res = requests.post(f"{BACKEND_URL}/ai/assistant", json=payload, headers=get_auth_headers())
-                        result = res.json()
-                        if "error" in result:
-                            st.error(result["error"])
-                        else:
-                            st.markdown("##### AI回复：")
-                            st.markdown(result["text"])
-                            # 聊天历史
-                            st.session_state.ai_chat_history.append({"role": "user", "content": user_input})
-                            st.session_state.ai_chat_history.append({"role": "ai", "content": result["text"]})
-                    except Exception as e:
-                        st.error(f"AI对话失败: {str(e)}")
+                payload = {"query": user_input}
+                try:
+                    st.markdown("##### AI回复：")
+                    text, _, error = stream_ai_assistant(payload, st.empty())
+                    if error:
+                        st.error(error)
+                    elif text:
+                        # 聊天历史
+                        st.session_state.ai_chat_history.append({"role": "user", "content": user_input})
+                        st.session_state.ai_chat_history.append({"role": "ai", "content": text})
+                except Exception as e:
+                    st.error(f"AI对话失败: {str(e)}")
             else:
                 st.warning("请输入你的问题")
 
@@ -1065,54 +1131,37 @@ elif page == "用户管理":
     # 用户列表（管理员功能）
     st.subheader("📋 用户列表")
     
-    if st.button("🔄 刷新用户列表"):
+    # 筛选条件（在服务端执行），查询后按页懒加载
+    with st.form("user_list_filters"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            status_filter = st.selectbox("账户状态", ["全部", "活跃", "禁用"])
+        with col2:
+            username_prefix = st.text_input("用户名前缀", placeholder="例如 zhang")
+        with col3:
+            page_size = st.selectbox("每页数量", [20, 50, 100, 200], index=1)
+        
+        filter_by_date = st.checkbox("按创建时间筛选")
+        col1, col2 = st.columns(2)
+        with col1:
+            created_from = st.date_input("创建时间起", value=datetime.now().date() - timedelta(days=30))
+        with col2:
+            created_to = st.date_input("创建时间止", value=datetime.now().date())
+        
+        submitted = st.form_submit_button("🔄 查询用户列表")
+    
+    def fetch_user_page(cursor=None):
+        """请求一页用户数据，成功时追加到 session_state 中"""
+        params = dict(st.session_state.user_list_query, cursor=cursor) if cursor else dict(st.session_state.user_list_query)
         try:
-            response = requests.get(f"{BACKEND_URL}/auth/users", headers=get_auth_headers())
+            response = requests.get(f"{BACKEND_URL}/auth/users", params=params, headers=get_auth_headers(), timeout=10)
             if response.status_code == 200:
                 data = response.json()
                 if data["success"]:
-                    users_data = data["users"]
-                    
-                    if users_data:
-                        # 转换为DataFrame并显示
-                        df_users = pd.DataFrame(users_data)
-                        
-                        # 格式化时间列
-                        if 'created_at' in df_users.columns:
-                            df_users['created_at'] = pd.to_datetime(df_users['created_at']).dt.strftime('%Y-%m-%d %H:%M')
-                        if 'last_login' in df_users.columns:
-                            df_users['last_login'] = pd.to_datetime(df_users['last_login'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M')
-                        
-                        # 重命名列
-                        column_mapping = {
-                            'id': 'ID',
-                            'username': '用户名',
-                            'email': '邮箱',
-                            'full_name': '姓名',
-                            'created_at': '创建时间',
-                            'last_login': '最后登录',
-                            'is_active': '状态'
-                        }
-                        df_display = df_users.rename(columns=column_mapping)
-                        
-                        # 状态格式化
-                        if '状态' in df_display.columns:
-                            df_display['状态'] = df_display['状态'].map({True: '✅ 活跃', False: '❌ 禁用'})
-                        
-                        st.dataframe(df_display, use_container_width=True)
-                        
-                        # 统计信息
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("总用户数", len(users_data))
-                        with col2:
-                            active_users = sum(1 for user in users_data if user.get('is_active', False))
-                            st.metric("活跃用户", active_users)
-                        with col3:
-                            recent_users = sum(1 for user in users_data if user.get('last_login'))
-                            st.metric("有登录记录", recent_users)
-                    else:
-                        st.info("暂无用户数据")
+                    st.session_state.user_list_rows.extend(data["users"])
+                    st.session_state.user_list_cursor = data.get("next_cursor")
+                    if "total" in data:
+                        st.session_state.user_list_total = data["total"]
                 else:
                     st.error(data.get("message", "获取用户列表失败"))
             elif response.status_code == 403:
@@ -1123,6 +1172,72 @@ elif page == "用户管理":
         except Exception as e:
             st.error(f"获取用户列表失败: {str(e)}")
     
+    if submitted:
+        query = {"limit": page_size, "include_total": True}
+        if status_filter != "全部":
+            query["is_active"] = status_filter == "活跃"
+        if username_prefix.strip():
+            query["username_prefix"] = username_prefix.strip()
+        if filter_by_date:
+            query["created_from"] = created_from.isoformat()
+            # 上界不含，取结束日期的下一天
+            query["created_to"] = (created_to + timedelta(days=1)).isoformat()
+        
+        st.session_state.user_list_query = query
+        st.session_state.user_list_rows = []
+        st.session_state.user_list_cursor = None
+        st.session_state.user_list_total = None
+        fetch_user_page()
+    
+    if "user_list_rows" in st.session_state:
+        users_data = st.session_state.user_list_rows
+        
+        if users_data:
+            # 转换为DataFrame并显示
+            df_users = pd.DataFrame(users_data)
+            
+            # 格式化时间列
+            if 'created_at' in df_users.columns:
+                df_users['created_at'] = pd.to_datetime(df_users['created_at'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M')
+            if 'last_login' in df_users.columns:
+                df_users['last_login'] = pd.to_datetime(df_users['last_login'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M')
+            
+            # 重命名列
+            column_mapping = {
+                'id': 'ID',
+                'username': '用户名',
+                'email': '邮箱',
+                'full_name': '姓名',
+                'created_at': '创建时间',
+                'last_login': '最后登录',
+                'is_active': '状态'
+            }
+            df_display = df_users.rename(columns=column_mapping)
+            
+            # 状态格式化
+            if '状态' in df_display.columns:
+                df_display['状态'] = df_display['状态'].map({1: '✅ 活跃', 0: '❌ 禁用', True: '✅ 活跃', False: '❌ 禁用'})
+            
+            st.dataframe(df_display, use_container_width=True)
+            
+            # 统计信息
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                total = st.session_state.user_list_total
+                st.metric("符合条件用户数", total if total is not None else len(users_data))
+            with col2:
+                st.metric("已加载", len(users_data))
+            with col3:
+                active_users = sum(1 for user in users_data if user.get('is_active', False))
+                st.metric("已加载中活跃用户", active_users)
+            
+            if st.session_state.user_list_cursor:
+                if st.button("⬇️ 加载更多"):
+                    fetch_user_page(st.session_state.user_list_cursor)
+                    st.rerun()
+        else:
+            st.info("暂无符合条件的用户")
+    
     # 使用说明
     with st.expander("📚 用户管理说明"):
         st.markdown("""
@@ -1131,9 +1246,9 @@ elif page == "用户管理":
         - 刷新最新的登录状态
         
         **用户列表**：
-        - 查看系统中所有注册用户
+        - 按账户状态、用户名前缀、创建时间筛选注册用户
+        - 结果分页加载，点击"加载更多"获取下一页
         - 查看用户活跃状态和登录记录
-        - 提供用户统计信息
         
         **安全提示**：
         - 定期更换密码保护账户安全
@@ -1180,6 +1295,12 @@ if page == "房价预测":
             value=6,
             help="预测未来几个月的房价走势"
         )
+        interval_levels = st.multiselect(
+            "预测区间（可选）",
+            [80, 95],
+            format_func=lambda level: f"{level}%",
+            help="基于历史残差的蒙特卡洛模拟，展示预测的不确定性范围"
+        )
 
     # 开始预测
     if st.button("开始预测", type="primary"):
@@ -1197,6 +1318,8 @@ if page == "房价预测":
                         "model_type": model_name,
                         "periods": periods
                     }
+                    if interval_levels:
+                        request_data["intervals"] = interval_levels
 
                     # 发送请求
                     response = requests.post(
@@ -1210,6 +1333,8 @@ if page == "房价预测":
 
                         if result["success"]:
                             st.success("✅ 预测完成")
+                            if result.get("message"):
+                                st.warning(result["message"])
 
                             # 显示预测结果
                             predictions = result["predictions"]
@@ -1228,6 +1353,15 @@ if page == "房价预测":
                             with col4:
                                 st.metric("最低价格", f"{metrics['min_price']:,.0f}")
 
+                            # 模型来源与训练耗时
+                            if metrics.get("model_source") == "trained":
+                                warm_note = "（热启动）" if metrics.get("warm_start") else ""
+                                st.caption(f"⏱️ 本次重新训练模型{warm_note}，耗时 {metrics.get('fit_time_seconds', 0):.2f} 秒")
+                                if metrics.get("queue_wait_seconds"):
+                                    st.caption(f"⏳ 训练前排队 {metrics['queue_wait_seconds']:.1f} 秒（入队时前方 {metrics.get('queue_position', 0)} 个任务）")
+                            elif metrics.get("model_source"):
+                                st.caption("⚡ 使用已缓存的模型，无需重新训练")
+
                             # 创建预测数据框
                             df_pred = pd.DataFrame(predictions)
                             df_pred["date"] = pd.to_datetime(df_pred["date"])
@@ -1248,6 +1382,26 @@ if page == "房价预测":
 
                                 fig = px.line()
 
+                                # 添加预测区间（先画宽区间，窄区间叠加在上层）
+                                for level in sorted(interval_levels, reverse=True):
+                                    if f"upper_{level}" not in df_pred.columns:
+                                        continue
+                                    fig.add_scatter(
+                                        x=df_pred["date"],
+                                        y=df_pred[f"upper_{level}"],
+                                        line=dict(width=0),
+                                        showlegend=False,
+                                        hoverinfo="skip"
+                                    )
+                                    fig.add_scatter(
+                                        x=df_pred["date"],
+                                        y=df_pred[f"lower_{level}"],
+                                        fill="tonexty",
+                                        fillcolor="rgba(255, 0, 0, 0.12)",
+                                        line=dict(width=0),
+                                        name=f"{level}% 预测区间"
+                                    )
+
                                 # 添加历史数据
                                 fig.add_scatter(
                                     x=df_hist["date"],
@@ -1279,8 +1433,12 @@ if page == "房价预测":
                                 # 格式化日期和价格
                                 df_display = df_pred.copy()
                                 df_display["date"] = df_display["date"].dt.strftime("%Y-%m-%d")
-                                df_display["predicted_price"] = df_display["predicted_price"].round(2)
-                                df_display.columns = ["日期", "预测价格 (元/平方米)"]
+                                df_display = df_display.round(2)
+                                display_columns = {"date": "日期", "predicted_price": "预测价格 (元/平方米)"}
+                                for level in interval_levels:
+                                    display_columns[f"lower_{level}"] = f"{level}%区间下限"
+                                    display_columns[f"upper_{level}"] = f"{level}%区间上限"
+                                df_display = df_display.rename(columns=display_columns)
 
                                 st.dataframe(df_display, use_container_width=True)
 
@@ -0,0 +1,40 @@
+"""批量AI分析接口的认证与限流回归测试"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main, rate_limit
+from backend.database import token_cache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def fake_analyze(city, city_df, version):
+        yield {"areas": sorted(city_df["area"].unique())}
+
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(main.ai_service, "analyze_city_areas_async", fake_analyze)
+    monkeypatch.setattr(main.rate_limiter, "buckets", rate_limit.ShardedTokenBuckets(4))
+    return TestClient(main.app)
+
+
+def test_batch_requires_login(client):
+    assert client.post("/ai/assistant/batch", json={"city": "北京"}).status_code == 401
+
+
+def test_batch_is_charged_per_area(client):
+    token = "batch-user-token"
+    user = {"id": 987301, "username": "batch", "email": "batch@example.com", "full_name": ""}
+    token_cache.put(token, user, (datetime.now() + timedelta(days=1)).isoformat())
+    headers = {"Authorization": f"Bearer {token}"}
+
+    areas = main.df[main.df["city"] == "北京"]["area"].nunique()
+    _, burst = rate_limit.RATE_LIMITS["ai_batch"]
+    # 每个请求共扣除与区域数相同的令牌（中间件一个，接口补扣其余）
+    for _ in range(int(burst // areas)):
+        response = client.post("/ai/assistant/batch", json={"city": "北京"}, headers=headers)
+        assert response.status_code == 200
+    response = client.post("/ai/assistant/batch", json={"city": "北京"}, headers=headers)
+    assert response.status_code == 429
+    assert response.headers["X-RateLimit-Class"] == "ai_batch"
@@ -0,0 +1,76 @@
+"""AI服务并发限制与熔断计时的回归测试"""
+import asyncio
+
+from backend.ai_service import AICallLimiter, AICircuitBreaker, AIService
+
+SLOW_SECONDS = 0.2
+QUEUE_WAIT = 0.5
+
+
+class _FastResponse:
+    status_code = 200
+    text = "{}"
+
+    @staticmethod
+    def json():
+        return {"choices": [{"message": {"content": "ok"}}], "model": "fake", "usage": {"total_tokens": 1}}
+
+
+class _FakeAsyncClient:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    async def post(self, url, json):
+        await asyncio.sleep(self.delay)
+        return _FastResponse()
+
+
+def _service(delay: float = 0.0) -> AIService:
+    service = AIService(api_key="test-key")
+    service.limiter = AICallLimiter(max_concurrency=1, queue_timeout=5)
+    service.breaker = AICircuitBreaker(failure_threshold=1, slow_seconds=SLOW_SECONDS, cooldown_seconds=60)
+    service.cache.enabled = False
+    service._async_client = _FakeAsyncClient(delay)
+    return service
+
+
+def test_slot_wait_does_not_open_breaker():
+    service = _service()
+
+    async def scenario():
+        held = asyncio.Event()
+
+        async def hold_slot():
+            async with service.limiter.slot_async():
+                held.set()
+                await asyncio.sleep(QUEUE_WAIT)
+
+        holder = asyncio.ensure_future(hold_slot())
+        await held.wait()
+        result = await service.chat_with_ai_async("上海房价")
+        await holder
+        return result
+
+    result = asyncio.run(scenario())
+    assert result["text"] == "ok"
+    assert service.breaker.stats()["state"] == "closed"
+    assert service.breaker.stats()["consecutive_failures"] == 0
+
+
+def test_slow_upstream_still_counts_as_failure():
+    service = _service(delay=SLOW_SECONDS + 0.1)
+    asyncio.run(service.chat_with_ai_async("广州房价"))
+    assert service.breaker.stats()["state"] == "open"
+
+
+def test_concurrency_cap_is_global():
+    service = _service(delay=0.05)
+    service.limiter = AICallLimiter(max_concurrency=2, queue_timeout=5)
+
+    async def scenario():
+        await asyncio.gather(*(service.chat_with_ai_async(f"城市{i}房价") for i in range(6)))
+
+    asyncio.run(scenario())
+    stats = service.limiter.stats()
+    assert stats["acquired"] == 6
+    assert stats["peak_in_flight"] == 2
@@ -0,0 +1,99 @@
+"""令牌缓存的回归测试"""
+import time
+from datetime import datetime, timedelta
+
+from backend.database import TokenCache
+from backend.security import revocation_list
+
+
+def test_cached_token_is_dropped_after_user_revocation():
+    cache = TokenCache(max_size=10, ttl_seconds=300)
+    user = {"id": 987001, "username": "cached", "email": "cached@example.com", "full_name": ""}
+    expires_at = (datetime.now() + timedelta(days=1)).isoformat()
+    cache.put("token-a", user, expires_at)
+    assert cache.get("token-a") == user
+
+    # 模拟其他进程停用该用户后同步过来的用户级吊销记录
+    revocation_list.revoke_user(user["id"], time.time(), time.time() + 60)
+    assert cache.get("token-a") is None
+
+    # 重新验证（如用户被重新启用）后写入的缓存不受之前的吊销影响
+    time.sleep(0.01)
+    cache.put("token-a", user, expires_at)
+    assert cache.get("token-a") == user
+
+
+def test_concurrent_rollup_refresh_counts_each_log_once(tmp_path, monkeypatch):
+    import threading
+    from backend import database
+
+    pool = database.SQLiteConnectionPool(str(tmp_path / "rollup.db"))
+    monkeypatch.setattr(database, "db_pool", pool)
+    database.init_sqlite_database()
+    with pool.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO user_activity_logs (activity_type, activity_data, created_at) VALUES (?, ?, ?)",
+            [("predict", '{"city": "北京", "area": "海淀区"}', "2025-06-01 10:00:00")] * 2000
+        )
+
+    # 每个线程使用各自的连接，相当于多个工作进程同时运行汇总任务
+    barrier = threading.Barrier(4)
+
+    def refresh():
+        barrier.wait()
+        database.refresh_activity_rollups(batch_size=50)
+        pool.connection().close()
+
+    workers = [threading.Thread(target=refresh) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    conn = pool.connection()
+    assert conn.execute("SELECT SUM(count) FROM activity_hourly_rollup").fetchone()[0] == 2000
+    assert conn.execute("SELECT SUM(count) FROM activity_location_rollup").fetchone()[0] == 2000
+    pool.close_all()
+
+
+def test_init_does_not_vacuum_existing_database(tmp_path, monkeypatch):
+    import sqlite3
+    from backend import database
+
+    path = str(tmp_path / "legacy.db")
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE legacy (id INTEGER PRIMARY KEY)")
+    legacy.commit()
+    legacy.close()
+
+    pool = database.SQLiteConnectionPool(path)
+    monkeypatch.setattr(database, "db_pool", pool)
+    assert database.init_sqlite_database()
+    assert pool.connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    assert database.enable_incremental_vacuum()["changed"] is True
+    assert pool.connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    pool.close_all()
+
+
+def test_new_database_uses_incremental_vacuum(tmp_path, monkeypatch):
+    from backend import database
+
+    pool = database.SQLiteConnectionPool(str(tmp_path / "new.db"))
+    monkeypatch.setattr(database, "db_pool", pool)
+    assert database.init_sqlite_database()
+    assert pool.connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    pool.close_all()
+
+
+def test_revocation_during_verification_invalidates_cache_entry():
+    cache = TokenCache(max_size=10, ttl_seconds=300)
+    user = {"id": 987002, "username": "racing", "email": "racing@example.com", "full_name": ""}
+    expires_at = (datetime.now() + timedelta(days=1)).isoformat()
+
+    verified_at = time.time()
+    # 查询数据库之后、写入缓存之前，用户被停用
+    revocation_list.revoke_user(user["id"], time.time(), time.time() + 60)
+    time.sleep(0.01)
+    cache.put("token-b", user, expires_at, cached_at=verified_at)
+    assert cache.get("token-b") is None
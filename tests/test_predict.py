@@ -0,0 +1,22 @@
+"""预测接口参数校验的回归测试"""
+from fastapi.testclient import TestClient
+
+from backend import main
+
+
+def test_invalid_model_type_is_rejected_before_training_queue(monkeypatch):
+    def no_slot(*args, **kwargs):
+        raise AssertionError("无效请求不应占用训练槽位")
+
+    monkeypatch.setattr(main.training_governor, "slot", no_slot)
+    client = TestClient(main.app)
+    response = client.post("/predict", json={"city": "北京", "area": "海淀区", "model_type": "XGBoost"})
+    assert response.status_code == 200
+    assert response.json() == {"success": False, "message": "不支持的模型类型: XGBoost", "predictions": None, "metrics": None}
+
+
+def test_invalid_interval_is_rejected_before_training_queue(monkeypatch):
+    monkeypatch.setattr(main, "get_or_train_model", lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError()))
+    client = TestClient(main.app)
+    response = client.post("/predict", json={"city": "北京", "area": "海淀区", "intervals": [80, 100]})
+    assert response.json()["message"] == "预测区间置信水平必须在1-99之间"
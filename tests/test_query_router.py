@@ -0,0 +1,69 @@
+"""AI助手问题路由的回归测试"""
+import pandas as pd
+import pytest
+
+from backend.query_router import QueryRouter
+
+
+@pytest.fixture(scope="module")
+def router():
+    dates = pd.date_range("2024-01-01", periods=13, freq="MS")
+    base = {("北京", "海淀区"): 90000, ("北京", "朝阳区"): 70000, ("上海", "浦东新区"): 80000}
+    rows = [
+        {"city": city, "area": area, "date": date, "price": price + i * 100}
+        for (city, area), price in base.items()
+        for i, date in enumerate(dates)
+    ]
+    return QueryRouter(pd.DataFrame(rows))
+
+
+@pytest.mark.parametrize("query", [
+    "北京海淀区现在多少钱",
+    "海淀一平米多少",
+    "浦东房价",
+])
+def test_price_lookup_is_routed(router, query):
+    result = router.route(query)
+    assert result is not None and result["intent"] == "price_lookup"
+
+
+@pytest.mark.parametrize("query", [
+    "哪个城市最贵",
+    "北京哪个区最便宜",
+    "房价最高的城市",
+    "北京各区房价排名",
+])
+def test_price_ranking_is_routed(router, query):
+    result = router.route(query)
+    assert result is not None and result["intent"] == "ranking"
+
+
+@pytest.mark.parametrize("query", [
+    "中国大学排名",
+    "GDP最高的城市",
+    "北京最高的楼是哪栋",
+    "北京有多少个区",
+    "海淀区有多少人口",
+    "海淀区房价未来走势如何",
+])
+def test_non_price_questions_go_to_llm(router, query):
+    assert router.route(query) is None
+
+
+def test_lowest_price_ranking_is_ascending(router):
+    result = router.route("房价最低的区域")
+    assert result["data"]["order"] == "asc"
+    assert result["data"]["ranking"][0]["name"] == "北京朝阳区"
+
+
+@pytest.mark.parametrize("query", ["北京海淀区房价排名", "海淀区房价最高吗"])
+def test_single_area_ranking_stays_within_its_city(router, query):
+    result = router.route(query)
+    assert result["intent"] == "ranking"
+    assert [item["name"] for item in result["data"]["ranking"]] == ["海淀区", "朝阳区"]
+    assert result["data"]["focus"] == {"name": "海淀区", "rank": 1, "of": 2}
+    assert "北京市各区域" in result["text"]
+
+
+def test_single_area_with_another_city_goes_to_llm(router):
+    assert router.route("上海和海淀哪个贵") is None
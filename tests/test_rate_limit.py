@@ -0,0 +1,50 @@
+"""请求限流身份识别的回归测试"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from backend import rate_limit
+from backend.database import token_cache
+from backend.rate_limit import RateLimiter, ShardedTokenBuckets
+
+
+def _request(ip: str, token: str = None):
+    headers = {"authorization": f"Bearer {token}"} if token else {}
+    return SimpleNamespace(headers=headers, client=SimpleNamespace(host=ip))
+
+
+def _kinds(keys):
+    return [key.split(":")[1] for key in keys]
+
+
+def test_identified_users_skip_ip_bucket():
+    limiter = RateLimiter(ShardedTokenBuckets(4))
+    user = {"id": 987101, "username": "ratelimit", "email": "r@example.com", "full_name": ""}
+    token_cache.put("rate-limit-token", user, (datetime.now() + timedelta(days=1)).isoformat())
+
+    assert _kinds(limiter.identity_keys("predict", _request("10.0.0.5", "rate-limit-token"))) == ["token", "user"]
+    # 匿名请求和无法识别的令牌仍按IP限流
+    assert _kinds(limiter.identity_keys("predict", _request("10.0.0.5"))) == ["ip"]
+    assert _kinds(limiter.identity_keys("predict", _request("10.0.0.5", "unknown-token"))) == ["ip", "token"]
+
+
+def test_users_behind_one_frontend_ip_do_not_share_budget():
+    limiter = RateLimiter(ShardedTokenBuckets(4))
+    expires_at = (datetime.now() + timedelta(days=1)).isoformat()
+    _, burst = rate_limit.RATE_LIMITS["predict"]
+    total_ip_burst = int(burst * rate_limit.RATE_LIMIT_IP_MULTIPLIER)
+    tokens = []
+    for i in range(total_ip_burst // int(burst) + 2):
+        token = f"frontend-user-{i}"
+        token_cache.put(token, {"id": 987200 + i, "username": token, "email": "", "full_name": ""}, expires_at)
+        tokens.append(token)
+
+    for token in tokens:
+        for _ in range(int(burst)):
+            assert limiter.buckets.acquire(limiter.identity_keys("predict", _request("10.0.0.9", token))) == 0
+
+
+def test_trusted_ip_skips_ip_bucket(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_TRUSTED_IPS", frozenset({"10.0.0.7"}))
+    limiter = RateLimiter(ShardedTokenBuckets(4))
+    assert limiter.identity_keys("ai", _request("10.0.0.7")) == []
+    assert _kinds(limiter.identity_keys("ai", _request("10.0.0.8"))) == ["ip"]
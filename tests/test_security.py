@@ -0,0 +1,60 @@
+"""令牌与密码哈希的回归测试"""
+from fastapi.testclient import TestClient
+
+from backend.security import token_signer
+
+
+def test_check_tag_rejects_non_ascii_tag():
+    assert token_signer.check_tag("abc.db.éé") is False
+    assert token_signer.check_tag(f"abc.{token_signer.active_kid}.éé") is False
+
+
+def test_check_tag_accepts_issued_tag():
+    assert token_signer.check_tag(token_signer.tag("abc")) is True
+
+
+def test_non_ascii_bearer_token_is_rejected_with_401():
+    from backend.main import app
+
+    client = TestClient(app)
+    kid = token_signer.active_kid
+    for token in ("abc.db.éé", f"abc.{kid}.éé"):
+        response = client.get("/auth/me", headers={"Authorization": f"Bearer {token}".encode("utf-8")})
+        assert response.status_code == 401
+
+
+def test_hash_many_leaves_room_for_interactive_requests():
+    import threading
+    import time
+    from backend.security import PasswordHashingService
+
+    class SlowHasher:
+        algorithm = "slow"
+
+        @staticmethod
+        def hash(password):
+            time.sleep(0.02)
+            return f"slow${password}"
+
+    service = PasswordHashingService(SlowHasher(), workers=1, max_pending=8, queue_timeout=5, batch_max_pending=2)
+    results = []
+    importer = threading.Thread(target=lambda: results.extend(service.hash_many(str(i) for i in range(30))))
+    importer.start()
+    time.sleep(0.1)
+    # 导入进行中，异步登录/注册（不等待空位）仍能提交
+    assert service.pending <= 2
+    assert service._submit(SlowHasher.hash, "login", wait=False).result() == "slow$login"
+    importer.join()
+    assert results == [f"slow${i}" for i in range(30)]
+
+
+def test_legacy_sha256_hash_is_verify_only():
+    import hashlib
+    from backend.security import HASHERS, identify_hasher, password_service
+
+    encoded = hashlib.sha256(b"secret123").hexdigest()
+    hasher = identify_hasher(encoded)
+    assert not hasattr(hasher, "hash")
+    assert hasher.algorithm not in HASHERS
+    assert hasher.verify("secret123", encoded)
+    assert password_service.needs_rehash(encoded)
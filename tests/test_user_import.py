@@ -0,0 +1,31 @@
+"""批量导入用户接口的回归测试"""
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main, rate_limit
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "USER_IMPORT_MAX_BYTES", 1024)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", False)
+    main.app.dependency_overrides[main.require_admin_permission] = lambda: {"id": 1, "username": "admin"}
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def test_oversized_import_is_rejected_before_parsing(client, monkeypatch):
+    monkeypatch.setattr(main, "parse_user_file", lambda *args: pytest.fail("超出上限的文件不应被解析"))
+    body = "username,email\n" + "user_x,x@example.com\n" * 100
+    response = client.post("/admin/users/import", content=body.encode())
+    assert response.status_code == 413
+
+    # 分块传输（不带 Content-Length）同样按读取的字节数拒绝
+    response = client.post("/admin/users/import", content=iter([body.encode()[:600], body.encode()[600:]]))
+    assert response.status_code == 413
+
+
+def test_invalid_import_file_returns_400(client):
+    response = client.post("/admin/users/import", content=b"name,phone\nalice,123\n")
+    assert response.status_code == 400
+    assert "缺少必需的列" in response.json()["detail"]